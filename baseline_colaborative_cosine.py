@@ -1,27 +1,52 @@
-import numpy as np
 import pandas as pd
-from scipy.spatial.distance import cosine
+import blocked_build
 import evaluation_utils
+import instrumentation
+import matrix_store
+import similarity_utils
+from neighbour_store import NeighbourStore
+from user_item_matrix import UserItemMatrix
 
 
 class CosineBaseline:
-    def __init__(self, user_item: pd.DataFrame, test_set: pd.DataFrame, movies_set: pd.DataFrame, k: int, n: int,
-                 sim_matrix_flag=0, sim_matrix_path="./generated_files/item_knn_sim.csv"):
+    def __init__(self, user_item, test_set: pd.DataFrame, movies_set: pd.DataFrame, k: int, n: int,
+                 sim_matrix_flag=0, sim_matrix_path="./generated_files/item_knn_sim.csv", sim_matrix_format="csv",
+                 k_max: int = None, neighbours_path="./generated_files/item_knn_neighbours.npz",
+                 memory_budget: int = None, build_workers: int = 1, sim_matrix_dtype="float32"):
         """
         Constructor of the class
-        :param user_item: user item matrix data frame
+        :param user_item: sparse user item matrix or dense user x item data frame
         :param test_set: test set
         :param movies_set: movies set
         :param k: number of neighbours
         :param n: number of recommendation items to return
         :param sim_matrix_flag: 1 to generate the similarity matrix from scratch, 0 to read from file path
         :param sim_matrix_path: path to file of the similarity matrix
+        :param sim_matrix_format: "csv" to store the similarity matrix as text or "bin" as a memory mapped binary file
+        :param k_max: number of neighbours kept per movie to use a neighbour store instead of the full matrix, None
+        to use the full matrix
+        :param neighbours_path: path to file of the neighbour store
+        :param memory_budget: maximum number of bytes of a tile to build the similarity model out of core, in tiles of
+        rows written to disk and resumable after a crash, None to build it in memory. It needs the bin format or k_max
+        :param build_workers: number of processes that build tiles at the same time
+        :param sim_matrix_dtype: type of the values of the bin format, "float32", "float16" or "uint8" for 8 bits fixed
+        point, see quantization_report to compare their rankings
         """
+        if not isinstance(user_item, UserItemMatrix):
+            user_item = UserItemMatrix.from_data_frame(user_item)
+
         self.user_item = user_item
         self.test_set = test_set
         self.movies_set = movies_set
         self.sim_matrix_flag = sim_matrix_flag
         self.sim_matrix_path = sim_matrix_path
+        self.sim_matrix_format = sim_matrix_format
+        self.k_max = k_max
+        self.neighbours_path = neighbours_path
+        self.memory_budget = memory_budget
+        self.build_workers = build_workers
+        self.sim_matrix_dtype = sim_matrix_dtype
+        self.sim_matrix = None
         self.k = k
         self.n = n
 
@@ -41,31 +66,64 @@ class CosineBaseline:
         """
         self.n = new_n
 
+    def __generate_similarity_matrix(self, movies_id: list):
+        """
+        Function that generates the item x item cosine similarity matrix
+        :param movies_id: list of all movie id on data set
+        :return: movie per movie similarity matrix where 1 means more proximity and 0 otherwise
+        """
+        return similarity_utils.cosine_similarity_matrix(self.user_item.item_matrix(movies_id), movies_id)
+
     def __get_similarity_matrix(self):
         """
-        Function that gets or generates the similarity matrix
-        :return: the similarity matrix with index and column
+        Function that returns the similarity matrix, it is loaded or generated only once for the life of the object
+        :return: the cached similarity matrix or neighbour store
+        """
+        if self.sim_matrix is None:
+            with instrumentation.span('cosine.similarity', flag=self.sim_matrix_flag, k_max=self.k_max):
+                self.sim_matrix = self.__load_similarity_matrix()
+
+        return self.sim_matrix
+
+    def __load_similarity_matrix(self):
+        """
+        Function that reads or generates the similarity matrix
+        :return: the similarity matrix with index and column, or the neighbour store in k_max mode
         """
         movies_id = self.movies_set['movie_id'].to_list()
         movies_id.sort()
 
-        if self.sim_matrix_flag == 1:
-            np.seterr(all='raise')
-            item_sim = pd.DataFrame(0, index=movies_id, columns=movies_id)
-            for i in range(0, len(movies_id)):
-                column1 = movies_id[i]
-                for j in range(i, len(movies_id)):
-                    column2 = movies_id[j]
-                    try:
-                        sim = 1 - cosine(self.user_item[column1].fillna(0), self.user_item[column2].fillna(0))
-                    except FloatingPointError:
-                        sim = 0
+        if self.k_max is not None:
+            if self.sim_matrix_flag == 1 and self.memory_budget is not None:
+                item_sim = blocked_build.build_neighbours("cosine", self.user_item.item_matrix(movies_id), movies_id,
+                                                          self.k_max, self.neighbours_path, self.memory_budget,
+                                                          self.build_workers)
+            elif self.sim_matrix_flag == 1:
+                item_sim = similarity_utils.cosine_neighbours(self.user_item.item_matrix(movies_id), movies_id,
+                                                              self.k_max)
+                item_sim.save(self.neighbours_path)
+            else:
+                item_sim = NeighbourStore.load(self.neighbours_path)
+
+        elif self.sim_matrix_flag == 1 and self.memory_budget is not None:
+            if self.sim_matrix_format != "bin":
+                raise ValueError("the blocked build writes the matrix in the bin format, set sim_matrix_format to bin "
+                                 "or use k_max")
+            blocked_build.build_similarity_matrix("cosine", self.user_item.item_matrix(movies_id), movies_id,
+                                                  self.sim_matrix_path, self.memory_budget, self.build_workers,
+                                                  self.sim_matrix_dtype)
+            item_sim = matrix_store.load_similarity_matrix(self.sim_matrix_path)
 
-                    item_sim.loc[column1, column2] = sim
-                    item_sim.loc[column2, column1] = sim
-                    print("sim: " + str(column1) + " / " + str(column2) + " = " + str(item_sim.loc[column1, column2]))
+        elif self.sim_matrix_flag == 1:
+            item_sim = self.__generate_similarity_matrix(movies_id)
+            if self.sim_matrix_format == "bin":
+                matrix_store.save_similarity_matrix(self.sim_matrix_path, item_sim, movies_id, self.sim_matrix_dtype)
+                item_sim = matrix_store.load_similarity_matrix(self.sim_matrix_path)
+            else:
+                item_sim.to_csv(self.sim_matrix_path, mode='w', header=False, index=False)
 
-            item_sim.to_csv(self.sim_matrix_path, mode='w', header=False, index=False)
+        elif self.sim_matrix_format == "bin":
+            item_sim = matrix_store.load_similarity_matrix(self.sim_matrix_path)
 
         else:
             item_sim = pd.read_csv(self.sim_matrix_path, header=None)
@@ -81,3 +139,28 @@ class CosineBaseline:
         """
         sim_matrix = self.__get_similarity_matrix()
         return evaluation_utils.generate_map(sim_matrix, self.test_set, self.user_item, self.n, self.k)
+
+    def generate_metrics(self, k_values: list, n_values: list, n_workers: int = 1):
+        """
+        Function that returns the MAP, precision, recall and nDCG of the recommendation algorithm for every pair of k
+        and n, calculated in a single pass over the users
+        :param k_values: numbers of neighbours
+        :param n_values: numbers of recommendation items
+        :param n_workers: number of processes of the evaluation
+        :return: data frame with the columns k, n, map, precision, recall, ndcg and users
+        """
+        sim_matrix = self.__get_similarity_matrix()
+        return evaluation_utils.generate_metrics(sim_matrix, self.test_set, self.user_item, k_values, n_values,
+                                                 n_workers)
+
+    def quantization_report(self, dtypes: list = ("float64", "float32", "float16", "uint8")):
+        """
+        Function that compares the top n lists and the MAP of the similarity matrix stored with each type of the bin
+        format against the float64 matrix
+        :param dtypes: types compared, see matrix_store.DTYPES
+        :return: data frame with one line per type, see evaluation_utils.quantization_report
+        """
+        movies_id = self.movies_set['movie_id'].to_list()
+        movies_id.sort()
+        reference = self.__generate_similarity_matrix(movies_id)
+        return evaluation_utils.quantization_report(reference, self.test_set, self.user_item, self.n, self.k, dtypes)
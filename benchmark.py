@@ -0,0 +1,170 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import scipy
+import evaluation_utils
+import explanations
+import recommendation_utils
+import similarity_utils
+import sparql_utils
+import synthetic_data
+from explanation_index import ExplanationIndex
+from movie_metadata import MovieMetadata
+from prop_vocabulary import PropVocabulary
+from user_item_matrix import UserItemMatrix
+
+
+# script that times every stage of the recommenders on synthetic data sets and writes the results as json
+
+
+def peak_rss_mb():
+    """
+    Function that returns the peak resident memory of the process
+    :return: peak resident set size in megabytes
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes and macos bytes
+    return rss / 1024 ** 2 if sys.platform == "darwin" else rss / 1024
+
+
+def time_stage(results: dict, name: str, items: int, function, *args, **kwargs):
+    """
+    Function that runs a stage and records its time, throughput and the peak memory of the process after it
+    :param results: dict that receives the measures of the stage
+    :param name: name of the stage
+    :param items: number of items the stage processes, e.g. movies or users, to calculate the throughput
+    :param function: function of the stage
+    :param args: positional arguments of the function
+    :param kwargs: keyword arguments of the function
+    :return: the value returned by the function
+    """
+    start = time.perf_counter()
+    value = function(*args, **kwargs)
+    seconds = time.perf_counter() - start
+
+    results[name] = {'seconds': seconds, 'items': items, 'throughput': items / seconds if seconds > 0 else None,
+                     'peak_rss_mb': peak_rss_mb()}
+    return value
+
+
+def run_scale(config: dict):
+    """
+    Function that generates a synthetic data set and times every stage on it
+    :param config: dict with the arguments of the run, see main
+    :return: dict with the data set sizes and the measures of every stage
+    """
+    movies_set, all_movie_props, train_set, test_set = synthetic_data.generate_data_set(
+        config['movies'], config['users'], config['props_per_movie'], config['interactions_per_user'],
+        seed=config['seed'])
+    movies_id = np.sort(movies_set['movie_id'].values)
+    test_users = test_set['user_id'].unique()
+    stages = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        props_path = os.path.join(directory, "all_movie_props.csv")
+        all_movie_props.to_csv(props_path, header=False, index=False)
+
+        def load_props():
+            movie_props = sparql_utils.get_all_movie_props(movies_set, 0, props_path)
+            return PropVocabulary.from_data_frame(movie_props, movies_id)
+
+        vocabulary = time_stage(stages, 'property_load', len(all_movie_props), load_props)
+
+    user_item = UserItemMatrix.from_interactions(train_set, movies_id, test_users)
+    sim_matrix = time_stage(stages, 'jaccard_build', len(movies_id), similarity_utils.jaccard_similarity_matrix,
+                            vocabulary, movies_id)
+    if config['k_max'] is not None:
+        time_stage(stages, 'jaccard_neighbours_build', len(movies_id), similarity_utils.jaccard_neighbours,
+                   vocabulary.incidence(), movies_id, config['k_max'])
+    time_stage(stages, 'cosine_build', len(movies_id), similarity_utils.cosine_similarity_matrix,
+               user_item.item_matrix(movies_id), movies_id)
+
+    def score_users():
+        profiles = recommendation_utils.profile_masks(user_item, test_users, movies_id)
+        scores = recommendation_utils.score_users(sim_matrix, profiles, config['k'])
+        return recommendation_utils.top_n(scores, profiles, config['n'])
+
+    positions, _ = time_stage(stages, 'user_scoring', len(test_users), score_users)
+    time_stage(stages, 'generate_map', len(test_users), evaluation_utils.generate_map, sim_matrix, test_set,
+               user_item, config['n'], config['k'], config['workers'])
+
+    explained = test_users[:config['explained_users']]
+    requests = [(user_id, user_item.profile(user_id), movies_id[positions[i][positions[i] >= 0]])
+                for i, user_id in enumerate(explained)]
+    index = ExplanationIndex(vocabulary, len(movies_id), MovieMetadata.from_vocabulary(vocabulary, movies_set))
+    time_stage(stages, 'explanations', sum(len(request[2]) for request in requests),
+               explanations.generate_batch_explanations, requests, index,
+               movies_set.set_index(movies_set['movie_id'].values), config['workers'])
+
+    return {'movies': len(movies_id), 'users': len(test_users), 'property_rows': len(all_movie_props),
+            'train_interactions': len(train_set), 'density': len(train_set) / (len(movies_id) * len(test_users)),
+            'stages': stages}
+
+
+def environment():
+    """
+    Function that describes the machine and the code of the run, so runs of different commits can be compared
+    :return: dict with the commit, the versions and the machine
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    return {'commit': commit, 'python': platform.python_version(), 'numpy': np.__version__,
+            'pandas': pd.__version__, 'scipy': scipy.__version__, 'machine': platform.machine(),
+            'system': platform.platform(), 'cpus': os.cpu_count()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Times the recommenders on synthetic data sets")
+    parser.add_argument("--movies", type=int, nargs="+", default=[500, 1000, 2000],
+                        help="number of movies of each scale of the scaling curve")
+    parser.add_argument("--users-per-movie", type=float, default=0.5, help="number of users per movie")
+    parser.add_argument("--props-per-movie", type=int, default=20, help="mean property rows per movie")
+    parser.add_argument("--interactions-per-user", type=int, default=20,
+                        help="mean interactions per user, sets the sparsity")
+    parser.add_argument("--k", type=int, default=5, help="number of neighbours")
+    parser.add_argument("--n", type=int, default=5, help="number of recommended items")
+    parser.add_argument("--k-max", type=int, default=None, help="also time the neighbour store build")
+    parser.add_argument("--workers", type=int, default=1, help="processes of generate_map and explanations")
+    parser.add_argument("--explained-users", type=int, default=100, help="users whose top n are explained")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="./results/benchmark.json", help="path of the json results")
+    args = parser.parse_args()
+
+    runs = []
+    for n_movies in args.movies:
+        config = {'movies': n_movies, 'users': max(1, int(n_movies * args.users_per_movie)),
+                  'props_per_movie': args.props_per_movie, 'interactions_per_user': args.interactions_per_user,
+                  'k': args.k, 'n': args.n, 'k_max': args.k_max, 'workers': args.workers,
+                  'explained_users': args.explained_users, 'seed': args.seed}
+
+        # every scale runs on a fresh process so its peak memory is not the one of a bigger previous scale
+        with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            run = executor.submit(run_scale, config).result()
+
+        runs.append(run)
+        print(json.dumps({'movies': run['movies'],
+                          'seconds': {stage: round(v['seconds'], 4) for stage, v in run['stages'].items()}}))
+
+    results = {'environment': environment(), 'arguments': vars(args), 'runs': runs}
+    if os.path.dirname(args.output):
+        os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
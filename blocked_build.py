@@ -0,0 +1,262 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import numpy as np
+from scipy import sparse
+import instrumentation
+import matrix_store
+import similarity_utils
+from neighbour_store import NeighbourStore, top_k_neighbours
+
+
+# utils functions lib to build similarity models out of core, in tiles of rows that fit in a memory budget. Every
+# finished tile is written to disk and marked as done, so a build that crashed starts again from the missing tiles
+
+# bytes of the intermediate arrays of one similarity, the sparse product, the unions and the float64 result
+BYTES_PER_SIMILARITY = 40
+MANIFEST = "manifest.json"
+
+
+def tile_rows(n_movies: int, memory_budget: int):
+    """
+    Function that returns the number of rows of a tile so its intermediate arrays fit in the memory budget
+    :param n_movies: number of movies of the matrix
+    :param memory_budget: maximum number of bytes used by a tile
+    :return: number of rows of every tile, at least one
+    """
+    return int(max(1, min(n_movies, memory_budget // (max(n_movies, 1) * BYTES_PER_SIMILARITY))))
+
+
+def similarity_source(kind: str, matrix: sparse.csr_matrix):
+    """
+    Function that prepares the matrix the rows of a similarity are calculated from
+    :param kind: "jaccard" for the movie x (prop, obj) incidence matrix or "cosine" for the users x movies
+    interactions
+    :param matrix: incidence or interactions matrix
+    :return: csr matrix read by similarity_rows
+    """
+    if kind == "jaccard":
+        return sparse.csr_matrix(matrix)
+    if kind == "cosine":
+        return similarity_utils.normalized_items(matrix)
+
+    raise ValueError("unknown similarity " + str(kind) + ", use jaccard or cosine")
+
+
+def similarity_rows(kind: str, source: sparse.csr_matrix, first_row: int, last_row: int):
+    """
+    Function that calculates a block of rows of a similarity matrix
+    :param kind: "jaccard" or "cosine"
+    :param source: matrix returned by similarity_source
+    :param first_row: position of the first row of the block
+    :param last_row: position after the last row of the block
+    :return: numpy array with the similarity of the rows against every movie
+    """
+    if kind == "jaccard":
+        return similarity_utils.jaccard_rows(source, first_row, last_row)
+
+    return similarity_utils.cosine_rows(source, first_row, last_row)
+
+
+def _fingerprint(source: sparse.csr_matrix, movies_id: np.ndarray):
+    """
+    Function that summarizes the input of a build, a build only resumes the tiles of a build with the same input
+    :param source: matrix returned by similarity_source
+    :param movies_id: sorted array of all movie id on data set
+    :return: hexadecimal sha1 of the movies and of the matrix
+    """
+    digest = hashlib.sha1()
+    for array in [np.asarray(movies_id, dtype=np.int64), source.indptr, source.indices, source.data]:
+        digest.update(np.ascontiguousarray(array).tobytes())
+
+    return digest.hexdigest()
+
+
+def _start_tiles(directory: str, manifest: dict):
+    """
+    Function that opens the directory of the tiles of a build, the tiles of a previous build are kept only when it had
+    the same manifest
+    :param directory: directory of the tiles
+    :param manifest: dict that describes the build
+    :return: True when the build resumes a previous one and False when it starts from scratch
+    """
+    manifest_path = os.path.join(directory, MANIFEST)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            if json.load(f) == manifest:
+                return True
+        shutil.rmtree(directory)
+
+    os.makedirs(directory, exist_ok=True)
+    with open(manifest_path + ".tmp", 'w') as f:
+        json.dump(manifest, f)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+    return False
+
+
+def _tile_path(directory: str, tile: int, extension: str):
+    """
+    Function that returns the path of the file of a tile
+    :param directory: directory of the tiles
+    :param tile: number of the tile
+    :param extension: extension of the file
+    :return: path of the file
+    """
+    return os.path.join(directory, "tile_" + str(tile).zfill(6) + extension)
+
+
+def _build_tile(task: tuple):
+    """
+    Function that calculates a tile and writes it, to the matrix file or to a file of top k neighbours, and then marks
+    it as done
+    :param task: tuple with the number of the tile and its first and last rows
+    :return: number of the tile
+    """
+    tile, first, last = task
+    state = _worker_state
+    rows = similarity_rows(state['kind'], state['source'], first, last)
+
+    if state['target'] == "matrix":
+        matrix_store.write_rows(state['file_path'], first, rows)
+        open(_tile_path(state['directory'], tile, ".done"), 'w').close()
+    else:
+        indices, scores = top_k_neighbours(rows, first, state['k_max'])
+        temporary = _tile_path(state['directory'], tile, ".tmp")
+        with open(temporary, 'wb') as f:
+            np.savez(f, indices=indices, scores=scores)
+        os.replace(temporary, _tile_path(state['directory'], tile, ".npz"))
+
+    return tile
+
+
+def _init_worker(state: dict):
+    """
+    Function that keeps the source matrix of the build once in every worker process
+    :param state: dict with the kind, source, target, directory, file_path and k_max of the build
+    :return: state of the worker set
+    """
+    _worker_state.update(state)
+
+
+_worker_state = {}
+
+
+def _run_tiles(state: dict, tasks: list, n_workers: int):
+    """
+    Function that builds the pending tiles, on this process or on a pool of processes
+    :param state: dict with the kind, source, target, directory, file_path and k_max of the build
+    :param tasks: tuples with the number, first and last rows of every pending tile
+    :param n_workers: number of processes
+    :return: tiles written and marked as done
+    """
+    if n_workers > 1 and len(tasks) > 1:
+        with multiprocessing.Pool(n_workers, initializer=_init_worker, initargs=(state,)) as pool:
+            for _ in pool.imap_unordered(_build_tile, tasks):
+                instrumentation.count('build.tiles')
+    else:
+        _init_worker(state)
+        for task in tasks:
+            _build_tile(task)
+            instrumentation.count('build.tiles')
+        _worker_state.clear()
+
+
+def _pending_tasks(directory: str, n_movies: int, rows: int, extension: str):
+    """
+    Function that lists the tiles that are not done yet
+    :param directory: directory of the tiles
+    :param n_movies: number of movies of the matrix
+    :param rows: number of rows of every tile
+    :param extension: extension of the file that marks a tile as done
+    :return: tuples with the number, first and last rows of every pending tile
+    """
+    tasks = [(tile, first, min(first + rows, n_movies)) for tile, first in enumerate(range(0, n_movies, rows))]
+    return [task for task in tasks if not os.path.exists(_tile_path(directory, task[0], extension))]
+
+
+def build_similarity_matrix(kind: str, matrix: sparse.csr_matrix, movies_id: list, file_path: str,
+                            memory_budget: int, n_workers: int = 1, dtype=np.float32):
+    """
+    Function that builds a full similarity matrix as a binary file without holding it in memory, the tiles of rows are
+    written straight to the memory mapped file. A build interrupted with the same input resumes from the missing
+    tiles
+    :param kind: "jaccard" for the movie x (prop, obj) incidence matrix or "cosine" for the users x movies
+    interactions
+    :param matrix: incidence or interactions matrix, with one movie of movies_id per row or column respectively
+    :param movies_id: sorted list of all movie id on data set
+    :param file_path: path of the binary file, its tiles are kept in file_path + ".tiles" until the build ends
+    :param memory_budget: maximum number of bytes used by a tile
+    :param n_workers: number of processes that build tiles at the same time, each one uses the memory budget
+    :param dtype: numpy type of the stored values
+    :return: path of the binary file written with the matrix, to open with matrix_store.load_similarity_matrix
+    """
+    movies_id = np.asarray(movies_id)
+    source = similarity_source(kind, matrix)
+    rows = tile_rows(len(movies_id), memory_budget)
+    directory = file_path + ".tiles"
+    manifest = {'kind': kind, 'target': "matrix", 'movies': len(movies_id), 'tile_rows': rows,
+                'dtype': np.dtype(dtype).str, 'input': _fingerprint(source, movies_id)}
+
+    with instrumentation.span('build.blocked_matrix', kind=kind, movies=len(movies_id), tile_rows=rows):
+        if not _start_tiles(directory, manifest) or not os.path.exists(file_path):
+            for name in os.listdir(directory):
+                if name != MANIFEST:
+                    os.remove(os.path.join(directory, name))
+            matrix_store.create_similarity_matrix(file_path, movies_id, dtype)
+
+        tasks = _pending_tasks(directory, len(movies_id), rows, ".done")
+        _run_tiles({'kind': kind, 'source': source, 'target': "matrix", 'directory': directory,
+                    'file_path': file_path, 'k_max': None}, tasks, n_workers)
+
+    shutil.rmtree(directory)
+
+    return file_path
+
+
+def build_neighbours(kind: str, matrix: sparse.csr_matrix, movies_id: list, k_max: int, file_path: str,
+                     memory_budget: int, n_workers: int = 1):
+    """
+    Function that builds the k_max neighbours of every movie in tiles of rows, every tile keeps its top k_max in a
+    file of its own and the store is assembled when all tiles are done. A build interrupted with the same input
+    resumes from the missing tiles
+    :param kind: "jaccard" for the movie x (prop, obj) incidence matrix or "cosine" for the users x movies
+    interactions
+    :param matrix: incidence or interactions matrix, with one movie of movies_id per row or column respectively
+    :param movies_id: sorted list of all movie id on data set
+    :param k_max: maximum number of neighbours kept per movie
+    :param file_path: path of the npz file of the store, its tiles are kept in file_path + ".tiles" until the build
+    ends
+    :param memory_budget: maximum number of bytes used by a tile
+    :param n_workers: number of processes that build tiles at the same time, each one uses the memory budget
+    :return: neighbour store with the k_max most similar movies of every movie, also saved to file_path
+    """
+    movies_id = np.asarray(movies_id)
+    n = len(movies_id)
+    k_max = min(k_max, max(n - 1, 1))
+    source = similarity_source(kind, matrix)
+    rows = tile_rows(n, memory_budget)
+    directory = file_path + ".tiles"
+    manifest = {'kind': kind, 'target': "neighbours", 'movies': n, 'tile_rows': rows, 'k_max': k_max,
+                'input': _fingerprint(source, movies_id)}
+
+    with instrumentation.span('build.blocked_neighbours', kind=kind, movies=n, tile_rows=rows):
+        _start_tiles(directory, manifest)
+        tasks = _pending_tasks(directory, n, rows, ".npz")
+        _run_tiles({'kind': kind, 'source': source, 'target': "neighbours", 'directory': directory,
+                    'file_path': file_path, 'k_max': k_max}, tasks, n_workers)
+
+        indices = np.empty((n, k_max), dtype=np.int32)
+        scores = np.empty((n, k_max), dtype=np.float32)
+        for tile, first in enumerate(range(0, n, rows)):
+            with np.load(_tile_path(directory, tile, ".npz")) as arrays:
+                indices[first:first + rows] = arrays['indices']
+                scores[first:first + rows] = arrays['scores']
+
+    store = NeighbourStore(movies_id, indices, scores)
+    store.save(file_path)
+    shutil.rmtree(directory)
+
+    return store
@@ -1,5 +1,12 @@
+import multiprocessing
+import os
+import tempfile
 import numpy as np
 import pandas as pd
+import instrumentation
+import matrix_store
+import recommendation_utils
+from neighbour_store import NeighbourStore
 
 
 def calculate_prediction(movie: int, profile: pd.DataFrame, sim_matrix: pd.DataFrame, k: int):
@@ -7,15 +14,19 @@ def calculate_prediction(movie: int, profile: pd.DataFrame, sim_matrix: pd.DataF
     Calculates the prediction of a user to like a movie
     :param movie: movie that the user may like
     :param profile: user profile with items interacted
-    :param sim_matrix: similarity matrix
+    :param sim_matrix: similarity matrix or neighbour store
     :param k: number of neighbors
     :return: sum os similarities that predicts if the user will like an item
     """
+    if isinstance(sim_matrix, NeighbourStore):
+        return sim_matrix.predict(movie, profile, k)
+
     curr_n = 0
     i = 1
     prediction = 0
 
-    similar_movies = sim_matrix.loc[movie].sort_values(ascending=False)
+    similar_movies = (sim_matrix.loc[movie].astype(np.float64) * matrix_store.similarity_scale(sim_matrix))
+    similar_movies = similar_movies.sort_values(ascending=False)
     while curr_n < k and i < len(similar_movies):
         neig_movie = similar_movies.index[i]
         if neig_movie in profile.index:
@@ -29,74 +40,307 @@ def calculate_prediction(movie: int, profile: pd.DataFrame, sim_matrix: pd.DataF
     return prediction
 
 
-def generate_map(sim_matrix: pd.DataFrame, test_set: pd.DataFrame, user_item: pd.DataFrame, n: int, k: int):
+def average_precision(recommended_movies: np.ndarray, test_user_movies: np.ndarray, len_rel: int):
+    """
+    Function that calculates the average precision of the recommendations of a user
+    :param recommended_movies: ranked movie ids recommended to the user
+    :param test_user_movies: movie ids of the user on the test set
+    :param len_rel: number of interactions of the user on the test set
+    :return: average precision of the user
+    """
+    hits = np.isin(recommended_movies, test_user_movies)
+    if not hits.any():
+        return 0
+
+    n_hits = np.cumsum(hits)
+    ap = (n_hits[hits] / (np.flatnonzero(hits) + 1)).sum()
+
+    return ap / len_rel
+
+
+def _evaluate_users(sim_matrix, profiles: np.ndarray, test_movies: list, movies_id: np.ndarray, n: int, k: int):
+    """
+    Function that calculates the average precision of a chunk of users
+    :param sim_matrix: item x item similarity matrix or neighbour store
+    :param profiles: users x movies boolean array of the profiles
+    :param test_movies: movie ids of each user on the test set
+    :param movies_id: sorted array of all movie id on data set
+    :param n: number of items recommended
+    :param k: number of neighbors considered
+    :return: array with the average precision of every user
+    """
+    if isinstance(sim_matrix, NeighbourStore):
+        # only the movies reachable from the profile through the reverse neighbours can score above zero
+        with instrumentation.span('evaluation.rank', users=len(profiles)):
+            profiles_pos = [np.flatnonzero(profile) for profile in profiles]
+            positions, _ = recommendation_utils.top_n_reachable(sim_matrix, profiles_pos, k, n)
+    else:
+        scores = recommendation_utils.score_users(sim_matrix, profiles, k)
+        with instrumentation.span('evaluation.rank', users=len(profiles)):
+            positions, _ = recommendation_utils.top_n(scores, profiles, n)
+
+    instrumentation.count('evaluation.users', len(profiles))
+    aps = np.zeros(len(profiles))
+    for i in range(0, len(profiles)):
+        recommended_movies = movies_id[positions[i][positions[i] >= 0]]
+        aps[i] = average_precision(recommended_movies, test_movies[i], len(test_movies[i]))
+
+    return aps
+
+
+def _evaluate_grid_users(sim_matrix, profiles: np.ndarray, test_movies: list, movies_id: np.ndarray,
+                         n_values: list, k_values: list):
     """
-    Function that calculates the map accuracy metric considering the sim_matrix generated by the method
-    :param sim_matrix: item x item similarity matrix
+    Function that calculates the average precision, precision, recall and ndcg of a chunk of users for every pair of
+    n and k, the users are scored once for all k and ranked once for the largest n
+    :param sim_matrix: item x item similarity matrix or neighbour store
+    :param profiles: users x movies boolean array of the profiles
+    :param test_movies: movie ids of each user on the test set
+    :param movies_id: sorted array of all movie id on data set
+    :param n_values: numbers of items recommended
+    :param k_values: numbers of neighbors considered
+    :return: users x k x n x 4 array with the average precision, precision, recall and ndcg of every user
+    """
+    scores = recommendation_utils.score_users_grid(sim_matrix, profiles, k_values)
+
+    len_rel = np.asarray([len(movies) for movies in test_movies])
+    cols = pd.Index(movies_id).get_indexer(np.concatenate(test_movies)) if len(test_movies) > 0 else []
+    rows = np.repeat(np.arange(len(test_movies)), len_rel)
+    relevant = np.zeros(profiles.shape, dtype=bool)
+    relevant[rows[cols >= 0], cols[cols >= 0]] = True
+
+    n_max = max(n_values)
+    discounts = 1 / np.log2(np.arange(2, n_max + 2))
+    ideal_dcg = np.cumsum(discounts)
+    metrics = np.zeros((len(profiles), len(k_values), len(n_values), 4))
+    for i in range(0, len(k_values)):
+        with instrumentation.span('evaluation.rank', users=len(profiles)):
+            positions, _ = recommendation_utils.top_n(scores[i], profiles, n_max)
+
+        hits = (positions >= 0) & np.take_along_axis(relevant, np.maximum(positions, 0), axis=1)
+        n_hits = np.cumsum(hits, axis=1)
+        precisions_sum = np.cumsum(hits * n_hits / np.arange(1, hits.shape[1] + 1), axis=1)
+        dcg = np.cumsum(hits * discounts[:hits.shape[1]], axis=1)
+
+        for j, n in enumerate(n_values):
+            last = min(n, hits.shape[1]) - 1
+            metrics[:, i, j, 0] = precisions_sum[:, last] / len_rel
+            metrics[:, i, j, 1] = n_hits[:, last] / n
+            metrics[:, i, j, 2] = n_hits[:, last] / len_rel
+            metrics[:, i, j, 3] = dcg[:, last] / ideal_dcg[np.minimum(len_rel, n) - 1]
+
+    instrumentation.count('evaluation.users', len(profiles))
+    return metrics
+
+
+def _init_worker(handle: tuple, profiles: np.ndarray, test_movies: list, evaluate, args: tuple,
+                 instrumented: bool):
+    """
+    Function that opens the shared similarity model once in every worker process
+    :param handle: handle of the model returned by matrix_store.share_similarity_model
+    :param profiles: users x movies boolean array of the profiles of all evaluated users
+    :param test_movies: movie ids of each evaluated user on the test set
+    :param evaluate: function that evaluates a chunk of users, _evaluate_users or _evaluate_grid_users
+    :param args: last arguments of the evaluate function, e.g. n and k
+    :param instrumented: True when the parent process records the instrumentation
+    :return: state of the worker set
+    """
+    instrumentation.enable(instrumented)
+    sim_matrix = matrix_store.open_shared_model(handle)
+    movies_id = sim_matrix.movies_id if isinstance(sim_matrix, NeighbourStore) else sim_matrix.index.values
+    _worker_state.update(sim_matrix=sim_matrix, profiles=profiles, test_movies=test_movies,
+                         movies_id=movies_id, evaluate=evaluate, args=args)
+
+
+def _evaluate_chunk(bounds: tuple):
+    """
+    Function that evaluates a chunk of the evaluated users in a worker process
+    :param bounds: first and last position of the chunk in the evaluated users
+    :return: array with the metrics of the users of the chunk and what the worker recorded
+    """
+    first, last = bounds
+    state = _worker_state
+    metrics = state['evaluate'](state['sim_matrix'], state['profiles'][first:last], state['test_movies'][first:last],
+                                state['movies_id'], *state['args'])
+    return metrics, instrumentation.snapshot()
+
+
+_worker_state = {}
+
+
+def _evaluate_test_users(sim_matrix, test_set: pd.DataFrame, user_item, evaluate, args: tuple, n_workers: int,
+                         n_users: int, seed: int, chunk_size: int):
+    """
+    Function that evaluates the users of the test set in fixed chunks, on this process or on a pool of processes
+    :param sim_matrix: item x item similarity matrix or neighbour store
     :param test_set: test set of data set
-    :param user_item: user x item matrix
+    :param user_item: sparse user item matrix or dense user x item data frame
+    :param evaluate: function that evaluates a chunk of users, _evaluate_users or _evaluate_grid_users
+    :param args: last arguments of the evaluate function, e.g. n and k
+    :param n_workers: number of processes, the similarity model is shared with them through memory maps
+    :param n_users: number of test users sampled for the evaluation, None to evaluate all of them
+    :param seed: seed of the sampling of users
+    :param chunk_size: number of users scored together
+    :return: tuple with the evaluated users and the array of their metrics, one line per user
+    """
+    test_set = test_set.set_index('user_id')
+    users = test_set.index.unique()
+    if n_users is not None and n_users < len(users):
+        users = np.sort(np.random.RandomState(seed).choice(users, n_users, replace=False))
+
+    movies_id = sim_matrix.movies_id if isinstance(sim_matrix, NeighbourStore) else sim_matrix.index.values
+    profiles = recommendation_utils.profile_masks(user_item, users, movies_id)
+    test_groups = test_set.groupby(level=0)['movie_id'].apply(np.asarray)
+    test_movies = [test_groups[user_id] for user_id in users]
+    chunks = [(first, min(first + chunk_size, len(users))) for first in range(0, len(users), chunk_size)]
+
+    if n_workers > 1:
+        with tempfile.TemporaryDirectory() as directory:
+            handle = matrix_store.share_similarity_model(sim_matrix, directory)
+            with multiprocessing.Pool(n_workers, initializer=_init_worker,
+                                      initargs=(handle, profiles, test_movies, evaluate, args,
+                                                instrumentation.enabled())) as pool:
+                results = pool.map(_evaluate_chunk, chunks)
+
+        metrics = [chunk_metrics for chunk_metrics, _ in results]
+        for _, recorded in results:
+            instrumentation.merge(recorded)
+    else:
+        metrics = [evaluate(sim_matrix, profiles[first:last], test_movies[first:last], movies_id, *args)
+                   for first, last in chunks]
+
+    return users, np.concatenate(metrics) if len(metrics) > 0 else np.zeros(0)
+
+
+def generate_map(sim_matrix: pd.DataFrame, test_set: pd.DataFrame, user_item, n: int, k: int,
+                 n_workers: int = 1, n_users: int = None, seed: int = 0, chunk_size: int = 64):
+    """
+    Function that calculates the map accuracy metric considering the sim_matrix generated by the method. Users are
+    scored in fixed chunks, so the result is the same for any number of workers
+    :param sim_matrix: item x item similarity matrix or neighbour store
+    :param test_set: test set of data set
+    :param user_item: sparse user item matrix or dense user x item data frame
     :param n: number of items recommended
     :param k: number of neighbors considered
+    :param n_workers: number of processes, the similarity model is shared with them through memory maps
+    :param n_users: number of test users sampled for the evaluation, None to evaluate all of them
+    :param seed: seed of the sampling of users
+    :param chunk_size: number of users scored together
     :return: float number that is the mean average precision of the recommendation engine
     """
-    test_set = test_set.set_index('user_id')
-    map_users = pd.DataFrame(index=test_set.index.unique(), columns=['map'])
+    with instrumentation.span('evaluation.generate_map', n=n, k=k, workers=n_workers):
+        users, aps = _evaluate_test_users(sim_matrix, test_set, user_item, _evaluate_users, (n, k), n_workers,
+                                          n_users, seed, chunk_size)
 
-    users = test_set.index.unique()[:300]
-    for user_id in users:
-        user_interactions = user_item.loc[user_id].sort_values()
+    map_users = pd.DataFrame({'map': aps}, index=users)
+    return map_users.mean()['map']
+
+
+def generate_metrics(sim_matrix, test_set: pd.DataFrame, user_item, k_values: list, n_values: list,
+                     n_workers: int = 1, n_users: int = None, seed: int = 0, chunk_size: int = 64):
+    """
+    Function that calculates the map, precision, recall and ndcg for every pair of k and n in a single pass over the
+    users, every user is scored once for all k and ranked once for the largest n. The map of a pair is the one of
+    generate_map with the same k and n
+    :param sim_matrix: item x item similarity matrix or neighbour store
+    :param test_set: test set of data set
+    :param user_item: sparse user item matrix or dense user x item data frame
+    :param k_values: numbers of neighbors considered
+    :param n_values: numbers of items recommended
+    :param n_workers: number of processes, the similarity model is shared with them through memory maps
+    :param n_users: number of test users sampled for the evaluation, None to evaluate all of them
+    :param seed: seed of the sampling of users
+    :param chunk_size: number of users scored together
+    :return: data frame with the columns k, n, map, precision, recall, ndcg and users, one line per pair of k and n
+    """
+    k_values = list(k_values)
+    n_values = list(n_values)
+    with instrumentation.span('evaluation.generate_metrics', k_values=len(k_values), n_values=len(n_values),
+                              workers=n_workers):
+        users, metrics = _evaluate_test_users(sim_matrix, test_set, user_item, _evaluate_grid_users,
+                                              (n_values, k_values), n_workers, n_users, seed, chunk_size)
+
+    means = metrics.mean(axis=0) if len(users) > 0 else np.zeros((len(k_values), len(n_values), 4))
+    k_grid, n_grid = np.meshgrid(k_values, n_values, indexing='ij')
+    results = pd.DataFrame({'k': k_grid.ravel(), 'n': n_grid.ravel()})
+    for i, metric in enumerate(['map', 'precision', 'recall', 'ndcg']):
+        results[metric] = means[:, :, i].ravel()
+    results['users'] = len(users)
 
-        profile = user_interactions[user_interactions == 1]
-        prediction = user_interactions[user_interactions.isnull()]
+    return results
 
-        for movie in prediction.index:
-            prediction.loc[movie] = calculate_prediction(movie, profile, sim_matrix, k)
 
-        prediction = prediction.sort_values(ascending=False)
-        recommended_movies = prediction[:n]
-        len_rel = len(test_set.loc[user_id])
-        n_hits = 0
-        ap = 0
+def quantization_report(sim_matrix: pd.DataFrame, test_set: pd.DataFrame, user_item, n: int, k: int,
+                        dtypes: list = ("float64", "float32", "float16", "uint8"), n_users: int = None, seed: int = 0):
+    """
+    Function that stores a similarity matrix with every type of the bin format and compares the top n lists and the
+    map of each stored matrix against the float64 matrix, to pick the smallest type that keeps the ranking
+    :param sim_matrix: item x item similarity matrix, the reference is its float64 copy
+    :param test_set: test set of data set
+    :param user_item: sparse user item matrix or dense user x item data frame
+    :param n: number of items recommended
+    :param k: number of neighbors considered
+    :param dtypes: types compared, see matrix_store.DTYPES
+    :param n_users: number of test users sampled for the comparison, None to compare all of them
+    :param seed: seed of the sampling of users
+    :return: data frame with the columns dtype, bytes_per_value, file_mb, max_error, same_top_n (fraction of users
+    with the same ranked list), top_n_overlap (mean fraction of the reference top n kept), map and map_difference
+    """
+    reference = matrix_store.dequantize(sim_matrix, np.float64)
+    movies_id = reference.index.values
+    users = test_set['user_id'].unique()
+    if n_users is not None and n_users < len(users):
+        users = np.sort(np.random.RandomState(seed).choice(users, n_users, replace=False))
 
-        test_user_movies = test_set.loc[user_id]['movie_id'].tolist()
+    profiles = recommendation_utils.profile_masks(user_item, users, movies_id)
+    reference_top, _ = recommendation_utils.top_n(recommendation_utils.score_users(reference, profiles, k), profiles, n)
+    reference_map = generate_map(reference, test_set, user_item, n, k, n_users=n_users, seed=seed)
+    reference_sizes = np.maximum((reference_top >= 0).sum(axis=1), 1)
 
-        if type(test_user_movies) != list:
-            test_user_movies = [test_user_movies]
+    report = []
+    with tempfile.TemporaryDirectory() as directory:
+        for dtype in dtypes:
+            file_path = os.path.join(directory, str(dtype) + ".bin")
+            matrix_store.save_similarity_matrix(file_path, reference, movies_id, dtype)
+            stored = matrix_store.load_similarity_matrix(file_path)
 
-        for rank in range(0, len(recommended_movies.index)):
-            movie = recommended_movies.index[rank]
-            if movie in test_user_movies:
-                n_hits = n_hits + 1
-                ap = ap + (n_hits / (rank + 1))
+            max_error = 0.0
+            for first in range(0, len(movies_id), 1024):
+                rows = matrix_store.dequantize(stored.iloc[first:first + 1024], np.float64).values
+                max_error = max(max_error, float(np.abs(rows - reference.values[first:first + 1024]).max(initial=0)))
 
-        if n_hits > 0:
-            u_ap = ap / len_rel
-        else:
-            u_ap = 0
+            top, _ = recommendation_utils.top_n(recommendation_utils.score_users(stored, profiles, k), profiles, n)
+            kept = np.array([np.isin(top[i][top[i] >= 0], reference_top[i]).sum() for i in range(0, len(users))])
+            stored_map = generate_map(stored, test_set, user_item, n, k, n_users=n_users, seed=seed)
 
-        print("user: " + str(user_id) + " AP: " + str(u_ap))
-        map_users.loc[user_id] = u_ap
+            report.append({'dtype': str(dtype), 'bytes_per_value': np.dtype(dtype).itemsize,
+                           'file_mb': os.path.getsize(file_path) / 2 ** 20, 'max_error': max_error,
+                           'same_top_n': float((top == reference_top).all(axis=1).mean()),
+                           'top_n_overlap': float((kept / reference_sizes).mean()), 'map': stored_map,
+                           'map_difference': stored_map - reference_map})
+            del stored
 
-    return map_users.mean()['map']
+    return pd.DataFrame(report)
 
 
-def generate_accuracy_results(recommender,
-                        k_values: list, file_path: str, name: str):
+def generate_accuracy_results(recommender, k_values: list, file_path: str, name: str, n_values: list = None,
+                              n_workers: int = 1):
     """
-    Compute map accuracy results for proposed and recommended
-    :param lod_rec: lod dbpedia recommender
-    :param baseline_rec: baseline cosine recommender
+    Compute the accuracy results of a recommender for every pair of k and n in a single pass over the users
+    :param recommender: recommender with a generate_metrics function, e.g. the lod or the baseline recommender
     :param k_values: vector of k params to test
-    :return: file with results
+    :param file_path: path of the csv file with the results
+    :param name: name of the algorithm
+    :param n_values: vector of n params to test, None for the n of the recommender
+    :param n_workers: number of processes of the evaluation
+    :return: data frame with the columns algorithm, k, n, map, precision, recall, ndcg and users, also written to the
+    csv file
     """
-    f = open(file_path, "w")
-    f.write(name + ":\n")
-    for k in k_values:
-        print("--- K = " + str(k) + " ---")
-        f.write("--- K = " + str(k) + " ---\n")
-
-        recommender.set_k(k)
+    n_values = [recommender.n] if n_values is None else n_values
+    with instrumentation.span('evaluation.accuracy', k_values=len(k_values), n_values=len(n_values)):
+        results = recommender.generate_metrics(k_values, n_values, n_workers)
 
-        f.write("Algorithm MAP: " + str(recommender.generate_map()))
+    results.insert(0, 'algorithm', name)
+    results.to_csv(file_path, index=False)
 
-    f.close()
\ No newline at end of file
+    return results
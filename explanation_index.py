@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from prop_vocabulary import PropVocabulary
+from movie_metadata import MovieMetadata
+
+
+# A class that precomputes, once per model, the tables the explanations read for every user
+class ExplanationIndex:
+
+    def __init__(self, vocabulary: PropVocabulary, number_documents: int, metadata: MovieMetadata = None,
+                 idf: np.ndarray = None, pair_movies: sparse.csr_matrix = None):
+        """
+        Constructor of the class
+        :param vocabulary: interned properties of all movies
+        :param number_documents: number of movies in data set
+        :param metadata: names of the movies, None to build them on the first explanation
+        :param idf: idf of every object already calculated, e.g. read from a model artifact, None to calculate it
+        :param pair_movies: inverted index already built with sorted indices, None to build it
+        """
+        self.vocabulary = vocabulary
+        self.number_documents = number_documents
+        self.metadata = metadata
+
+        # idf of every object, counted over the property rows as in the ExpLOD framework
+        if idf is None:
+            with np.errstate(divide='ignore'):
+                idf = np.log(number_documents / vocabulary.obj_rows)
+        self.idf = idf
+
+        # inverted index from every (prop, obj) pair to the positions of the movies that have it
+        if pair_movies is None:
+            pair_movies = vocabulary.incidence().T.tocsr()
+            pair_movies.sort_indices()
+        self.pair_movies = pair_movies
+
+    def profile_graph(self, rec_movie_id: int, profile_id: list):
+        """
+        Function that finds all the properties the profile movies share with a recommended movie, reading on the
+        inverted index only the pairs of the recommended movie
+        :param rec_movie_id: recommended movie id
+        :param profile_id: movies the user interacted with
+        :return: data frame with the columns movie_id, prop, obj_id and pair_id of every shared property, indexed by
+        obj, in the order of the profile
+        """
+        rec_pairs = self.vocabulary.movie_pairs(rec_movie_id)
+        profile_id = np.asarray(profile_id)
+        profile_pos = self.vocabulary.positions.reindex(profile_id).values
+        known = ~np.isnan(profile_pos)
+
+        shared = self.pair_movies[rec_pairs][:, profile_pos[known].astype(np.int64)].tocoo()
+        order = np.lexsort((shared.row, shared.col))
+        pairs = rec_pairs[shared.row[order]]
+        props, objs = self.vocabulary.pair_strings(pairs)
+
+        graph = pd.DataFrame({'movie_id': profile_id[known][shared.col[order]], 'prop': props, 'obj': objs,
+                              'obj_id': self.vocabulary.pair_obj[pairs], 'pair_id': pairs})
+        return graph.set_index('obj')
+
+    def prop_scores(self, graph: pd.DataFrame, profile_size: int):
+        """
+        Function that scores every object of a graph with the number of profile movies connected through it times
+        its idf
+        :param graph: graph returned by profile_graph
+        :param profile_size: number of movies the user interacted with
+        :return: data frame indexed by obj with the columns prop, the first property of the object on the graph, ncip,
+        the number of connections through the object, idf and score
+        """
+        groups = graph.groupby(level=0, sort=False)
+        ncip = groups.size()
+        idf = self.idf[groups['obj_id'].first().values]
+
+        return pd.DataFrame({'prop': groups['prop'].first(), 'ncip': ncip, 'idf': idf,
+                             'score': ncip / profile_size * idf})
@@ -1,27 +1,43 @@
+import multiprocessing
 import numpy as np
 import pandas as pd
+import instrumentation
 import sparql_utils
+from prop_vocabulary import PropVocabulary
+from explanation_index import ExplanationIndex
+from movie_metadata import MovieMetadata
 import re
-import math
 
 
 class Explanations:
 
     def __init__(self, profile: pd.DataFrame, recommended: pd.DataFrame,
-                 movie_props: pd.DataFrame, movies_set: pd.DataFrame, number_documents: int):
+                 movie_props, movies_set: pd.DataFrame, number_documents: int, cache: dict = None):
         """
         Constructor of class explanations
         :param profile: items that the user interacted
         :param recommended: recommended movies
-        :param movie_props: movies properties
+        :param movie_props: movies properties, as a data frame, a prop vocabulary or an explanation index to share it
+        between users
         :param movies_set: set of movies in data set
         :param number_documents: number of movies in data_set
+        :param cache: memo of the explanations shared by many users, None to not memoize
         """
+        if isinstance(movie_props, pd.DataFrame):
+            movie_props = PropVocabulary.from_data_frame(movie_props, np.sort(movies_set['movie_id'].values))
+        if isinstance(movie_props, PropVocabulary):
+            movie_props = ExplanationIndex(movie_props, number_documents)
+        if movie_props.metadata is None:
+            movie_props.metadata = MovieMetadata.from_vocabulary(movie_props.vocabulary, movies_set)
+
         self.profile = profile
         self.recommended = recommended
-        self.movie_props = movie_props
+        self.index = movie_props
+        self.movie_props = movie_props.vocabulary
+        self.metadata = movie_props.metadata
         self.movies_set = movies_set
         self.number_documents = number_documents
+        self.cache = cache
 
     def __get_profile_recommended_graph(self, rec_movie_id: int):
         """
@@ -29,21 +45,7 @@ class Explanations:
         :param rec_movie_id: recommended movie id
         :return: union of intersection between each of the profile movies, with the recommended one
         """
-        cols = ['movie_id', 'prop', 'obj']
-        graph = pd.DataFrame(columns=cols)
-
-        rec_movie_props_l = sparql_utils.movie_props_tolist(rec_movie_id, self.movie_props)
-
-        for i in range(0, len(self.profile.index)):
-            pro_movie = self.profile.index[i]
-            pro_movie_props_l = sparql_utils.movie_props_tolist(pro_movie, self.movie_props)
-
-            intersection = pd.Series(list(set(rec_movie_props_l).intersection(set(pro_movie_props_l))), dtype=str)
-            for tuples in intersection.values:
-                graph = graph.append({cols[0]: pro_movie, cols[1]: tuples[0], cols[2]: tuples[1]}, ignore_index=True)
-
-        graph = graph.set_index(cols[2])
-        return graph
+        return self.index.profile_graph(rec_movie_id, self.profile.index.values)
 
     def __generate_score(self, graph: pd.DataFrame):
         """
@@ -56,21 +58,10 @@ class Explanations:
         :param graph: of connections between the profile movies to the recommended
         :return: the property with the best score
         """
-        prop_scores = pd.DataFrame(index=graph.index.unique(), columns=['prop', 'score'])
-        for obj in graph.index.unique():
-            ncip = len(graph.loc[obj])
-            count_d = self.movie_props['obj'].value_counts()[obj]
-            idf = math.log(self.number_documents / count_d)
-            score = (ncip / len(self.profile)) * idf
-            try:
-                rel = graph.loc[obj]['prop'].unique()[0]
-            except AttributeError:
-                rel = graph.loc[obj]['prop']
-
-            prop_scores.loc[obj] = [rel, score]
+        prop_scores = self.index.prop_scores(graph, len(self.profile))
 
         # return properties with max score
-        return prop_scores.loc[prop_scores['score'] == prop_scores.max()[1]]
+        return prop_scores.loc[prop_scores['score'] == prop_scores['score'].max()]
 
     def __get_value_of_uri(self, property: str):
         """
@@ -134,14 +125,14 @@ class Explanations:
             if type(movies_id) == pd.Series:
                 count = 0
                 for movie_id in movies_id.iteritems():
-                    movie_name = sparql_utils.get_movie_name(self.movie_props, self.movies_set, movie_id[1])
+                    movie_name = sparql_utils.get_movie_name(self.metadata, self.movies_set, movie_id[1])
                     if count != len(movies_id) - 1:
                         sentence = sentence + "\"" + movie_name + "\", "
                     else:
                         sentence = sentence[:-2] + " and \"" + movie_name + "\""
                     count = count + 1
             else:
-                movie_name = "\"" + sparql_utils.get_movie_name(self.movie_props, self.movies_set, movies_id) + "\""
+                movie_name = "\"" + sparql_utils.get_movie_name(self.metadata, self.movies_set, movies_id) + "\""
                 sentence = sentence + movie_name
 
             explanations.append(sentence)
@@ -156,28 +147,151 @@ class Explanations:
                     explanation_sentence = explanation_sentence[:-2] + " and " + explanations[i]
 
             explanation_sentence = explanation_sentence + " watch \"" + \
-                                   sparql_utils.get_movie_name(self.movie_props, self.movies_set,
+                                   sparql_utils.get_movie_name(self.metadata, self.movies_set,
                                                                movie) + "\" with these same characteristics"
 
         else:
             explanation_sentence = explanations[0] + explanations[1]
 
             explanation_sentence = explanation_sentence + " watch \"" + \
-                                   sparql_utils.get_movie_name(self.movie_props, self.movies_set,
+                                   sparql_utils.get_movie_name(self.metadata, self.movies_set,
                                                                movie) + "\" with this same characteristic"
 
         return explanation_sentence
 
+    def explain(self, movie: int):
+        """
+        Generate the structured explanation of a recommendation. Everything but the score only depends on the
+        recommended movie and on the properties the profile shares with it, so it is memoized on the cache with that
+        key and reused by every user with the same shared properties
+        :param movie: movie id of the recommended one
+        :return: dict with the sentence, the prop and obj of the best scored property, its score and the profile
+        movies connected through the best scored properties, the sentence is None when no property is shared
+        """
+        with instrumentation.span('explanations.graph'):
+            graph = self.__get_profile_recommended_graph(movie)
+        key = (movie, tuple(graph['movie_id']), tuple(graph['pair_id']))
+
+        explanation = self.cache.get(key) if self.cache is not None else None
+        instrumentation.count('explanations.generated')
+        instrumentation.count('explanations.cache_hits' if explanation is not None else 'explanations.cache_misses')
+        if explanation is None:
+            if len(graph) == 0:
+                explanation = {'sentence': None, 'prop': None, 'obj': None, 'ncip': 0, 'idf': 0.0,
+                               'profile_movies': []}
+            else:
+                with instrumentation.span('explanations.score'):
+                    most_relevant_prop = self.__generate_score(graph)
+                best = most_relevant_prop.iloc[0]
+                with instrumentation.span('explanations.sentence'):
+                    sentence = self.__generate_sentence(graph, most_relevant_prop, movie)
+                explanation = {'sentence': sentence,
+                               'prop': best['prop'], 'obj': most_relevant_prop.index[0], 'ncip': best['ncip'],
+                               'idf': best['idf'],
+                               'profile_movies': graph.loc[most_relevant_prop.index, 'movie_id'].unique().tolist()}
+
+            if self.cache is not None:
+                self.cache[key] = explanation
+
+        score = explanation['ncip'] / len(self.profile) * explanation['idf'] if explanation['ncip'] > 0 else 0.0
+        return {'sentence': explanation['sentence'], 'prop': explanation['prop'], 'obj': explanation['obj'],
+                'score': score, 'profile_movies': explanation['profile_movies']}
+
     def generate_explanations(self):
         """
         Generate an explanation for every recommendation
-        :return: all the explanations printed
+        :return: data frame indexed by the recommended movies with the columns sentence, prop, obj, score and
+        profile_movies of each explanation
         """
-        explanation = pd.DataFrame(index=self.recommended.index, columns=['sentence'])
-        for movie in self.recommended.index:
-            profile_recommended_graph = self.__get_profile_recommended_graph(movie)
-            most_relevant_prop = self.__generate_score(profile_recommended_graph)
-            explanation.loc[movie] = self.__generate_sentence(profile_recommended_graph, most_relevant_prop, movie)
-
-        for movie in self.recommended.index:
-            print(explanation.loc[movie]['sentence'])
+        explanation = [self.explain(movie) for movie in self.recommended.index]
+        return pd.DataFrame(explanation, index=self.recommended.index,
+                            columns=['sentence', 'prop', 'obj', 'score', 'profile_movies'])
+
+
+def _explain_users(index: ExplanationIndex, movies_set: pd.DataFrame, requests: list, cache: dict):
+    """
+    Function that explains the recommendations of some users
+    :param index: explanation index of the properties
+    :param movies_set: set of movies in data set
+    :param requests: list of tuples with the user id, the profile movies and the recommended movies of each user
+    :param cache: memo of the explanations shared by the users
+    :return: data frame with one line per recommendation
+    """
+    explanations = []
+    for user_id, profile, recommended in requests:
+        user_explanations = Explanations(pd.Series(1, index=profile), pd.Series(1, index=recommended), index,
+                                         movies_set, index.number_documents, cache).generate_explanations()
+        user_explanations.insert(0, 'movie_id', user_explanations.index.values)
+        user_explanations.insert(0, 'user_id', user_id)
+        explanations.append(user_explanations)
+
+    return pd.concat(explanations, ignore_index=True) if len(explanations) > 0 else \
+        pd.DataFrame(columns=['user_id', 'movie_id', 'sentence', 'prop', 'obj', 'score', 'profile_movies'])
+
+
+def _init_worker(index: ExplanationIndex, movies_set: pd.DataFrame, instrumented: bool):
+    """
+    Function that receives the explanation index once per worker process, each worker keeps its own memo
+    :param index: explanation index of the properties
+    :param movies_set: set of movies in data set
+    :param instrumented: True when the parent process records the instrumentation
+    :return: worker state initialized
+    """
+    instrumentation.enable(instrumented)
+    _worker_state['index'] = index
+    _worker_state['movies_set'] = movies_set
+    _worker_state['cache'] = {}
+
+
+def _explain_chunk(requests: list):
+    """
+    Function that explains a chunk of users on a worker process
+    :param requests: list of tuples with the user id, the profile movies and the recommended movies of each user
+    :return: data frame with one line per recommendation and what the worker recorded
+    """
+    explanations = _explain_users(_worker_state['index'], _worker_state['movies_set'], requests,
+                                  _worker_state['cache'])
+    return explanations, instrumentation.snapshot()
+
+
+_worker_state = {}
+
+
+def generate_batch_explanations(requests, movie_props, movies_set: pd.DataFrame, n_workers: int = 1,
+                                chunk_size: int = 64, cache: dict = None):
+    """
+    Function that explains the recommendations of many users, explanations are memoized per recommended movie and
+    shared properties because popular recommendations recur across users
+    :param requests: iterable of tuples with the user id, the profile movies and the recommended movies of each user
+    :param movie_props: movies properties, as a data frame, a prop vocabulary or an explanation index
+    :param movies_set: set of movies in data set
+    :param n_workers: number of processes, each receives the index once
+    :param chunk_size: number of users explained per task
+    :param cache: memo to reuse between calls when there is a single worker, None for a new one
+    :return: data frame with the columns user_id, movie_id, sentence, prop, obj, score and profile_movies, one line
+    per recommendation
+    """
+    if isinstance(movie_props, pd.DataFrame):
+        movie_props = PropVocabulary.from_data_frame(movie_props, np.sort(movies_set['movie_id'].values))
+    if isinstance(movie_props, PropVocabulary):
+        movie_props = ExplanationIndex(movie_props, len(movie_props.movies_id),
+                                       MovieMetadata.from_vocabulary(movie_props, movies_set))
+
+    requests = list(requests)
+    chunks = [requests[first:first + chunk_size] for first in range(0, len(requests), chunk_size)]
+
+    with instrumentation.span('explanations.batch', users=len(requests), workers=n_workers):
+        if n_workers > 1:
+            with multiprocessing.Pool(n_workers, initializer=_init_worker,
+                                      initargs=(movie_props, movies_set, instrumentation.enabled())) as pool:
+                results = pool.map(_explain_chunk, chunks)
+
+            explanations = [chunk_explanations for chunk_explanations, _ in results]
+            for _, recorded in results:
+                instrumentation.merge(recorded)
+        else:
+            cache = {} if cache is None else cache
+            explanations = [_explain_users(movie_props, movies_set, chunk, cache) for chunk in chunks]
+
+    return pd.concat(explanations, ignore_index=True) if len(explanations) > 0 else \
+        _explain_users(movie_props, movies_set, [], {})
@@ -0,0 +1,197 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+import pandas as pd
+
+
+# utils functions lib to record timing spans, counters and events of the pipeline. Everything is off by default and
+# a disabled call only checks a flag, so the instrumentation stays in the code at almost no cost
+
+_state = {'enabled': False, 'spans': [], 'counters': {}, 'events': []}
+_lock = threading.Lock()
+
+
+class _NullSpan:
+    """
+    Span returned while the instrumentation is disabled, it does nothing
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def enable(flag: bool = True):
+    """
+    Function that turns the instrumentation on or off, what was already recorded is kept
+    :param flag: True to record and False to stop recording
+    :return: instrumentation turned on or off
+    """
+    _state['enabled'] = flag
+
+
+def enabled():
+    """
+    Function that tells if the instrumentation is recording
+    :return: True when recording
+    """
+    return _state['enabled']
+
+
+def reset():
+    """
+    Function that discards everything recorded
+    :return: spans, counters and events cleared
+    """
+    with _lock:
+        _state['spans'] = []
+        _state['counters'] = {}
+        _state['events'] = []
+
+
+@contextmanager
+def _record_span(name: str, fields: dict):
+    """
+    Function that times the block of a span and records it
+    :param name: name of the stage
+    :param fields: extra values recorded with the span
+    :return: context manager of the span
+    """
+    start = time.perf_counter()
+    started_at = time.time()
+    try:
+        yield
+    finally:
+        span = {'name': name, 'started_at': started_at, 'seconds': time.perf_counter() - start, 'pid': os.getpid()}
+        span.update(fields)
+        with _lock:
+            _state['spans'].append(span)
+
+
+def span(name: str, **fields):
+    """
+    Function that times a stage, to be used as a context manager
+    :param name: name of the stage, e.g. lod.similarity_build
+    :param fields: extra values recorded with the span, e.g. the number of users
+    :return: context manager that records the span when the instrumentation is enabled
+    """
+    if not _state['enabled']:
+        return _NULL_SPAN
+
+    return _record_span(name, fields)
+
+
+def count(name: str, value: int = 1):
+    """
+    Function that adds a value to a counter
+    :param name: name of the counter, e.g. sparql.requests
+    :param value: value added
+    :return: counter incremented when the instrumentation is enabled
+    """
+    if not _state['enabled']:
+        return
+
+    with _lock:
+        _state['counters'][name] = _state['counters'].get(name, 0) + value
+
+
+def event(name: str, **fields):
+    """
+    Function that records a structured log line, used instead of progress prints
+    :param name: name of the event, e.g. sparql.batch_done
+    :param fields: values of the event
+    :return: event recorded when the instrumentation is enabled
+    """
+    if not _state['enabled']:
+        return
+
+    line = {'name': name, 'at': time.time(), 'pid': os.getpid()}
+    line.update(fields)
+    with _lock:
+        _state['events'].append(line)
+
+
+def snapshot():
+    """
+    Function that copies and clears what was recorded, used by worker processes to send it to the parent
+    :return: dict with the spans, counters and events recorded
+    """
+    with _lock:
+        recorded = {'spans': _state['spans'], 'counters': _state['counters'], 'events': _state['events']}
+        _state['spans'] = []
+        _state['counters'] = {}
+        _state['events'] = []
+
+    return recorded
+
+
+def merge(recorded: dict):
+    """
+    Function that adds what another process recorded to this process
+    :param recorded: dict returned by snapshot
+    :return: spans, events and counters merged
+    """
+    with _lock:
+        _state['spans'].extend(recorded['spans'])
+        _state['events'].extend(recorded['events'])
+        for name, value in recorded['counters'].items():
+            _state['counters'][name] = _state['counters'].get(name, 0) + value
+
+
+def counters():
+    """
+    Function that returns the counters
+    :return: dict with the value of every counter
+    """
+    with _lock:
+        return dict(_state['counters'])
+
+
+def summary():
+    """
+    Function that summarizes the spans per stage
+    :return: data frame indexed by stage with the columns calls, total_seconds, mean_seconds and max_seconds, sorted
+    by total time
+    """
+    with _lock:
+        spans = pd.DataFrame(_state['spans'], columns=['name', 'seconds'])
+
+    stages = spans.groupby('name')['seconds'].agg(['count', 'sum', 'mean', 'max'])
+    stages.columns = ['calls', 'total_seconds', 'mean_seconds', 'max_seconds']
+    stages.index.name = 'stage'
+
+    return stages.sort_values('total_seconds', ascending=False)
+
+
+def summary_table():
+    """
+    Function that formats the spans and counters as text, to print at the end of a run
+    :return: string with the table of stages followed by the counters
+    """
+    table = summary().to_string(float_format=lambda value: "%.4f" % value)
+    lines = [name + ": " + str(value) for name, value in sorted(counters().items())]
+
+    return table + "\n" + "\n".join(lines)
+
+
+def export_logs(file_path: str):
+    """
+    Function that writes everything recorded as json lines, one per span and event plus one line with the counters
+    :param file_path: path of the file
+    :return: file with the structured logs
+    """
+    with _lock:
+        lines = [dict(record, type='span') for record in _state['spans']]
+        lines += [dict(record, type='event') for record in _state['events']]
+        lines.append({'type': 'counters', 'counters': dict(_state['counters'])})
+
+    with open(file_path, 'w') as f:
+        for line in lines:
+            f.write(json.dumps(line, default=str) + "\n")
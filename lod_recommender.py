@@ -2,19 +2,34 @@ import numpy as np
 import pandas as pd
 import sparql_utils
 import evaluation_utils
+import recommendation_utils
+import matrix_store
+import similarity_utils
+import blocked_build
+import model_artifact
+from minhash_lsh import MinHashLSH
+from neighbour_store import NeighbourStore
+from prop_vocabulary import PropVocabulary
+from movie_metadata import MovieMetadata
+from explanation_index import ExplanationIndex
+from user_item_matrix import UserItemMatrix
+from model_artifact import ModelArtifact
 import explanations
+import instrumentation
 
 
 # A class that generates recomendations and explanations based on dbpedia
 class JacLodRecommendationEngine:
 
-    def __init__(self, user_item: pd.DataFrame, movies_set: pd.DataFrame, test_set: pd.DataFrame,
+    def __init__(self, user_item, movies_set: pd.DataFrame, test_set: pd.DataFrame,
                  k: int, n: int, explanation_flag: int, sim_matrix_flag: int,
-                 sim_matrix_path="./generated_files/sim_matrix.csv",
-                 all_props_path="./generated_files/all_movie_props.csv"):
+                 sim_matrix_path="./generated_files/sim_matrix.csv", sim_matrix_format="csv",
+                 all_props_path="./generated_files/all_movie_props.csv", lsh_index: MinHashLSH = None,
+                 k_max: int = None, neighbours_path="./generated_files/sim_neighbours.npz", memory_budget: int = None,
+                 build_workers: int = 1, sim_matrix_dtype="float32", model: ModelArtifact = None):
         """
         Constructor of the class
-        :param user_item: user item matrix
+        :param user_item: sparse user item matrix or dense user x item data frame
         :param movies_set: movies data frame with two columns for movie id and movie dbpedia uri
         :param test_set: test data frame with interactions to predict
         :param k: number of neighbours
@@ -22,9 +37,24 @@ class JacLodRecommendationEngine:
         :param explanation_flag: 1 to generate explanations and 0 otherwise
         :param sim_matrix_flag: 1 to generate the similarity matrix from scratch, 0 to read from file path
         :param sim_matrix_path: path to file of the similarity matrix
+        :param sim_matrix_format: "csv" to store the similarity matrix as text or "bin" as a memory mapped binary file
         :param all_props_path: path to file with all properties
+        :param lsh_index: MinHash LSH index to use approximate neighbours instead of the exact similarity matrix
+        :param k_max: number of neighbours kept per movie to use a neighbour store instead of the full matrix, None
+        to use the full matrix
+        :param neighbours_path: path to file of the neighbour store
+        :param memory_budget: maximum number of bytes of a tile to build the similarity model out of core, in tiles of
+        rows written to disk and resumable after a crash, None to build it in memory. It needs the bin format or k_max
+        :param build_workers: number of processes that build tiles at the same time
+        :param sim_matrix_dtype: type of the values of the bin format, "float32", "float16" or "uint8" for 8 bits fixed
+        point, see quantization_report to compare their rankings
+        :param model: model artifact the similarity, properties, names and explanation tables are read from, on their
+        first use, instead of the files, see load_model
         """
 
+        if not isinstance(user_item, UserItemMatrix):
+            user_item = UserItemMatrix.from_data_frame(user_item)
+
         self.user_item = user_item
         self.test_set = test_set
         self.movies_set = movies_set.set_index(movies_set['movie_id'].values)
@@ -33,7 +63,20 @@ class JacLodRecommendationEngine:
         self.explanation_flag = explanation_flag
         self.sim_matrix_flag = sim_matrix_flag
         self.sim_matrix_path = sim_matrix_path
+        self.sim_matrix_format = sim_matrix_format
         self.all_props_path = all_props_path
+        self.lsh_index = lsh_index
+        self.k_max = k_max
+        self.neighbours_path = neighbours_path
+        self.memory_budget = memory_budget
+        self.build_workers = build_workers
+        self.sim_matrix_dtype = sim_matrix_dtype
+        self.model = model
+        self.sim_matrix = None
+        self.vocabulary = None
+        self.metadata = None
+        self.explanation_index = None
+        self.explanation_cache = {}
 
     def set_k(self, new_k: int):
         """
@@ -51,66 +94,126 @@ class JacLodRecommendationEngine:
         """
         self.n = new_n
 
-    def __calculate_jaccard(self,  movie1_id: int, props_m1: list, movie2_id: int, props_m2: list):
+    def __generate_similarity_matrix(self, movies_id: list):
         """
-        Function that calculates the jaccard similarity of two movies, if they are the same return 1
-        :param movie1_id: movie_id of movie 1
-        :param props_m1: list of tuples with the properties of movie 1
-        :param movie2_id: list of tuples of movie 2
-        :param props_m2: data frame with the properties of movie 2
-        :return: jaccard similarity between the two lists
+        Function that generates the similarity matrix
+        :param movies_id: list of all movie id on data set
+        :return: movie per movie similarity matrix where 1 means more proximity and 0 otherwise
         """
 
-        if movie1_id == movie2_id:
-            return 1
+        return similarity_utils.jaccard_similarity_matrix(self.__get_vocabulary(self.sim_matrix_flag), movies_id)
 
-        intersection = pd.Series(list(set(props_m1).intersection(set(props_m2))), dtype=str)
-        union = pd.Series(list(set(props_m1).union(set(props_m2))), dtype=str)
+    def __get_vocabulary(self, flag: int = 0):
+        """
+        Function that returns the interned properties of all movies, they are read only once for the life of the
+        object unless the properties are generated again
+        :param flag: 1 to generate the properties from dbpedia and 0 to read them from file
+        :return: the cached prop vocabulary
+        """
+        if self.vocabulary is None or flag == 1:
+            if flag == 0 and self.model is not None and self.model.has_component('vocabulary'):
+                self.vocabulary = self.model.vocabulary()
+            else:
+                movies_id = self.movies_set['movie_id'].to_list()
+                movies_id.sort()
+                movies_props = sparql_utils.get_all_movie_props(self.movies_set, flag, self.all_props_path)
+                with instrumentation.span('lod.vocabulary', movies=len(movies_id)):
+                    self.vocabulary = PropVocabulary.from_data_frame(movies_props, movies_id)
+            self.metadata = None
 
-        intersection_n = len(intersection)
-        union_n = len(union)
+        return self.vocabulary
 
-        try:
-            jaccard = intersection_n / union_n
-        except ZeroDivisionError:
-            jaccard = 0
+    def __get_metadata(self):
+        """
+        Function that returns the names, uris and number of properties of all movies, built once for the properties
+        :return: the cached movie metadata
+        """
+        vocabulary = self.__get_vocabulary()
+        if self.metadata is None and self.model is not None and self.model.has_component('metadata'):
+            self.metadata = self.model.metadata()
+        elif self.metadata is None:
+            with instrumentation.span('lod.metadata'):
+                self.metadata = MovieMetadata.from_vocabulary(vocabulary, self.movies_set)
 
-        return jaccard
+        return self.metadata
 
-    def __generate_similarity_matrix(self, movies_id: list):
+    def __get_explanation_index(self):
         """
-        Function that generates the similarity matrix
-        :param movies_id: list of all movie id on data set
-        :return: movie per movie similarity matrix where 1 means more proximity and 0 otherwise
+        Function that returns the idf table and inverted index of the explanations, built once for the properties
+        together with a new memo of the explanations
+        :return: the cached explanation index
         """
+        vocabulary = self.__get_vocabulary()
+        if self.explanation_index is None or self.explanation_index.vocabulary is not vocabulary:
+            metadata = self.__get_metadata()
+            if self.model is not None and self.model.has_component('explanations'):
+                self.explanation_index = self.model.explanation_index()
+            else:
+                with instrumentation.span('lod.explanation_index'):
+                    self.explanation_index = ExplanationIndex(vocabulary, len(vocabulary.movies_id), metadata)
+            self.explanation_cache = {}
 
-        movies_props = sparql_utils.get_all_movie_props(self.movies_set, self.sim_matrix_flag, self.all_props_path)
-        sim_movies = pd.DataFrame(0, index=movies_id, columns=movies_id)
+        return self.explanation_index
 
-        for i in range(0, len(movies_id)):
-            movie1 = movies_id[i]
-            movie1_props = sparql_utils.movie_props_tolist(movie1, movies_props)
-            for j in range(i, len(movies_id)):
-                movie2 = movies_id[j]
-                movie2_props = sparql_utils.movie_props_tolist(movie2, movies_props)
-                jac_sim = self.__calculate_jaccard(movie1, movie1_props, movie2, movie2_props)
-                sim_movies.loc[movie1, movie2] = jac_sim
-                sim_movies.loc[movie2, movie1] = jac_sim
-                print("sim: " + str(movie1) + " / " + str(movie2) + " = " + str(sim_movies.loc[movie1, movie2]))
+    def __get_similarity_matrix(self):
+        """
+        Function that returns the similarity matrix, it is loaded or generated only once for the life of the object
+        :return: the cached similarity matrix or neighbour store
+        """
+        if self.sim_matrix is None:
+            with instrumentation.span('lod.similarity', flag=self.sim_matrix_flag, k_max=self.k_max,
+                                      lsh=self.lsh_index is not None):
+                self.sim_matrix = self.__load_similarity_matrix()
 
-        return sim_movies
+        return self.sim_matrix
 
-    def __get_similarity_matrix(self):
+    def __load_similarity_matrix(self):
         """
-        Function that gets or generates the similarity matrix
-        :return: the similarity matrix with index and column
+        Function that reads or generates the similarity matrix
+        :return: the similarity matrix with index and column, or the neighbour store in LSH or k_max mode
         """
+        if self.model is not None:
+            return self.model.similarity()
+
         movies_id = self.movies_set['movie_id'].to_list()
         movies_id.sort()
 
-        if self.sim_matrix_flag == 1:
+        if self.lsh_index is not None:
+            return self.lsh_index.fit(self.__get_vocabulary(self.sim_matrix_flag).incidence(), movies_id)
+
+        if self.k_max is not None:
+            if self.sim_matrix_flag == 1 and self.memory_budget is not None:
+                incidence = self.__get_vocabulary(self.sim_matrix_flag).incidence()
+                neighbours = blocked_build.build_neighbours("jaccard", incidence, movies_id, self.k_max,
+                                                            self.neighbours_path, self.memory_budget,
+                                                            self.build_workers)
+            elif self.sim_matrix_flag == 1:
+                incidence = self.__get_vocabulary(self.sim_matrix_flag).incidence()
+                neighbours = similarity_utils.jaccard_neighbours(incidence, movies_id, self.k_max)
+                neighbours.save(self.neighbours_path)
+            else:
+                neighbours = NeighbourStore.load(self.neighbours_path)
+
+            return neighbours
+
+        if self.sim_matrix_flag == 1 and self.memory_budget is not None:
+            if self.sim_matrix_format != "bin":
+                raise ValueError("the blocked build writes the matrix in the bin format, set sim_matrix_format to bin "
+                                 "or use k_max")
+            incidence = self.__get_vocabulary(self.sim_matrix_flag).incidence()
+            blocked_build.build_similarity_matrix("jaccard", incidence, movies_id, self.sim_matrix_path,
+                                                  self.memory_budget, self.build_workers, self.sim_matrix_dtype)
+            sim_matrix = matrix_store.load_similarity_matrix(self.sim_matrix_path)
+        elif self.sim_matrix_flag == 1:
             sim_matrix = self.__generate_similarity_matrix(movies_id)
-            sim_matrix.to_csv(self.sim_matrix_path, mode='w', header=False, index=False)
+            if self.sim_matrix_format == "bin":
+                matrix_store.save_similarity_matrix(self.sim_matrix_path, sim_matrix, movies_id,
+                                                    self.sim_matrix_dtype)
+                sim_matrix = matrix_store.load_similarity_matrix(self.sim_matrix_path)
+            else:
+                sim_matrix.to_csv(self.sim_matrix_path, mode='w', header=False, index=False)
+        elif self.sim_matrix_format == "bin":
+            sim_matrix = matrix_store.load_similarity_matrix(self.sim_matrix_path)
         else:
             sim_matrix = pd.read_csv(self.sim_matrix_path, header=None)
             sim_matrix.columns = movies_id
@@ -118,42 +221,199 @@ class JacLodRecommendationEngine:
 
         return sim_matrix
 
-    def generate_recommendation(self, user_id: int):
+    def update_similarity_matrix(self, changed_movies_id: list):
         """
-        Function that generates a top n recommendation to a user
-        :param user_id: user to generate recommendation
-        :return: recommendations with or without the explanation to the user
+        Function that updates the stored similarity matrix after the properties of some movies changed or movies were
+        added or removed from the movies set, only the similarities of these movies are calculated again. The
+        properties are read from the properties file, which must already hold the new properties
+        :param changed_movies_id: movies whose properties changed, added and removed movies do not need to be listed
+        :return: stored similarity matrix, or neighbour store, updated and cached
+        """
+        if self.model is not None:
+            raise ValueError("the model artifact is read only, update the files of the engine and save a new model")
+        with instrumentation.span('lod.similarity_update', changed=len(changed_movies_id)):
+            return self.__update_similarity_matrix(changed_movies_id)
+
+    def __update_similarity_matrix(self, changed_movies_id: list):
+        """
+        Function that updates the stored similarity matrix, see update_similarity_matrix
+        :param changed_movies_id: movies whose properties changed
+        :return: stored similarity matrix, or neighbour store, updated and cached
+        """
+        movies_id = self.movies_set['movie_id'].to_list()
+        movies_id.sort()
+        self.vocabulary = None
+        incidence = self.__get_vocabulary().incidence()
+
+        if self.lsh_index is not None:
+            # the signatures of the bands are cheap to calculate again, only the exact matrix is worth patching
+            self.sim_matrix = self.lsh_index.fit(incidence, movies_id)
+            return self.sim_matrix
+
+        if self.k_max is not None:
+            neighbours = self.sim_matrix if self.sim_matrix is not None else NeighbourStore.load(self.neighbours_path)
+            self.sim_matrix = similarity_utils.update_jaccard_neighbours(neighbours, incidence, movies_id,
+                                                                         changed_movies_id)
+            self.sim_matrix.save(self.neighbours_path)
+            return self.sim_matrix
+
+        if self.sim_matrix_format == "bin":
+            old_movies_id, dtype, _, _ = matrix_store.read_header(self.sim_matrix_path)
+            if np.array_equal(old_movies_id, movies_id):
+                positions = similarity_utils.changed_positions(old_movies_id, movies_id, changed_movies_id)
+                rows = similarity_utils.jaccard_rows_at(incidence, positions)
+                matrix_store.patch_similarity_matrix(self.sim_matrix_path, positions, rows)
+            else:
+                sim_matrix = matrix_store.dequantize(matrix_store.load_similarity_matrix(self.sim_matrix_path))
+                sim_matrix = similarity_utils.update_jaccard_matrix(sim_matrix, incidence, movies_id,
+                                                                    changed_movies_id)
+                matrix_store.save_similarity_matrix(self.sim_matrix_path, sim_matrix, movies_id, dtype)
+            self.sim_matrix = matrix_store.load_similarity_matrix(self.sim_matrix_path)
+            return self.sim_matrix
+
+        sim_matrix = self.sim_matrix
+        if sim_matrix is None:
+            # the csv file has no movie ids, it must have been generated with the current movies set
+            sim_matrix = pd.read_csv(self.sim_matrix_path, header=None)
+            if len(sim_matrix) != len(movies_id):
+                raise ValueError("the csv similarity matrix does not match the movies set, load it before the movies "
+                                 "set changes or use the bin format")
+            sim_matrix.columns = movies_id
+            sim_matrix.index = movies_id
+
+        self.sim_matrix = similarity_utils.update_jaccard_matrix(sim_matrix, incidence, movies_id, changed_movies_id)
+        self.sim_matrix.to_csv(self.sim_matrix_path, mode='w', header=False, index=False)
+        return self.sim_matrix
+
+    def save_model(self, directory: str, explanation_flag: int = 1, sim_matrix_dtype=None):
+        """
+        Function that packs the model of the engine in a single versioned artifact with a manifest and checksums, see
+        load_model
+        :param directory: directory of the artifact, it is replaced when it exists
+        :param explanation_flag: 1 to also pack the properties, names and explanation tables and 0 for a model that
+        only scores
+        :param sim_matrix_dtype: type of the values of a full similarity matrix, None to keep the type of the matrix
+        :return: manifest of the artifact
         """
         sim_matrix = self.__get_similarity_matrix()
-        user_interactions = self.user_item.loc[user_id].sort_values()
+        vocabulary = metadata = explanation_index = None
+        if explanation_flag == 1:
+            explanation_index = self.__get_explanation_index()
+            vocabulary = explanation_index.vocabulary
+            metadata = self.__get_metadata()
 
-        profile = user_interactions[user_interactions == 1]
-        prediction = user_interactions[user_interactions.isnull()]
+        params = {'k': self.k, 'n': self.n, 'explanation_flag': self.explanation_flag,
+                  'k_max': sim_matrix.k_max if isinstance(sim_matrix, NeighbourStore) else None}
+        return model_artifact.write_model(directory, self.movies_set, self.user_item, sim_matrix, vocabulary, metadata,
+                                          explanation_index, params, sim_matrix_dtype)
+
+    @classmethod
+    def load_model(cls, directory: str, test_set: pd.DataFrame = None, verify: bool = False):
+        """
+        Function that opens an engine saved with save_model, only the manifest, the movies and the interactions are
+        read now and the similarity, memory mapped, and the explanation data are read on their first use
+        :param directory: directory of the artifact
+        :param test_set: test data frame with interactions to predict, None for an engine that only recommends
+        :param verify: True to check the checksums of every file of the artifact before opening it
+        :return: engine of the artifact, its update_similarity_matrix is not available
+        """
+        model = ModelArtifact(directory, verify)
+        params = model.params
+        return cls(model.user_item(), model.movies_set(), test_set, params['k'], params['n'],
+                   params['explanation_flag'], 0, k_max=params['k_max'], model=model)
 
-        for movie in prediction.index:
-            prediction.loc[movie] = evaluation_utils.calculate_prediction(movie, profile, sim_matrix, self.k)
+    def warm_up(self, explanation_flag: int = 0):
+        """
+        Function that loads everything the recommendations need, so the first request of a long lived process is as
+        fast as the next ones
+        :param explanation_flag: 1 to also build the properties and the explanation index and 0 otherwise
+        :return: similarity matrix, and explanation index, cached
+        """
+        self.__get_similarity_matrix()
+        if explanation_flag == 1:
+            self.__get_explanation_index()
+
+    def iter_recommendations(self, users_id: list, explanation_flag: int = 0, chunk_size: int = 256, n: int = None):
+        """
+        Function that generates a top n recommendation to many users, scoring each chunk of users together
+        :param users_id: users to generate recommendation
+        :param explanation_flag: 1 to add the explanation of every recommendation and 0 otherwise
+        :param chunk_size: number of users scored together
+        :param n: number of recommendation items to return, None for the n of the class
+        :return: generator of data frames with the columns user_id, rank, movie_id, score and, with explanations,
+        explanation
+        """
+        sim_matrix = self.__get_similarity_matrix()
+        movies_id = self.movies_set['movie_id'].to_list()
+        movies_id.sort()
+        n = self.n if n is None else n
+
+        if explanation_flag == 1:
+            explanation_index = self.__get_explanation_index()
+
+        users_id = list(users_id)
+        for first in range(0, len(users_id), chunk_size):
+            chunk = users_id[first:first + chunk_size]
+            with instrumentation.span('lod.recommend', users=len(chunk)):
+                if isinstance(sim_matrix, NeighbourStore):
+                    profiles_pos = self.user_item.profile_positions(chunk, movies_id)
+                    positions, best_scores = recommendation_utils.top_n_reachable(sim_matrix, profiles_pos, self.k,
+                                                                                  n)
+                else:
+                    profiles = recommendation_utils.profile_masks(self.user_item, chunk, movies_id)
+                    scores = recommendation_utils.score_users(sim_matrix, profiles, self.k)
+                    positions, best_scores = recommendation_utils.top_n(scores, profiles, n)
+                    profiles_pos = [np.flatnonzero(profile) for profile in profiles]
+                recommendations = recommendation_utils.recommendations_frame(chunk, movies_id, positions,
+                                                                             best_scores)
+            instrumentation.count('lod.recommendations', len(recommendations))
+
+            if explanation_flag == 1:
+                recommended = recommendations.groupby('user_id', sort=False)['movie_id'].apply(np.asarray)
+                requests = [(chunk[i], np.asarray(movies_id)[profiles_pos[i]], recommended.get(chunk[i], []))
+                            for i in range(0, len(chunk))]
+                chunk_explanations = explanations.generate_batch_explanations(requests, explanation_index,
+                                                                              self.movies_set,
+                                                                              cache=self.explanation_cache)
+                recommendations['explanation'] = chunk_explanations['sentence'].values
+
+            yield recommendations
+
+    def generate_recommendations(self, users_id: list, explanation_flag: int = 0, chunk_size: int = 256,
+                                 n: int = None):
+        """
+        Function that generates a top n recommendation to many users
+        :param users_id: users to generate recommendation
+        :param explanation_flag: 1 to add the explanation of every recommendation and 0 otherwise
+        :param chunk_size: number of users scored together
+        :param n: number of recommendation items to return, None for the n of the class
+        :return: data frame with the columns user_id, rank, movie_id, score and, with explanations, explanation
+        """
+        return pd.concat(list(self.iter_recommendations(users_id, explanation_flag, chunk_size, n)),
+                         ignore_index=True)
+
+    def generate_recommendation(self, user_id: int):
+        """
+        Function that generates a top n recommendation to a user and prints it
+        :param user_id: user to generate recommendation
+        :return: recommendations with or without the explanation to the user
+        """
+        recommendations = self.generate_recommendations([user_id], self.explanation_flag)
+        profile = self.user_item.profile(user_id)
+        metadata = self.__get_metadata()
 
-        prediction = prediction.sort_values(ascending=False)
-        recommended_movies = prediction[:self.n]
         print("----- MOVIES WATCHED BY THE USER " + str(user_id) + " -----")
-        for movie in profile.index:
-            print(sparql_utils.get_movie_name(sparql_utils.get_all_movie_props(self.movies_set, 0, self.all_props_path),
-                                             self.movies_set, movie))
+        for movie in profile:
+            print(sparql_utils.get_movie_name(metadata, self.movies_set, movie))
 
         print("----- MOVIES RECOMMENDED TO THE USER " + str(user_id) + " -----")
-        for movie in recommended_movies.index:
-            print(sparql_utils.get_movie_name(sparql_utils.get_all_movie_props(self.movies_set, 0, self.all_props_path),
-                                              self.movies_set, movie))
+        for movie in recommendations['movie_id']:
+            print(sparql_utils.get_movie_name(metadata, self.movies_set, movie))
 
         print("----- EXPLANATIONS TO THE USER " + str(user_id) + " -----")
         if self.explanation_flag == 1:
-            all_movies_props = sparql_utils.get_all_movie_props(self.movies_set,
-                                                                self.sim_matrix_flag,
-                                                                self.all_props_path)
-            movies_explanations = explanations.Explanations(profile, recommended_movies,
-                                                            all_movies_props, self.movies_set, len(sim_matrix.index.unique()))
-
-            movies_explanations.generate_explanations()
+            for sentence in recommendations['explanation']:
+                print(sentence)
 
     def generate_map(self):
         """
@@ -162,3 +422,28 @@ class JacLodRecommendationEngine:
         """
         sim_matrix = self.__get_similarity_matrix()
         return evaluation_utils.generate_map(sim_matrix, self.test_set, self.user_item, self.n, self.k)
+
+    def generate_metrics(self, k_values: list, n_values: list, n_workers: int = 1):
+        """
+        Function that returns the MAP, precision, recall and nDCG of the recommendation algorithm for every pair of k
+        and n, calculated in a single pass over the users
+        :param k_values: numbers of neighbours
+        :param n_values: numbers of recommendation items
+        :param n_workers: number of processes of the evaluation
+        :return: data frame with the columns k, n, map, precision, recall, ndcg and users
+        """
+        sim_matrix = self.__get_similarity_matrix()
+        return evaluation_utils.generate_metrics(sim_matrix, self.test_set, self.user_item, k_values, n_values,
+                                                 n_workers)
+
+    def quantization_report(self, dtypes: list = ("float64", "float32", "float16", "uint8")):
+        """
+        Function that compares the top n lists and the MAP of the similarity matrix stored with each type of the bin
+        format against the float64 matrix
+        :param dtypes: types compared, see matrix_store.DTYPES
+        :return: data frame with one line per type, see evaluation_utils.quantization_report
+        """
+        movies_id = self.movies_set['movie_id'].to_list()
+        movies_id.sort()
+        reference = similarity_utils.jaccard_similarity_matrix(self.__get_vocabulary(), movies_id)
+        return evaluation_utils.quantization_report(reference, self.test_set, self.user_item, self.n, self.k, dtypes)
@@ -4,6 +4,7 @@ import lod_recommender
 import random
 import baseline_colaborative_cosine as cos_baseline
 import evaluation_utils
+from user_item_matrix import UserItemMatrix
 
 
 def read_data_set(file_path: str, columns: list):
@@ -25,15 +26,9 @@ def main():
     test_set = read_data_set("./facebook_movies/testset.tsv", cols)
     movies_set = read_data_set("./facebook_movies/mappingLinkedData.tsv", ['movie_id', 'dbpedia_uri'])
 
-    # create user/item matrix
-    user_item = pd.DataFrame(index=test_set["user_id"].unique(),
-                             columns=[i for i in movies_set['movie_id'].sort_values().tolist()])
-
-    # set 1 on user/item matrix if user interacted with movie
-    for index, row in train_set.iterrows():
-        user_id = row[0]
-        movie_id = row[1]
-        user_item.loc[user_id, movie_id] = 1
+    # create sparse user/item matrix with 1 if user interacted with movie
+    user_item = UserItemMatrix.from_interactions(train_set, movies_set['movie_id'].sort_values().tolist(),
+                                                 test_set["user_id"].unique())
 
     # call recomendation engines
     recommender_engine = lod_recommender.JacLodRecommendationEngine(user_item, movies_set, test_set, 5, 5, 1, 0)
@@ -45,11 +40,12 @@ def main():
 
     # ---- accuracy results code ----
     # k_values = [5, 10, 20]
-    # evaluation_utils.generate_accuracy_results(recommender_engine, k_values, "./results/lod_results.txt",
-    #                                        "LOD Jaccard Recommender")
+    # n_values = [5, 10]
+    # evaluation_utils.generate_accuracy_results(recommender_engine, k_values, "./results/lod_results.csv",
+    #                                            "LOD Jaccard Recommender", n_values)
     # baseline = cos_baseline.CosineBaseline(user_item, test_set, movies_set, 5, 5)
-    # evaluation_utils.generate_accuracy_results(baseline, k_values, "./results/baseline_results.txt",
-    #                                            "Baseline Collaborative Item-KNN Recommender")
+    # evaluation_utils.generate_accuracy_results(baseline, k_values, "./results/baseline_results.csv",
+    #                                            "Baseline Collaborative Item-KNN Recommender", n_values)
 
     print("--- END ---")
 
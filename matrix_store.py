@@ -0,0 +1,232 @@
+import os
+import struct
+import numpy as np
+import pandas as pd
+from neighbour_store import NeighbourStore
+
+
+# utils functions lib to store similarity matrices as memory mapped binary files
+
+MAGIC = b'LODSIM\x00\x00'
+VERSION = 2
+# magic, version, number of movies, dtype name, offset of the matrix in the file and scale of the stored values
+HEADER = struct.Struct('<8sIQ8sQd')
+# the first version had no scale, its values are stored as they are
+HEADER_V1 = struct.Struct('<8sIQ8sQ')
+ALIGNMENT = 64
+# types of the stored values, the unsigned integers are fixed point numbers of [0, 1] with a scale
+DTYPES = ["float64", "float32", "float16", "uint8"]
+
+
+def quantize(values: np.ndarray, dtype):
+    """
+    Function that converts similarities of [0, 1] to the stored type, unsigned integers hold the similarity times
+    their maximum value rounded to the nearest integer
+    :param values: numpy array with the similarities
+    :param dtype: numpy type of the stored values
+    :return: tuple with the stored values and the scale that converts them back to similarities
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind == 'u':
+        maximum = np.iinfo(dtype).max
+        return np.rint(np.clip(values, 0, 1) * maximum).astype(dtype), 1 / maximum
+
+    return np.asarray(values, dtype=dtype), 1.0
+
+
+def similarity_scale(sim_matrix):
+    """
+    Function that returns the scale of the values of a similarity matrix, the scorers multiply the stored values by it
+    :param sim_matrix: similarity matrix data frame
+    :return: 1 for float matrices and the scale of the fixed point matrices opened with load_similarity_matrix
+    """
+    return sim_matrix.attrs.get('scale', 1.0) if isinstance(sim_matrix, pd.DataFrame) else 1.0
+
+
+def dequantize(sim_matrix: pd.DataFrame, dtype=np.float32):
+    """
+    Function that copies a similarity matrix to memory as floating point similarities
+    :param sim_matrix: similarity matrix data frame, e.g. opened with load_similarity_matrix
+    :param dtype: numpy type of the copy
+    :return: similarity matrix data frame with the similarities in a new array
+    """
+    values = sim_matrix.values.astype(dtype) * dtype(similarity_scale(sim_matrix))
+    return pd.DataFrame(values, index=sim_matrix.index, columns=sim_matrix.columns)
+
+
+def create_similarity_matrix(file_path: str, movies_id: list, dtype=np.float32):
+    """
+    Function that writes the header of a binary similarity matrix and reserves the space of the matrix, filled with
+    zeros, so its rows can be written later by any process
+    :param file_path: path of the binary file
+    :param movies_id: sorted list of all movie id on data set
+    :param dtype: numpy type of the stored values
+    :return: offset of the matrix in the file
+    """
+    movies_id = np.asarray(movies_id, dtype=np.int64)
+    dtype = np.dtype(dtype)
+    _, scale = quantize(np.zeros(0), dtype)
+
+    ids_end = HEADER.size + movies_id.nbytes
+    offset = ids_end + (-ids_end) % ALIGNMENT
+
+    with open(file_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(movies_id), dtype.str.encode(), offset, scale))
+        f.write(movies_id.tobytes())
+        f.write(b'\x00' * (offset - ids_end))
+        f.truncate(offset + len(movies_id) ** 2 * dtype.itemsize)
+
+    return offset
+
+
+def save_similarity_matrix(file_path: str, sim_matrix, movies_id: list, dtype=np.float32):
+    """
+    Function that writes a similarity matrix as a binary file with a header holding the sorted movie ids followed by
+    the raw row major matrix
+    :param file_path: path of the binary file
+    :param sim_matrix: movie x movie similarity matrix as a data frame or numpy array
+    :param movies_id: sorted list of all movie id on data set
+    :param dtype: numpy type of the stored values, float64, float32, float16 or uint8 for 8 bits fixed point
+    :return: binary file with the matrix
+    """
+    values = sim_matrix.values if isinstance(sim_matrix, pd.DataFrame) else sim_matrix
+    offset = create_similarity_matrix(file_path, movies_id, dtype)
+
+    matrix = np.memmap(file_path, dtype=dtype, mode='r+', offset=offset, shape=(len(movies_id), len(movies_id)))
+    matrix[:], _ = quantize(values, dtype)
+    matrix.flush()
+    del matrix
+
+
+def write_rows(file_path: str, first_row: int, rows: np.ndarray):
+    """
+    Function that writes a block of contiguous rows of a binary similarity matrix in place, processes writing
+    different rows can share the file
+    :param file_path: path of the binary file
+    :param first_row: position of the first row of the block
+    :param rows: numpy array with the rows against every movie
+    :return: rows written and flushed to the file
+    """
+    movies_id, dtype, offset, _ = read_header(file_path)
+    matrix = np.memmap(file_path, dtype=dtype, mode='r+', offset=offset + first_row * len(movies_id) * dtype.itemsize,
+                       shape=(len(rows), len(movies_id)))
+    matrix[:], _ = quantize(rows, dtype)
+    matrix.flush()
+    del matrix
+
+
+def read_header(file_path: str):
+    """
+    Function that reads the header of a binary similarity matrix
+    :param file_path: path of the binary file
+    :return: tuple with the movie ids, the numpy type of the values, the offset of the matrix and the scale of the
+    values
+    """
+    with open(file_path, 'rb') as f:
+        header = f.read(HEADER.size)
+        magic, version = struct.unpack_from('<8sI', header)
+        if magic != MAGIC:
+            raise ValueError(file_path + " is not a binary similarity matrix")
+        if version == 1:
+            _, _, n, dtype, offset = HEADER_V1.unpack_from(header)
+            scale = 1.0
+            f.seek(HEADER_V1.size)
+        elif version == VERSION:
+            _, _, n, dtype, offset, scale = HEADER.unpack(header)
+        else:
+            raise ValueError("unsupported binary similarity matrix version " + str(version))
+
+        movies_id = np.frombuffer(f.read(n * 8), dtype=np.int64)
+
+    return movies_id, np.dtype(dtype.rstrip(b'\x00').decode()), offset, scale
+
+
+def load_similarity_matrix(file_path: str):
+    """
+    Function that opens a binary similarity matrix with numpy.memmap, pages are read on demand and shared with every
+    process that maps the same file
+    :param file_path: path of the binary file
+    :return: read only similarity matrix data frame backed by the memory map, the values of fixed point matrices are
+    kept as stored and their scale is in the attrs of the data frame, see similarity_scale
+    """
+    movies_id, dtype, offset, scale = read_header(file_path)
+    matrix = np.memmap(file_path, dtype=dtype, mode='r', offset=offset, shape=(len(movies_id), len(movies_id)))
+
+    sim_matrix = pd.DataFrame(matrix, index=movies_id, columns=movies_id, copy=False)
+    sim_matrix.attrs['scale'] = scale
+    return sim_matrix
+
+
+def patch_similarity_matrix(file_path: str, positions: np.ndarray, rows: np.ndarray):
+    """
+    Function that overwrites in place some rows and the matching columns of a binary similarity matrix, the rest of
+    the file is not read nor written
+    :param file_path: path of the binary file
+    :param positions: positions of the rows to overwrite
+    :param rows: numpy array with the new rows, one per position, against every movie
+    :return: binary file patched
+    """
+    movies_id, dtype, offset, _ = read_header(file_path)
+    matrix = np.memmap(file_path, dtype=dtype, mode='r+', offset=offset, shape=(len(movies_id), len(movies_id)))
+    rows, _ = quantize(rows, dtype)
+    matrix[positions, :] = rows
+    matrix[:, positions] = rows.T
+    matrix.flush()
+    del matrix
+
+
+def memmap_file(values: np.ndarray):
+    """
+    Function that finds the binary similarity matrix file behind an array opened with load_similarity_matrix
+    :param values: array to inspect
+    :return: path of the file or None when the array is not backed by a binary similarity matrix
+    """
+    base = values
+    while base is not None:
+        if isinstance(base, np.memmap) and base.filename is not None:
+            try:
+                read_header(base.filename)
+                return base.filename
+            except ValueError:
+                return None
+        base = base.base
+
+    return None
+
+
+def share_similarity_model(sim_matrix, directory: str):
+    """
+    Function that makes a similarity model readable by other processes through memory maps, a matrix already opened
+    with load_similarity_matrix is reused and any other model is written once to the directory
+    :param sim_matrix: similarity matrix or neighbour store
+    :param directory: directory for the files of models that are only in memory
+    :return: small picklable handle to open the model with open_shared_model
+    """
+    if isinstance(sim_matrix, NeighbourStore):
+        np.save(os.path.join(directory, "movies_id.npy"), sim_matrix.movies_id)
+        np.save(os.path.join(directory, "indices.npy"), sim_matrix.indices)
+        np.save(os.path.join(directory, "scores.npy"), sim_matrix.scores)
+        return "neighbours", directory
+
+    file_path = memmap_file(sim_matrix.values)
+    if file_path is None:
+        file_path = os.path.join(directory, "sim_matrix.bin")
+        values = sim_matrix if similarity_scale(sim_matrix) == 1 else dequantize(sim_matrix, np.float64)
+        save_similarity_matrix(file_path, values, sim_matrix.index.values, dtype=sim_matrix.values.dtype)
+
+    return "matrix", file_path
+
+
+def open_shared_model(handle: tuple):
+    """
+    Function that opens, read only and memory mapped, a model shared with share_similarity_model
+    :param handle: handle returned by share_similarity_model
+    :return: similarity matrix or neighbour store
+    """
+    kind, path = handle
+    if kind == "neighbours":
+        return NeighbourStore(np.load(os.path.join(path, "movies_id.npy")),
+                              np.load(os.path.join(path, "indices.npy"), mmap_mode='r'),
+                              np.load(os.path.join(path, "scores.npy"), mmap_mode='r'))
+
+    return load_similarity_matrix(path)
@@ -0,0 +1,342 @@
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from scipy import sparse
+import instrumentation
+import matrix_store
+from neighbour_store import NeighbourStore
+from prop_vocabulary import PropVocabulary
+from movie_metadata import MovieMetadata
+from explanation_index import ExplanationIndex
+from user_item_matrix import UserItemMatrix
+
+
+# utils functions lib and class to pack a trained model in a single versioned directory. Every component is kept in
+# files of its own, listed on a manifest with their size and sha256, so a process reads only the components it uses
+
+FORMAT = "lod-recommender-model"
+VERSION = 1
+MANIFEST = "manifest.json"
+# files of every component, the similarity has one of the two layouts
+COMPONENT_FILES = {'movies': ["movies.npz"], 'user_item': ["user_item.npz"], 'matrix': ["sim_matrix.bin"],
+                   'neighbours': ["neighbours_movies_id.npy", "neighbours_indices.npy", "neighbours_scores.npy"],
+                   'vocabulary': ["vocabulary.npz"], 'metadata': ["metadata.npz"],
+                   'explanations': ["explanations.npz"]}
+
+
+def _pack_strings(values):
+    """
+    Function that packs a list of strings as one utf-8 buffer and the offsets of the strings, so they are saved
+    without pickle
+    :param values: list of strings
+    :return: tuple with the uint8 buffer and the int64 offsets, in characters, of the start and end of every string
+    """
+    values = [str(value) for value in values]
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in values], out=offsets[1:])
+
+    return np.frombuffer("".join(values).encode('utf-8'), dtype=np.uint8), offsets
+
+
+def _unpack_strings(data: np.ndarray, offsets: np.ndarray):
+    """
+    Function that unpacks the strings packed with _pack_strings
+    :param data: uint8 buffer
+    :param offsets: offsets of the strings
+    :return: object array with the strings
+    """
+    text = data.tobytes().decode('utf-8')
+    values = np.empty(len(offsets) - 1, dtype=object)
+    values[:] = [text[start:end] for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+    return values
+
+
+def _file_digest(file_path: str):
+    """
+    Function that calculates the checksum of a file, reading it in blocks
+    :param file_path: path of the file
+    :return: hexadecimal sha256 of the file
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def _write_similarity(directory: str, sim_matrix, dtype):
+    """
+    Function that writes the similarity component, a binary matrix file is copied as it is when its type is kept
+    :param directory: directory of the artifact
+    :param sim_matrix: similarity matrix or neighbour store
+    :param dtype: numpy type of the stored values of a matrix, None to keep the type of the matrix
+    :return: tuple with the name of the component and its description on the manifest
+    """
+    if isinstance(sim_matrix, NeighbourStore):
+        for file_name, array in zip(COMPONENT_FILES['neighbours'],
+                                    [sim_matrix.movies_id, sim_matrix.indices, sim_matrix.scores]):
+            np.save(os.path.join(directory, file_name), array)
+        return 'neighbours', {'k_max': int(sim_matrix.k_max)}
+
+    file_path = os.path.join(directory, COMPONENT_FILES['matrix'][0])
+    dtype = np.dtype(sim_matrix.values.dtype if dtype is None else dtype)
+    source = matrix_store.memmap_file(sim_matrix.values)
+    if source is not None and dtype == sim_matrix.values.dtype:
+        shutil.copyfile(source, file_path)
+    else:
+        scale = matrix_store.similarity_scale(sim_matrix)
+        values = sim_matrix if scale == 1 else matrix_store.dequantize(sim_matrix, np.float64)
+        matrix_store.save_similarity_matrix(file_path, values, sim_matrix.index.values, dtype)
+
+    return 'matrix', {'dtype': dtype.name}
+
+
+def write_model(directory: str, movies_set: pd.DataFrame, user_item: UserItemMatrix, sim_matrix,
+                vocabulary: PropVocabulary = None, metadata: MovieMetadata = None,
+                explanation_index: ExplanationIndex = None, params: dict = None, sim_matrix_dtype=None):
+    """
+    Function that writes a model artifact, the files are written to a temporary directory that replaces the artifact
+    only when it is complete, so a reader never sees half of a model
+    :param directory: directory of the artifact
+    :param movies_set: data set of movies with columns movie id and movie dbpedia uri
+    :param user_item: interactions of the users
+    :param sim_matrix: similarity matrix or neighbour store
+    :param vocabulary: interned properties of all movies, None for a model that only scores
+    :param metadata: names of the movies, None to leave them out
+    :param explanation_index: idf table and inverted index of the explanations, None to leave them out
+    :param params: parameters of the engine kept on the manifest, e.g. k and n
+    :param sim_matrix_dtype: numpy type of the stored values of a matrix, None to keep the type of the matrix
+    :return: manifest of the artifact
+    """
+    temporary = directory.rstrip(os.sep) + ".tmp"
+    if os.path.exists(temporary):
+        shutil.rmtree(temporary)
+    os.makedirs(temporary)
+
+    components = {}
+    with instrumentation.span('model.write', directory=directory):
+        uris, uris_offsets = _pack_strings(movies_set['dbpedia_uri'].values)
+        np.savez(os.path.join(temporary, COMPONENT_FILES['movies'][0]),
+                 movie_id=movies_set['movie_id'].values.astype(np.int64), uris=uris, uris_offsets=uris_offsets)
+        components['movies'] = {}
+
+        matrix = user_item.matrix
+        np.savez(os.path.join(temporary, COMPONENT_FILES['user_item'][0]), indptr=matrix.indptr,
+                 indices=matrix.indices, shape=np.asarray(matrix.shape, dtype=np.int64), users_id=user_item.users_id,
+                 movies_id=user_item.movies_id)
+        components['user_item'] = {}
+
+        name, description = _write_similarity(temporary, sim_matrix, sim_matrix_dtype)
+        components[name] = description
+
+        if vocabulary is not None:
+            props, props_offsets = _pack_strings(vocabulary.props)
+            objs, objs_offsets = _pack_strings(vocabulary.objs)
+            names, names_offsets = _pack_strings(vocabulary.names.values)
+            np.savez(os.path.join(temporary, COMPONENT_FILES['vocabulary'][0]), movies_id=vocabulary.movies_id,
+                     props=props, props_offsets=props_offsets, objs=objs, objs_offsets=objs_offsets,
+                     pair_prop=vocabulary.pair_prop, pair_obj=vocabulary.pair_obj, indptr=vocabulary.indptr,
+                     pairs=vocabulary.pairs, obj_rows=vocabulary.obj_rows, names_id=vocabulary.names.index.values,
+                     names=names, names_offsets=names_offsets)
+            components['vocabulary'] = {'pairs': len(vocabulary.pair_prop)}
+
+        if metadata is not None:
+            names, names_offsets = _pack_strings(metadata.names)
+            uris, uris_offsets = _pack_strings(metadata.uris)
+            np.savez(os.path.join(temporary, COMPONENT_FILES['metadata'][0]), movies_id=metadata.movies_id,
+                     names=names, names_offsets=names_offsets, uris=uris, uris_offsets=uris_offsets,
+                     prop_counts=metadata.prop_counts)
+            components['metadata'] = {}
+
+        if explanation_index is not None:
+            pair_movies = explanation_index.pair_movies
+            np.savez(os.path.join(temporary, COMPONENT_FILES['explanations'][0]), idf=explanation_index.idf,
+                     indptr=pair_movies.indptr, indices=pair_movies.indices,
+                     shape=np.asarray(pair_movies.shape, dtype=np.int64))
+            components['explanations'] = {'number_documents': int(explanation_index.number_documents)}
+
+        for name, description in components.items():
+            description['files'] = {}
+            for file_name in COMPONENT_FILES[name]:
+                file_path = os.path.join(temporary, file_name)
+                description['files'][file_name] = {'bytes': os.path.getsize(file_path),
+                                                   'sha256': _file_digest(file_path)}
+
+        manifest = {'format': FORMAT, 'version': VERSION,
+                    'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+                    'params': params or {}, 'components': components}
+        with open(os.path.join(temporary, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=1)
+
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.replace(temporary, directory)
+
+    return manifest
+
+
+# A class that opens a model artifact and reads each of its components only on the first use
+class ModelArtifact:
+
+    def __init__(self, directory: str, verify: bool = False):
+        """
+        Constructor of the class, only the manifest is read
+        :param directory: directory of the artifact written with write_model
+        :param verify: True to check the sha256 of every file now, otherwise only the sizes of the files of a
+        component are checked when it is read
+        """
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('format') != FORMAT:
+            raise ValueError(directory + " is not a model artifact")
+        if self.manifest.get('version') != VERSION:
+            raise ValueError("unsupported model artifact version " + str(self.manifest.get('version')))
+
+        self.params = self.manifest['params']
+        self.components = self.manifest['components']
+        self.cache = {}
+        if verify:
+            self.verify()
+
+    def has_component(self, name: str):
+        """
+        Function that tells if the artifact has a component
+        :param name: name of the component, e.g. vocabulary or explanations
+        :return: True when the component was written to the artifact
+        """
+        return name in self.components
+
+    def verify(self):
+        """
+        Function that checks the size and the sha256 of every file of the artifact
+        :return: True, a ValueError is raised on the first file that does not match the manifest
+        """
+        for name, description in self.components.items():
+            for file_name, stored in description['files'].items():
+                if _file_digest(self.__file_path(name, file_name)) != stored['sha256']:
+                    raise ValueError("checksum of " + file_name + " does not match the manifest of " + self.directory)
+
+        return True
+
+    def __file_path(self, name: str, file_name: str):
+        """
+        Function that returns the path of a file of a component after checking its size against the manifest
+        :param name: name of the component
+        :param file_name: name of the file
+        :return: path of the file
+        """
+        if name not in self.components:
+            raise ValueError("the model artifact " + self.directory + " has no " + name + " component")
+
+        file_path = os.path.join(self.directory, file_name)
+        expected = self.components[name]['files'][file_name]['bytes']
+        if not os.path.exists(file_path) or os.path.getsize(file_path) != expected:
+            raise ValueError(file_name + " of " + self.directory + " is missing or does not have the size of the "
+                                         "manifest")
+
+        return file_path
+
+    def __load(self, name: str, reader):
+        """
+        Function that reads a component once and keeps it for the next calls
+        :param name: name of the component
+        :param reader: function of the paths of the files of the component that returns the component
+        :return: the cached component
+        """
+        if name not in self.cache:
+            with instrumentation.span('model.load', component=name):
+                self.cache[name] = reader(*[self.__file_path(name, file_name) for file_name in COMPONENT_FILES[name]])
+
+        return self.cache[name]
+
+    def movies_set(self):
+        """
+        Function that returns the data set of movies of the model
+        :return: data frame with the columns movie_id and dbpedia_uri
+        """
+        def read(file_path):
+            with np.load(file_path) as arrays:
+                return pd.DataFrame({'movie_id': arrays['movie_id'],
+                                     'dbpedia_uri': _unpack_strings(arrays['uris'], arrays['uris_offsets'])})
+
+        return self.__load('movies', read)
+
+    def user_item(self):
+        """
+        Function that returns the interactions of the users of the model
+        :return: user item matrix
+        """
+        def read(file_path):
+            with np.load(file_path) as arrays:
+                indices = arrays['indices']
+                matrix = sparse.csr_matrix((np.ones(len(indices), dtype=np.float32), indices, arrays['indptr']),
+                                           shape=tuple(arrays['shape']))
+                return UserItemMatrix(matrix, arrays['users_id'], arrays['movies_id'])
+
+        return self.__load('user_item', read)
+
+    def similarity(self):
+        """
+        Function that returns the similarity model, memory mapped so only the pages that are scored are read
+        :return: read only similarity matrix data frame or neighbour store
+        """
+        if self.has_component('neighbours'):
+            def read(movies_id_path, indices_path, scores_path):
+                return NeighbourStore(np.load(movies_id_path), np.load(indices_path, mmap_mode='r'),
+                                      np.load(scores_path, mmap_mode='r'))
+
+            return self.__load('neighbours', read)
+
+        return self.__load('matrix', matrix_store.load_similarity_matrix)
+
+    def vocabulary(self):
+        """
+        Function that returns the interned properties of all movies of the model
+        :return: prop vocabulary
+        """
+        def read(file_path):
+            with np.load(file_path) as arrays:
+                names = pd.Series(_unpack_strings(arrays['names'], arrays['names_offsets']), index=arrays['names_id'],
+                                  dtype=object)
+                return PropVocabulary(arrays['movies_id'], _unpack_strings(arrays['props'], arrays['props_offsets']),
+                                      _unpack_strings(arrays['objs'], arrays['objs_offsets']), arrays['pair_prop'],
+                                      arrays['pair_obj'], arrays['indptr'], arrays['pairs'], arrays['obj_rows'], names)
+
+        return self.__load('vocabulary', read)
+
+    def metadata(self):
+        """
+        Function that returns the names, uris and number of properties of all movies of the model
+        :return: movie metadata
+        """
+        def read(file_path):
+            with np.load(file_path) as arrays:
+                return MovieMetadata(arrays['movies_id'], _unpack_strings(arrays['names'], arrays['names_offsets']),
+                                     _unpack_strings(arrays['uris'], arrays['uris_offsets']), arrays['prop_counts'])
+
+        return self.__load('metadata', read)
+
+    def explanation_index(self):
+        """
+        Function that returns the idf table and inverted index of the explanations of the model, together with its
+        vocabulary and metadata
+        :return: explanation index
+        """
+        def read(file_path):
+            with np.load(file_path) as arrays:
+                indices = arrays['indices']
+                pair_movies = sparse.csr_matrix((np.ones(len(indices), dtype=np.int32), indices, arrays['indptr']),
+                                                shape=tuple(arrays['shape']))
+                pair_movies.has_sorted_indices = True
+                return ExplanationIndex(self.vocabulary(), self.components['explanations']['number_documents'],
+                                        self.metadata() if self.has_component('metadata') else None,
+                                        arrays['idf'], pair_movies)
+
+        return self.__load('explanations', read)
@@ -0,0 +1,81 @@
+import re
+import numpy as np
+import pandas as pd
+from prop_vocabulary import PropVocabulary
+
+
+def name_from_uri(movie_uri: str):
+    """
+    Function that gets the movie name from its dbpedia uri, if the input is
+    http://dbpedia.org/resource/Toy_Story_(film), the output will be Toy Story
+    :param movie_uri: dbpedia uri of the movie
+    :return: the movie name
+    """
+    reg = r'\([\s\S]*\)'
+    separated = movie_uri.split("/")
+    most_important = separated[-1]
+    most_important = re.sub(reg, '', most_important)
+    name = most_important.replace("_", " ")
+    if name[-1] == " ":
+        name = name[:-1]
+
+    return name
+
+
+# A class that holds the display name, uri and number of properties of every movie, built once with the model
+class MovieMetadata:
+
+    def __init__(self, movies_id: list, names: np.ndarray, uris: np.ndarray, prop_counts: np.ndarray):
+        """
+        Constructor of the class
+        :param movies_id: sorted list of all movie id on data set
+        :param names: display name of every movie
+        :param uris: dbpedia uri of every movie
+        :param prop_counts: number of distinct (prop, obj) pairs of every movie
+        """
+        self.movies_id = np.asarray(movies_id)
+        self.names = np.asarray(names, dtype=object)
+        self.uris = np.asarray(uris, dtype=object)
+        self.prop_counts = np.asarray(prop_counts, dtype=np.int32)
+        self.positions = dict(zip(self.movies_id.tolist(), range(len(self.movies_id))))
+
+    @classmethod
+    def from_vocabulary(cls, vocabulary: PropVocabulary, movies_set: pd.DataFrame):
+        """
+        Function that builds the metadata of the movies of a vocabulary, the name is the foaf name of the movie or,
+        when it has none, the name on its uri
+        :param vocabulary: interned properties of all movies
+        :param movies_set: data set of movies with columns movie id and movie dbpedia uri
+        :return: metadata of the movies
+        """
+        uris = movies_set.drop_duplicates('movie_id').set_index('movie_id')['dbpedia_uri']
+        uris = uris.reindex(vocabulary.movies_id).values
+        names = vocabulary.names.reindex(vocabulary.movies_id).values
+        missing = pd.isnull(names)
+        names[missing] = [name_from_uri(uri) for uri in uris[missing]]
+
+        return cls(vocabulary.movies_id, names, uris, np.diff(vocabulary.indptr))
+
+    def name(self, movie_id: int):
+        """
+        Function that returns the display name of a movie
+        :param movie_id: movie id
+        :return: the movie name
+        """
+        return self.names[self.positions[movie_id]]
+
+    def uri(self, movie_id: int):
+        """
+        Function that returns the dbpedia uri of a movie
+        :param movie_id: movie id
+        :return: the movie uri
+        """
+        return self.uris[self.positions[movie_id]]
+
+    def prop_count(self, movie_id: int):
+        """
+        Function that returns the number of distinct (prop, obj) pairs of a movie
+        :param movie_id: movie id
+        :return: the number of properties
+        """
+        return int(self.prop_counts[self.positions[movie_id]])
@@ -0,0 +1,193 @@
+import numpy as np
+import pandas as pd
+
+
+# A class that holds, for every movie, its most similar movies sorted by similarity
+class NeighbourStore:
+
+    def __init__(self, movies_id: list, indices: np.ndarray, scores: np.ndarray):
+        """
+        Constructor of the class
+        :param movies_id: sorted list of all movie id on data set
+        :param indices: n x k_max array with the position in movies_id of the neighbours of every movie, sorted by
+        decreasing similarity and padded with -1 when a movie has less than k_max neighbours
+        :param scores: n x k_max array with the similarity of every neighbour, padded with 0
+        """
+        self.movies_id = np.asarray(movies_id)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.scores = np.asarray(scores, dtype=np.float32)
+        self.positions = pd.Series(np.arange(len(self.movies_id)), index=self.movies_id)
+        self.reverse_indptr = None
+        self.reverse_indices = None
+
+    @property
+    def k_max(self):
+        """
+        Maximum number of neighbours kept per movie
+        :return: number of columns of the neighbour arrays
+        """
+        return self.indices.shape[1]
+
+    @classmethod
+    def from_pairs(cls, movies_id: list, rows: np.ndarray, cols: np.ndarray, sims: np.ndarray, k_max: int):
+        """
+        Function that builds the store from a list of (movie, neighbour, similarity) triples, keeping only the k_max
+        most similar neighbours of every movie
+        :param movies_id: sorted list of all movie id on data set
+        :param rows: position of the movie of each triple
+        :param cols: position of the neighbour of each triple
+        :param sims: similarity of each triple
+        :param k_max: maximum number of neighbours kept per movie
+        :return: neighbour store of the triples
+        """
+        n = len(movies_id)
+        order = np.lexsort((cols, -sims, rows))
+        rows, cols, sims = rows[order], cols[order], sims[order]
+
+        # rank of every triple inside the neighbours of its movie
+        starts = np.searchsorted(rows, np.arange(n))
+        rank = np.arange(len(rows)) - starts[rows]
+        keep = rank < k_max
+
+        indices = np.full((n, k_max), -1, dtype=np.int32)
+        scores = np.zeros((n, k_max), dtype=np.float32)
+        indices[rows[keep], rank[keep]] = cols[keep]
+        scores[rows[keep], rank[keep]] = sims[keep]
+
+        return cls(movies_id, indices, scores)
+
+    @classmethod
+    def load(cls, file_path: str):
+        """
+        Function that reads a neighbour store saved with save
+        :param file_path: path of the npz file
+        :return: neighbour store of the file
+        """
+        with np.load(file_path) as arrays:
+            return cls(arrays['movies_id'], arrays['indices'], arrays['scores'])
+
+    def save(self, file_path: str):
+        """
+        Function that writes the store as compact numpy arrays, int32 neighbour positions and float32 similarities
+        :param file_path: path of the npz file
+        :return: file with the store
+        """
+        np.savez(file_path, movies_id=self.movies_id, indices=self.indices, scores=self.scores)
+
+    def predict(self, movie: int, profile: pd.DataFrame, k: int):
+        """
+        Calculates the prediction of a user to like a movie from the neighbours of the movie. Profile movies that are
+        not among the k_max neighbours count as zero similarity, as they would on the full similarity matrix
+        :param movie: movie that the user may like
+        :param profile: user profile with items interacted
+        :param k: number of neighbors
+        :return: mean of the similarities of the k nearest profile movies
+        """
+        position = self.positions[movie]
+        neighbours = self.indices[position]
+        valid = neighbours >= 0
+
+        in_profile = np.isin(self.movies_id[neighbours[valid]], profile.index)
+        profile_scores = self.scores[position][valid][in_profile][:k]
+
+        curr_n = min(k, len(profile.index) - int(movie in profile.index))
+        if curr_n == 0:
+            return 0
+
+        return float(profile_scores.sum()) / curr_n
+
+    def reverse_neighbours(self):
+        """
+        Function that returns the reverse neighbour index, which maps every movie to the movies that have it among
+        their neighbours. It is built once for the store
+        :return: tuple with the csr like indptr and indices arrays, the movies that have the movie at position i among
+        their neighbours are indices[indptr[i]:indptr[i + 1]], sorted by position
+        """
+        if self.reverse_indptr is None:
+            rows = np.repeat(np.arange(len(self.movies_id), dtype=np.int32), self.k_max)
+            cols = self.indices.ravel()
+            valid = cols >= 0
+            order = np.argsort(cols[valid], kind='stable')
+            self.reverse_indices = rows[valid][order]
+            self.reverse_indptr = np.zeros(len(self.movies_id) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(cols[valid], minlength=len(self.movies_id)), out=self.reverse_indptr[1:])
+
+        return self.reverse_indptr, self.reverse_indices
+
+    def reachable(self, profile_pos: np.ndarray):
+        """
+        Function that returns the candidates of a user, the movies that have a profile movie among their neighbours.
+        Every other movie has a prediction of zero
+        :param profile_pos: positions of the movies that the user interacted
+        :return: sorted positions of the candidates, profile movies excluded
+        """
+        indptr, indices = self.reverse_neighbours()
+        profile_pos = np.asarray(profile_pos, dtype=np.int64)
+        starts, ends = indptr[profile_pos], indptr[profile_pos + 1]
+
+        # positions of the reverse neighbours of every profile movie, concatenated
+        lengths = ends - starts
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        candidates = np.unique(indices[offsets])
+
+        return candidates[~np.isin(candidates, profile_pos)]
+
+    def score_candidates(self, candidates_pos: np.ndarray, profile_pos: np.ndarray, k: int):
+        """
+        Calculates the prediction of a user to like every candidate movie at once, with the same rule as predict
+        :param candidates_pos: positions of the movies that the user may like
+        :param profile_pos: positions of the movies that the user interacted, none of them is a candidate
+        :param k: number of neighbors
+        :return: array with the prediction of every candidate
+        """
+        curr_n = min(k, len(profile_pos))
+        if curr_n == 0:
+            return np.zeros(len(candidates_pos))
+
+        profile_mask = np.zeros(len(self.movies_id) + 1, dtype=bool)
+        profile_mask[profile_pos] = True
+
+        # the padding -1 points to the extra position of the mask, which is never a profile movie
+        neighbours = self.indices[candidates_pos]
+        in_profile = profile_mask[neighbours]
+        in_profile &= np.cumsum(in_profile, axis=1) <= k
+
+        return (self.scores[candidates_pos] * in_profile).sum(axis=1, dtype=np.float64) / curr_n
+
+
+def top_k_neighbours(block: np.ndarray, rows_pos, k_max: int):
+    """
+    Function that selects the k_max most similar movies of each row of a block of the similarity matrix, the movie
+    itself and movies with zero similarity are not neighbours
+    :param block: rows of the movie x movie similarity matrix
+    :param rows_pos: position in the matrix of the first row of a contiguous block, or of every row of the block
+    :param k_max: maximum number of neighbours kept per movie
+    :return: k_max neighbour positions padded with -1 and their float32 similarities padded with 0
+    """
+    block = np.array(block, dtype=np.float32)
+    block[np.isnan(block)] = -np.inf
+    rows = np.arange(len(block))
+    block[rows, rows + rows_pos if np.isscalar(rows_pos) else rows_pos] = -np.inf
+
+    # the k_max-th similarity of every row, the movies tied with it are taken by position
+    kth = np.partition(block, block.shape[1] - k_max, axis=1)[:, -k_max, None]
+    above = block > kth
+    ties = block == kth
+    missing = k_max - above.sum(axis=1, keepdims=True)
+    selected = above | ties
+    crowded = np.flatnonzero(ties.sum(axis=1) > missing.ravel())
+    selected[crowded] = above[crowded] | (ties[crowded] & (np.cumsum(ties[crowded], axis=1, dtype=np.int32)
+                                                           <= missing[crowded]))
+    candidates = np.nonzero(selected)[1].reshape(len(block), k_max)
+    candidates_scores = np.take_along_axis(block, candidates, axis=1)
+
+    # sort by decreasing similarity and by position on ties
+    order = np.lexsort((candidates, -candidates_scores), axis=1)
+    indices = np.take_along_axis(candidates, order, axis=1).astype(np.int32)
+    scores = np.take_along_axis(candidates_scores, order, axis=1)
+
+    empty = ~(scores > 0)
+    indices[empty] = -1
+    scores[empty] = 0
+
+    return indices, scores
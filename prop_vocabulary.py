@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+NAME_PROP = "http://xmlns.com/foaf/0.1/name"
+
+
+# A class that interns the (prop, obj) pairs of the dbpedia properties of the movies to integer ids
+class PropVocabulary:
+
+    def __init__(self, movies_id: list, props: np.ndarray, objs: np.ndarray, pair_prop: np.ndarray,
+                 pair_obj: np.ndarray, indptr: np.ndarray, pairs: np.ndarray, obj_rows: np.ndarray,
+                 names: pd.Series):
+        """
+        Constructor of the class
+        :param movies_id: sorted list of all movie id on data set
+        :param props: uri of every property type, indexed by the property id
+        :param objs: uri or literal of every object, indexed by the object id
+        :param pair_prop: int32 property id of every pair, indexed by the pair id
+        :param pair_obj: int32 object id of every pair, indexed by the pair id
+        :param indptr: offsets of the pairs of every movie, the pairs of the movie on position i are
+        pairs[indptr[i]:indptr[i + 1]]
+        :param pairs: int32 sorted pair ids of every movie, one after the other
+        :param obj_rows: number of property rows of every object
+        :param names: name of the movies that have a foaf name, indexed by movie id
+        """
+        self.movies_id = np.asarray(movies_id)
+        self.props = np.asarray(props, dtype=object)
+        self.objs = np.asarray(objs, dtype=object)
+        self.pair_prop = np.asarray(pair_prop, dtype=np.int32)
+        self.pair_obj = np.asarray(pair_obj, dtype=np.int32)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.pairs = np.asarray(pairs, dtype=np.int32)
+        self.obj_rows = np.asarray(obj_rows, dtype=np.int64)
+        self.names = names
+        self.positions = pd.Series(np.arange(len(self.movies_id)), index=self.movies_id)
+
+    @classmethod
+    def from_data_frame(cls, all_movie_props: pd.DataFrame, movies_id: list):
+        """
+        Function that interns the properties of all movies, every string is read only once
+        :param all_movie_props: data frame indexed by movie id with the columns prop and obj
+        :param movies_id: sorted list of all movie id on data set, properties of other movies are only counted on the
+        number of rows of the objects and on the names
+        :return: vocabulary of the properties
+        """
+        movie_ids = all_movie_props.index.values
+        props_codes, props = pd.factorize(all_movie_props['prop'].astype(str).values)
+        objs_codes, objs = pd.factorize(all_movie_props['obj'].astype(str).values)
+        pairs_codes, pairs_keys = pd.factorize(props_codes.astype(np.int64) * len(objs) + objs_codes)
+
+        # repeated (movie, prop, obj) rows are kept once, sorted by movie position and pair id
+        rows = pd.Index(movies_id).get_indexer(movie_ids)
+        known = rows >= 0
+        keys = np.unique(rows[known].astype(np.int64) * max(len(pairs_keys), 1) + pairs_codes[known])
+        keys_rows = keys // max(len(pairs_keys), 1)
+        indptr = np.zeros(len(movies_id) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(keys_rows, minlength=len(movies_id)), out=indptr[1:])
+
+        # the name of a movie is its first foaf name row
+        is_name = np.isin(props_codes, np.flatnonzero(props == NAME_PROP))
+        names = pd.Series(objs[objs_codes[is_name]], index=movie_ids[is_name])
+        names = names[~names.index.duplicated()]
+
+        return cls(movies_id, props, objs, pairs_keys // len(objs), pairs_keys % len(objs), indptr,
+                   keys % max(len(pairs_keys), 1), np.bincount(objs_codes, minlength=len(objs)), names)
+
+    def movie_pairs(self, movie_id: int):
+        """
+        Function that returns the interned properties of a movie
+        :param movie_id: movie id
+        :return: sorted int32 array with the pair ids of the movie, empty for movies that are not on the data set
+        """
+        try:
+            pos = self.positions[movie_id]
+        except KeyError:
+            return self.pairs[:0]
+
+        return self.pairs[self.indptr[pos]:self.indptr[pos + 1]]
+
+    def pair_strings(self, pairs: np.ndarray):
+        """
+        Function that returns the strings of interned pairs
+        :param pairs: pair ids
+        :return: tuple with the arrays of the property uris and of the objects of the pairs
+        """
+        return self.props[self.pair_prop[pairs]], self.objs[self.pair_obj[pairs]]
+
+    def incidence(self):
+        """
+        Function that encodes the properties of all movies as a binary movie x pair sparse matrix, it shares the
+        arrays of the vocabulary
+        :return: csr matrix with 1 where the movie has the pair and 0 otherwise
+        """
+        return sparse.csr_matrix((np.ones(len(self.pairs), dtype=np.int32), self.pairs, self.indptr),
+                                 shape=(len(self.movies_id), len(self.pair_prop)))
+
+    def name(self, movie_id: int):
+        """
+        Function that returns the foaf name of a movie
+        :param movie_id: movie id
+        :return: the name or None when the movie has no foaf name
+        """
+        return self.names.get(movie_id)
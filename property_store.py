@@ -0,0 +1,95 @@
+import sqlite3
+import time
+import pandas as pd
+import instrumentation
+import sparql_utils
+
+
+# A class that keeps the dbpedia properties of the movies in a local sqlite database keyed by the movie uri
+class PropertyStore:
+
+    def __init__(self, db_path: str = "./generated_files/all_movie_props.sqlite", ttl: float = None):
+        """
+        Constructor of the class
+        :param db_path: path of the sqlite database, created when it does not exist
+        :param ttl: seconds after which the properties of a movie are fetched again, None to never expire
+        """
+        self.db_path = db_path
+        self.ttl = ttl
+        with sqlite3.connect(self.db_path) as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS movies (uri TEXT PRIMARY KEY, fetched_at REAL NOT NULL)")
+            connection.execute("CREATE TABLE IF NOT EXISTS props (uri TEXT NOT NULL, prop TEXT NOT NULL, "
+                               "obj TEXT NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS props_uri ON props (uri)")
+
+    def stale_uris(self, movies_uri: list, now: float = None):
+        """
+        Function that returns the uris that were never fetched or whose properties expired
+        :param movies_uri: uris to check
+        :param now: current time in seconds since the epoch, None for the clock time
+        :return: list with the uris that must be fetched
+        """
+        now = time.time() if now is None else now
+        with sqlite3.connect(self.db_path) as connection:
+            fetched = pd.read_sql("SELECT uri, fetched_at FROM movies", connection).set_index('uri')['fetched_at']
+
+        fetched_at = fetched.reindex(pd.Index(movies_uri).unique())
+        stale = fetched_at.isnull()
+        if self.ttl is not None:
+            stale |= fetched_at < now - self.ttl
+
+        return fetched_at.index[stale].tolist()
+
+    def update(self, movies_uri: list, props: pd.DataFrame, fetched_at: float = None):
+        """
+        Function that replaces the properties of some movies, movies without properties are also recorded as fetched
+        :param movies_uri: uris of the fetched movies
+        :param props: data frame with the columns uri, prop and obj of the fetched movies
+        :param fetched_at: time of the fetch in seconds since the epoch, None for the clock time
+        :return: database updated
+        """
+        fetched_at = time.time() if fetched_at is None else fetched_at
+        with sqlite3.connect(self.db_path) as connection:
+            connection.executemany("DELETE FROM props WHERE uri = ?", [(uri,) for uri in movies_uri])
+            connection.executemany("INSERT OR REPLACE INTO movies (uri, fetched_at) VALUES (?, ?)",
+                                   [(uri, fetched_at) for uri in movies_uri])
+            connection.executemany("INSERT INTO props (uri, prop, obj) VALUES (?, ?, ?)",
+                                   props[['uri', 'prop', 'obj']].itertuples(index=False, name=None))
+
+    def refresh(self, movies_set: pd.DataFrame, endpoint: str = sparql_utils.DBPEDIA_ENDPOINT, **fetch_args):
+        """
+        Function that fetches from the dbpedia only the movies that are missing or expired on the store
+        :param movies_set: data set of movies with columns movie id and movie dbpedia uri
+        :param endpoint: url of the sparql endpoint
+        :param fetch_args: other arguments of sparql_utils.fetch_all_movie_props
+        :return: number of movies fetched
+        """
+        stale = movies_set[movies_set['dbpedia_uri'].isin(self.stale_uris(movies_set['dbpedia_uri']))]
+        stale = stale.drop_duplicates('dbpedia_uri')
+        instrumentation.count('property_store.hits', movies_set['dbpedia_uri'].nunique() - len(stale))
+        instrumentation.count('property_store.misses', len(stale))
+        if len(stale) == 0:
+            return 0
+
+        all_props, failures = sparql_utils.fetch_all_movie_props(stale, endpoint, **fetch_args)
+        props = pd.DataFrame(all_props, columns=['movie_id', 'prop', 'obj'])
+        props['uri'] = props['movie_id'].map(stale.set_index('movie_id')['dbpedia_uri'])
+
+        fetched = stale[~stale['movie_id'].isin(failures['movie_id'])]
+        self.update(fetched['dbpedia_uri'].tolist(), props)
+
+        return len(fetched)
+
+    def load(self, movies_set: pd.DataFrame):
+        """
+        Function that reads the properties of the movies of the data set
+        :param movies_set: data set of movies with columns movie id and movie dbpedia uri
+        :return: data frame with the columns movie_id, prop and obj, sorted by movie id
+        """
+        with sqlite3.connect(self.db_path) as connection:
+            props = pd.read_sql("SELECT uri, prop, obj FROM props ORDER BY rowid", connection)
+
+        movies = movies_set[['movie_id', 'dbpedia_uri']].rename(columns={'dbpedia_uri': 'uri'})
+        props = props.merge(movies, on='uri')
+
+        return props[['movie_id', 'prop', 'obj']].sort_values('movie_id', kind='stable').reset_index(drop=True)
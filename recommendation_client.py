@@ -0,0 +1,97 @@
+import argparse
+import json
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+
+
+# script that load tests the recommendation server with many concurrent requests and reports latency and throughput
+
+
+def request_recommendations(url: str, user_id: int, n: int = None, explain: int = 0, timeout: float = 30):
+    """
+    Function that asks the recommendations of a user to the server
+    :param url: base url of the server, e.g. http://127.0.0.1:8000
+    :param user_id: user to generate recommendation
+    :param n: number of recommendation items to return, None for the default of the server
+    :param explain: 1 to add the explanation of every recommendation and 0 otherwise
+    :param timeout: maximum seconds to wait for the answer
+    :return: dict answered by the server with the user_id and the list of recommendations
+    """
+    query = "user_id=" + str(user_id) + "&explain=" + str(explain)
+    if n is not None:
+        query += "&n=" + str(n)
+
+    with urllib.request.urlopen(url.rstrip("/") + "/recommend?" + query, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def server_stats(url: str):
+    """
+    Function that asks the latency and throughput measured by the server
+    :param url: base url of the server
+    :return: dict answered by the server
+    """
+    with urllib.request.urlopen(url.rstrip("/") + "/stats") as response:
+        return json.loads(response.read())
+
+
+def load_test(url: str, users_id: list, n_requests: int, concurrency: int, n: int = None, explain: int = 0,
+              seed: int = 0):
+    """
+    Function that sends requests of random users from many threads and measures the latency seen by the client
+    :param url: base url of the server
+    :param users_id: users the requests are drawn from
+    :param n_requests: total number of requests
+    :param concurrency: number of threads sending requests at the same time
+    :param n: number of recommendation items to return, None for the default of the server
+    :param explain: 1 to ask the explanations and 0 otherwise
+    :param seed: seed of the draw of the users
+    :return: dict with the number of requests and errors, the throughput in requests per second and the p50, p99
+    and max latencies in milliseconds
+    """
+    users = np.random.RandomState(seed).choice(np.asarray(users_id), n_requests)
+
+    def timed_request(user_id):
+        start = time.perf_counter()
+        try:
+            request_recommendations(url, int(user_id), n, explain)
+            error = False
+        except (urllib.error.URLError, OSError):
+            error = True
+        return time.perf_counter() - start, error
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(timed_request, users))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.asarray([latency for latency, _ in results]) * 1000
+    return {'requests': n_requests, 'errors': sum(error for _, error in results), 'concurrency': concurrency,
+            'seconds': elapsed, 'throughput': n_requests / elapsed, 'p50_ms': float(np.percentile(latencies, 50)),
+            'p99_ms': float(np.percentile(latencies, 99)), 'max_ms': float(latencies.max())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load tests the recommendation server")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--requests", type=int, default=1000, help="total number of requests")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32],
+                        help="numbers of concurrent clients, one load test per value")
+    parser.add_argument("--n", type=int, default=None, help="number of recommended items")
+    parser.add_argument("--explain", type=int, default=0, choices=[0, 1])
+    parser.add_argument("--test-set", default="./facebook_movies/testset.tsv", help="users of the requests")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    users_id = pd.read_csv(args.test_set, header=None, sep="\t", usecols=[0])[0].unique()
+    for concurrency in args.concurrency:
+        print(json.dumps(load_test(args.url, users_id, args.requests, concurrency, args.n, args.explain, args.seed)))
+    print(json.dumps({'server': server_stats(args.url)}))
+
+
+if __name__ == "__main__":
+    main()
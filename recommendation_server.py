@@ -0,0 +1,344 @@
+import argparse
+import collections
+import json
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+import instrumentation
+import lod_recommender
+from main import read_data_set
+from user_item_matrix import UserItemMatrix
+
+
+# A class that keeps a warm recommendation engine in memory and serves the requests of many threads, grouping the
+# requests that arrive together in micro batches for the batch scorer
+class RecommendationServer:
+
+    def __init__(self, engine: lod_recommender.JacLodRecommendationEngine, max_batch_size: int = 64,
+                 max_wait: float = 0.002, history: int = 100000):
+        """
+        Constructor of the class
+        :param engine: recommendation engine, only the batch thread of the server calls it
+        :param max_batch_size: maximum number of requests scored together
+        :param max_wait: seconds the first request of a batch waits for other requests
+        :param history: number of latest requests kept to calculate the latency percentiles
+        """
+        self.engine = engine
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.latencies = collections.deque(maxlen=history)
+        self.batch_sizes = collections.deque(maxlen=history)
+        self.served = 0
+        self.failed = 0
+        self.started_at = None
+        self.running = False
+        self.batcher = None
+        self.lock = threading.Lock()
+
+    def start(self, explanation_flag: int = 1):
+        """
+        Function that loads the model and starts the batch thread
+        :param explanation_flag: 1 to also load the explanation index and 0 otherwise
+        :return: server ready to receive requests
+        """
+        with instrumentation.span('server.warm_up', explanation=explanation_flag):
+            self.engine.warm_up(explanation_flag)
+
+        self.running = True
+        self.started_at = time.perf_counter()
+        self.batcher = threading.Thread(target=self.__batch_loop, name="recommendation-batcher", daemon=True)
+        self.batcher.start()
+
+    def stop(self):
+        """
+        Function that stops the batch thread after the batch it is serving, the requests still waiting on the queue
+        are answered with an error
+        :return: batch thread stopped
+        """
+        with self.lock:
+            self.running = False
+        if self.batcher is not None:
+            self.batcher.join()
+            self.batcher = None
+
+        while True:
+            try:
+                request = self.requests.get_nowait()
+            except queue.Empty:
+                break
+            request['error'] = RuntimeError("the server stopped before the recommendation of the user "
+                                            + str(request['user_id']))
+            with self.lock:
+                self.failed += 1
+            request['done'].set()
+
+    def recommend(self, user_id: int, n: int = None, explain: int = 0, timeout: float = None):
+        """
+        Function that recommends to a user, it blocks until the batch of the request is served
+        :param user_id: user to generate recommendation
+        :param n: number of recommendation items to return, at least 1, None for the n of the engine
+        :param explain: 1 to add the explanation of every recommendation and 0 otherwise
+        :param timeout: maximum seconds to wait, None to wait forever
+        :return: list of dicts with the keys rank, movie_id, score and, with explanations, explanation
+        """
+        n = self.engine.n if n is None else int(n)
+        if n < 1:
+            raise ValueError("n must be at least 1, got " + str(n))
+
+        request = {'user_id': user_id, 'n': n, 'explain': int(explain), 'received_at': time.perf_counter(),
+                   'done': threading.Event(), 'result': None, 'error': None}
+        # stop takes the lock to stop receiving, so a request put here is either served or answered by stop
+        with self.lock:
+            if not self.running:
+                raise RuntimeError("the server is not running, call start first")
+            self.requests.put(request)
+        if not request['done'].wait(timeout):
+            raise TimeoutError("the recommendation of the user " + str(user_id) + " timed out")
+
+        if request['error'] is not None:
+            raise request['error']
+
+        return request['result']
+
+    def __next_batch(self):
+        """
+        Function that waits for a request and collects the ones that arrive until the batch is full or the first
+        request waited max_wait seconds
+        :return: list of requests, empty when no request arrived
+        """
+        try:
+            batch = [self.requests.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self.requests.get(timeout=remaining) if remaining > 0 else self.requests.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def __batch_loop(self):
+        """
+        Function of the batch thread, it serves batches until the server stops
+        :return: requests answered
+        """
+        while self.running:
+            batch = self.__next_batch()
+            if len(batch) > 0:
+                self.__serve_batch(batch)
+
+    def __serve_batch(self, batch: list):
+        """
+        Function that answers a batch of requests, the requests with the same n and explanation flag are scored
+        together with one call to the engine
+        :param batch: list of requests
+        :return: result or error set on every request
+        """
+        known = self.engine.user_item.user_index.index
+        groups = collections.defaultdict(list)
+        for request in batch:
+            if request['user_id'] in known:
+                groups[(request['n'], request['explain'])].append(request)
+            else:
+                request['error'] = KeyError("unknown user " + str(request['user_id']))
+
+        with instrumentation.span('server.batch', requests=len(batch), groups=len(groups)):
+            for (n, explain), requests in groups.items():
+                users_id = list(dict.fromkeys(request['user_id'] for request in requests))
+                try:
+                    recommendations = self.engine.generate_recommendations(users_id, explain, len(users_id), n)
+                except Exception as error:
+                    for request in requests:
+                        request['error'] = error
+                    continue
+
+                results = {user_id: rows.drop(columns='user_id').to_dict('records')
+                           for user_id, rows in recommendations.groupby('user_id', sort=False)}
+                for request in requests:
+                    request['result'] = results.get(request['user_id'], [])
+
+        finished = time.perf_counter()
+        with self.lock:
+            self.batch_sizes.append(len(batch))
+            for request in batch:
+                self.latencies.append(finished - request['received_at'])
+                if request['error'] is None:
+                    self.served += 1
+                else:
+                    self.failed += 1
+
+        instrumentation.count('server.requests', len(batch))
+        for request in batch:
+            request['done'].set()
+
+    def stats(self):
+        """
+        Function that returns the latency and throughput of the server since it started
+        :return: dict with the number of requests, the throughput in requests per second, the mean batch size and
+        the p50, p99 and max latencies in milliseconds
+        """
+        with self.lock:
+            latencies = np.asarray(self.latencies) * 1000
+            batch_sizes = np.asarray(self.batch_sizes)
+            served, failed = self.served, self.failed
+
+        elapsed = time.perf_counter() - self.started_at if self.started_at is not None else 0
+        stats = {'served': served, 'failed': failed, 'uptime_seconds': elapsed,
+                 'throughput': (served + failed) / elapsed if elapsed > 0 else None,
+                 'mean_batch_size': float(batch_sizes.mean()) if len(batch_sizes) > 0 else None}
+        for name, q in [('p50_ms', 50), ('p99_ms', 99), ('max_ms', 100)]:
+            stats[name] = float(np.percentile(latencies, q)) if len(latencies) > 0 else None
+
+        return stats
+
+    def serve_http(self, host: str = "127.0.0.1", port: int = 8000, timeout: float = 30):
+        """
+        Function that answers the requests of a local http interface until the process is interrupted, see
+        _RequestHandler for the paths
+        :param host: address to listen
+        :param port: port to listen
+        :param timeout: maximum seconds a request waits for its recommendation before it is answered with 504
+        :return: http interface served
+        """
+        http_server = _HttpServer((host, port), _RequestHandler)
+        http_server.recommender = self
+        http_server.timeout_seconds = timeout
+        try:
+            http_server.serve_forever()
+        finally:
+            http_server.server_close()
+
+
+class _HttpServer(ThreadingHTTPServer):
+    """
+    Http server with one thread per connection and a listen queue long enough for many concurrent clients, the
+    default of 5 makes the extra connections wait a second to retry
+    """
+    daemon_threads = True
+    request_queue_size = 128
+    timeout_seconds = None
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """
+    Handler of the http interface, it answers json to the paths
+    /recommend?user_id=<id>&n=<n>&explain=<0 or 1>, /stats and /health
+    """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        recommender = self.server.recommender
+
+        if url.path == "/health":
+            self.__reply(200, {'status': "ok"})
+        elif url.path == "/stats":
+            self.__reply(200, recommender.stats())
+        elif url.path == "/recommend":
+            try:
+                user_id = int(query['user_id'])
+                n = int(query['n']) if 'n' in query else None
+                explain = int(query.get('explain', 0))
+            except (KeyError, ValueError):
+                self.__reply(400, {'error': "user_id must be an integer, n and explain are optional integers"})
+                return
+            if n is not None and n < 1:
+                self.__reply(400, {'error': "n must be at least 1"})
+                return
+
+            try:
+                recommendations = recommender.recommend(user_id, n, explain, self.server.timeout_seconds)
+            except KeyError as error:
+                self.__reply(404, {'error': str(error.args[0])})
+                return
+            except TimeoutError as error:
+                self.__reply(504, {'error': str(error)})
+                return
+            except Exception as error:
+                self.__reply(500, {'error': repr(error)})
+                return
+
+            self.__reply(200, {'user_id': user_id, 'recommendations': recommendations})
+        else:
+            self.__reply(404, {'error': "unknown path " + url.path})
+
+    def __reply(self, status: int, body: dict):
+        data = json.dumps(body, default=_to_json).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # one line per request on stderr would cost more than the recommendation itself
+        pass
+
+
+def _to_json(value):
+    """
+    Function that converts the numpy values of the recommendations to json
+    :param value: value that json can not serialize
+    :return: python value
+    """
+    if isinstance(value, np.generic):
+        value = value.item()
+        return None if isinstance(value, float) and np.isnan(value) else value
+
+    raise TypeError("can not serialize " + str(type(value)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves recommendations of a warm LOD engine over local http")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--k", type=int, default=5, help="number of neighbours")
+    parser.add_argument("--n", type=int, default=5, help="default number of recommended items")
+    parser.add_argument("--k-max", type=int, default=None, help="use the neighbour store of the given k_max")
+    parser.add_argument("--sim-matrix-format", default="csv", choices=["csv", "bin"])
+    parser.add_argument("--sim-matrix-path", default="./generated_files/sim_matrix.csv")
+    parser.add_argument("--model", default=None, help="directory of a model saved with save_model, instead of the "
+                                                         "data set and similarity files")
+    parser.add_argument("--no-explanations", action="store_true", help="do not load the explanation index")
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=2.0)
+    parser.add_argument("--request-timeout", type=float, default=30.0,
+                        help="seconds a request waits for its recommendation before a 504")
+    args = parser.parse_args()
+
+    if args.model is not None:
+        engine = lod_recommender.JacLodRecommendationEngine.load_model(args.model)
+    else:
+        cols = ['user_id', 'movie_id', 'interaction']
+        train_set = read_data_set("./facebook_movies/trainingset.tsv", cols)
+        test_set = read_data_set("./facebook_movies/testset.tsv", cols)
+        movies_set = read_data_set("./facebook_movies/mappingLinkedData.tsv", ['movie_id', 'dbpedia_uri'])
+        user_item = UserItemMatrix.from_interactions(train_set, movies_set['movie_id'].sort_values().tolist(),
+                                                     test_set["user_id"].unique())
+
+        engine = lod_recommender.JacLodRecommendationEngine(user_item, movies_set, test_set, args.k, args.n, 0, 0,
+                                                            sim_matrix_path=args.sim_matrix_path,
+                                                            sim_matrix_format=args.sim_matrix_format,
+                                                            k_max=args.k_max)
+    server = RecommendationServer(engine, args.max_batch_size, args.max_wait_ms / 1000)
+    server.start(0 if args.no_explanations else 1)
+    print("serving on http://" + args.host + ":" + str(args.port))
+    try:
+        server.serve_http(args.host, args.port, args.request_timeout)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        print(json.dumps(server.stats()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+import numpy as np
+import pandas as pd
+import instrumentation
+import matrix_store
+from neighbour_store import NeighbourStore
+from user_item_matrix import UserItemMatrix
+
+
+# utils functions lib to recommend to many users at once
+
+
+def profile_masks(user_item, users_id: list, movies_id: list):
+    """
+    Function that returns which movies each user interacted, in the order of the similarity matrix
+    :param user_item: sparse user item matrix or dense user x item data frame
+    :param users_id: users to get the profiles
+    :param movies_id: sorted list of all movie id on data set
+    :return: users x movies boolean array, true where the user interacted with the movie
+    """
+    if isinstance(user_item, UserItemMatrix):
+        return user_item.profile_masks(users_id, movies_id)
+
+    interactions = user_item.loc[users_id].reindex(columns=movies_id)
+    return interactions.values == 1
+
+
+def _score_dense(sim_values: np.ndarray, profiles: np.ndarray, k: int, scale: float = 1.0):
+    """
+    Function that scores a batch of users on a similarity matrix. The profiles are padded to the same size with -inf
+    similarities so the top k of every user is selected with a single partition over the batch
+    :param sim_values: movie x movie similarity matrix as a numpy array
+    :param profiles: users x movies boolean array of the profiles
+    :param k: number of neighbors
+    :param scale: scale of the stored values, see matrix_store.similarity_scale
+    :return: users x movies array with the prediction of every movie
+    """
+    sizes = profiles.sum(axis=1)
+    width = max(int(sizes.max()), 1)
+    curr_n = np.minimum(sizes, k)
+
+    # position of every profile movie of each user, padded with the position 0
+    padded = np.zeros((len(profiles), width), dtype=np.int64)
+    valid = np.arange(width)[None, :] < sizes[:, None]
+    padded[valid] = np.nonzero(profiles)[1]
+
+    profile_sims = np.asarray(sim_values[:, padded.ravel()], dtype=np.float64).reshape(-1, len(profiles), width)
+    if scale != 1:
+        profile_sims *= scale
+    profile_sims[:, ~valid] = -np.inf
+
+    top = min(k, width)
+    top_sims = -np.partition(-profile_sims, top - 1, axis=2)[:, :, :top]
+    top_sims[np.isinf(top_sims)] = 0
+
+    return np.divide(top_sims.sum(axis=2).T, curr_n[:, None], out=np.zeros((len(profiles), sim_values.shape[0])),
+                     where=curr_n[:, None] > 0)
+
+
+def _score_neighbours(store: NeighbourStore, profiles: np.ndarray, k: int):
+    """
+    Function that scores a batch of users on a neighbour store, counting the profile movies along the sorted
+    neighbours of every movie and keeping the first k
+    :param store: neighbour store
+    :param profiles: users x movies boolean array of the profiles
+    :param k: number of neighbors
+    :return: users x movies array with the prediction of every movie
+    """
+    curr_n = np.minimum(profiles.sum(axis=1), k)
+
+    # the padding -1 points to the extra column of the masks, which is never a profile movie
+    masks = np.zeros((len(profiles), profiles.shape[1] + 1), dtype=bool)
+    masks[:, :-1] = profiles
+    in_profile = masks[:, store.indices]
+    in_profile &= np.cumsum(in_profile, axis=2) <= k
+
+    sums = (in_profile * store.scores[None, :, :]).sum(axis=2, dtype=np.float64)
+    return np.divide(sums, curr_n[:, None], out=np.zeros_like(sums), where=curr_n[:, None] > 0)
+
+
+def score_users(sim_matrix, profiles: np.ndarray, k: int, memory_budget: int = 1 << 28):
+    """
+    Function that calculates the prediction of many users to like every movie, with the same rule as
+    calculate_prediction, in batches of users that fit in the memory budget
+    :param sim_matrix: similarity matrix or neighbour store
+    :param profiles: users x movies boolean array of the profiles, in the order of the similarity matrix
+    :param k: number of neighbors
+    :param memory_budget: maximum number of bytes of the intermediate arrays of a batch
+    :return: users x movies array with the prediction of every movie, profile movies included
+    """
+    n_movies = profiles.shape[1]
+    if isinstance(sim_matrix, NeighbourStore):
+        bytes_per_user = n_movies * sim_matrix.k_max * 9
+    else:
+        bytes_per_user = n_movies * max(int(profiles.sum(axis=1).max(initial=0)), 1) * 16
+
+    batch_size = max(1, memory_budget // bytes_per_user)
+    scores = np.empty(profiles.shape)
+    with instrumentation.span('scoring.score_users', users=len(profiles)):
+        for first in range(0, len(profiles), batch_size):
+            batch = profiles[first:first + batch_size]
+            if isinstance(sim_matrix, NeighbourStore):
+                scores[first:first + len(batch)] = _score_neighbours(sim_matrix, batch, k)
+            else:
+                scores[first:first + len(batch)] = _score_dense(sim_matrix.values, batch, k,
+                                                                matrix_store.similarity_scale(sim_matrix))
+
+    if instrumentation.enabled():
+        # every movie reads its k_max neighbours on a store and the similarity to every profile movie on a matrix
+        if isinstance(sim_matrix, NeighbourStore):
+            visited = len(profiles) * n_movies * sim_matrix.k_max
+        else:
+            visited = int(profiles.sum()) * n_movies
+        instrumentation.count('scoring.users', len(profiles))
+        instrumentation.count('scoring.items_scored', profiles.size)
+        instrumentation.count('scoring.neighbours_visited', visited)
+
+    return scores
+
+
+def _score_dense_grid(sim_values: np.ndarray, profiles: np.ndarray, k_values: list, scale: float = 1.0):
+    """
+    Function that scores a batch of users on a similarity matrix for many k at once, the profile movies of every
+    candidate are ordered once up to the largest k and the prefix sums of that order give the score of every k
+    :param sim_values: movie x movie similarity matrix as a numpy array
+    :param profiles: users x movies boolean array of the profiles
+    :param k_values: numbers of neighbors
+    :param scale: scale of the stored values, see matrix_store.similarity_scale
+    :return: k x users x movies array with the prediction of every movie for every k
+    """
+    sizes = profiles.sum(axis=1)
+    width = max(int(sizes.max()), 1)
+
+    padded = np.zeros((len(profiles), width), dtype=np.int64)
+    valid = np.arange(width)[None, :] < sizes[:, None]
+    padded[valid] = np.nonzero(profiles)[1]
+
+    profile_sims = np.asarray(sim_values[:, padded.ravel()], dtype=np.float64).reshape(-1, len(profiles), width)
+    if scale != 1:
+        profile_sims *= scale
+    profile_sims[:, ~valid] = -np.inf
+
+    top = min(max(k_values), width)
+    top_sims = -np.sort(np.partition(-profile_sims, top - 1, axis=2)[:, :, :top], axis=2)
+    top_sims[np.isinf(top_sims)] = 0
+    prefix_sums = np.cumsum(top_sims, axis=2)
+
+    scores = np.zeros((len(k_values), len(profiles), sim_values.shape[0]))
+    for i, k in enumerate(k_values):
+        curr_n = np.minimum(sizes, k)
+        np.divide(prefix_sums[:, :, min(k, width) - 1].T, curr_n[:, None], out=scores[i], where=curr_n[:, None] > 0)
+
+    return scores
+
+
+def _score_neighbours_grid(store: NeighbourStore, profiles: np.ndarray, k_values: list):
+    """
+    Function that scores a batch of users on a neighbour store for many k at once, the profile movies are counted
+    along the sorted neighbours once and every k keeps its first k
+    :param store: neighbour store
+    :param profiles: users x movies boolean array of the profiles
+    :param k_values: numbers of neighbors
+    :return: k x users x movies array with the prediction of every movie for every k
+    """
+    masks = np.zeros((len(profiles), profiles.shape[1] + 1), dtype=bool)
+    masks[:, :-1] = profiles
+    in_profile = masks[:, store.indices]
+    counts = np.cumsum(in_profile, axis=2)
+
+    scores = np.zeros((len(k_values), len(profiles), profiles.shape[1]))
+    for i, k in enumerate(k_values):
+        curr_n = np.minimum(profiles.sum(axis=1), k)
+        sums = ((in_profile & (counts <= k)) * store.scores[None, :, :]).sum(axis=2, dtype=np.float64)
+        np.divide(sums, curr_n[:, None], out=scores[i], where=curr_n[:, None] > 0)
+
+    return scores
+
+
+def score_users_grid(sim_matrix, profiles: np.ndarray, k_values: list, memory_budget: int = 1 << 28):
+    """
+    Function that calculates the prediction of many users to like every movie for many numbers of neighbors, with the
+    same rule as score_users but ordering the neighbors of every candidate only once
+    :param sim_matrix: similarity matrix or neighbour store
+    :param profiles: users x movies boolean array of the profiles, in the order of the similarity matrix
+    :param k_values: numbers of neighbors
+    :param memory_budget: maximum number of bytes of the intermediate arrays of a batch
+    :return: k x users x movies array with the prediction of every movie for every k, profile movies included
+    """
+    n_movies = profiles.shape[1]
+    if isinstance(sim_matrix, NeighbourStore):
+        bytes_per_user = n_movies * (sim_matrix.k_max * 17 + len(k_values) * 8)
+    else:
+        bytes_per_user = n_movies * (max(int(profiles.sum(axis=1).max(initial=0)), 1) * 24 + len(k_values) * 8)
+
+    batch_size = max(1, memory_budget // bytes_per_user)
+    scores = np.empty((len(k_values),) + profiles.shape)
+    with instrumentation.span('scoring.score_users_grid', users=len(profiles), k_values=len(k_values)):
+        for first in range(0, len(profiles), batch_size):
+            batch = profiles[first:first + batch_size]
+            if isinstance(sim_matrix, NeighbourStore):
+                scores[:, first:first + len(batch)] = _score_neighbours_grid(sim_matrix, batch, k_values)
+            else:
+                scores[:, first:first + len(batch)] = _score_dense_grid(sim_matrix.values, batch, k_values,
+                                                                        matrix_store.similarity_scale(sim_matrix))
+
+    instrumentation.count('scoring.users', len(profiles))
+    instrumentation.count('scoring.items_scored', profiles.size * len(k_values))
+
+    return scores
+
+
+def top_n(scores: np.ndarray, profiles: np.ndarray, n: int):
+    """
+    Function that ranks the movies the users did not interact with, ties are broken by movie position
+    :param scores: users x movies array with the predictions
+    :param profiles: users x movies boolean array of the profiles, these movies are never recommended
+    :param n: number of items recommended
+    :return: users x n arrays with the positions of the recommended movies and their scores, positions are -1 when a
+    user has less than n candidates
+    """
+    candidates = np.where(profiles, -np.inf, scores)
+    n = min(n, candidates.shape[1])
+
+    # the partition gives the n-th best score, the movies tied with it are taken by position so the top n is always
+    # the prefix of a bigger top n
+    nth_scores = -np.partition(-candidates, n - 1, axis=1)[:, n - 1:n]
+    above = candidates > nth_scores
+    tied = candidates == nth_scores
+    tied &= np.cumsum(tied, axis=1) <= n - above.sum(axis=1, keepdims=True)
+    best = np.nonzero(above | tied)[1].reshape(len(candidates), n)
+    best_scores = np.take_along_axis(candidates, best, axis=1)
+    order = np.lexsort((best, -best_scores), axis=1)
+    best = np.take_along_axis(best, order, axis=1)
+    best_scores = np.take_along_axis(best_scores, order, axis=1)
+
+    best[np.isinf(best_scores)] = -1
+    best_scores[np.isinf(best_scores)] = np.nan
+
+    return best, best_scores
+
+
+def top_n_reachable(store: NeighbourStore, profiles_pos: list, k: int, n: int):
+    """
+    Function that ranks the movies of many users scoring only the movies reachable from their profiles through the
+    reverse neighbour index, so the cost of a user grows with its profile size x k_max instead of the number of
+    movies. The ranking is the same as top_n on the scores of every movie
+    :param store: neighbour store
+    :param profiles_pos: list with the positions of the profile movies of every user
+    :param k: number of neighbors
+    :param n: number of items recommended
+    :return: users x n arrays with the positions of the recommended movies and their scores, positions are -1 when a
+    user has less than n candidates
+    """
+    n_movies = len(store.movies_id)
+    n = min(n, n_movies)
+    best = np.full((len(profiles_pos), n), -1, dtype=np.int64)
+    best_scores = np.full((len(profiles_pos), n), np.nan)
+
+    visited = 0
+    for i, profile_pos in enumerate(profiles_pos):
+        candidates = store.reachable(profile_pos)
+        scores = store.score_candidates(candidates, profile_pos, k)
+        visited += len(candidates)
+
+        # partial sort of the candidates, they are sorted by position so a stable order breaks ties by position
+        if len(candidates) > n:
+            nth_score = -np.partition(-scores, n - 1)[n - 1]
+            selected = np.flatnonzero(scores >= nth_score)
+            scores, candidates = scores[selected], candidates[selected]
+        order = np.argsort(-scores, kind='stable')[:n]
+        best[i, :len(order)] = candidates[order]
+        best_scores[i, :len(order)] = scores[order]
+
+        # every movie out of reach scores zero, the first ones by position complete the ranking
+        missing = min(n, n_movies - len(profile_pos)) - len(order)
+        if missing > 0:
+            taken = np.union1d(profile_pos, candidates)
+            first = np.arange(missing + len(taken))
+            best[i, len(order):len(order) + missing] = first[~np.isin(first, taken)][:missing]
+            best_scores[i, len(order):len(order) + missing] = 0
+
+    instrumentation.count('scoring.users', len(profiles_pos))
+    instrumentation.count('scoring.items_scored', visited)
+    instrumentation.count('scoring.neighbours_visited', visited * store.k_max)
+
+    return best, best_scores
+
+
+def recommendations_frame(users_id: list, movies_id: list, positions: np.ndarray, scores: np.ndarray):
+    """
+    Function that turns the ranked positions of a batch of users into a tidy data frame
+    :param users_id: users of the batch
+    :param movies_id: sorted list of all movie id on data set
+    :param positions: users x n positions of the recommended movies returned by top_n
+    :param scores: users x n scores of the recommended movies
+    :return: data frame with the columns user_id, rank, movie_id and score, one line per recommendation
+    """
+    valid = positions >= 0
+    rows, ranks = np.nonzero(valid)
+
+    return pd.DataFrame({'user_id': np.asarray(users_id)[rows],
+                         'rank': ranks + 1,
+                         'movie_id': np.asarray(movies_id)[positions[valid]],
+                         'score': scores[valid]})
+
+
+def write_recommendations(recommendations, file_path: str):
+    """
+    Function that writes recommendations to a csv or parquet file, chunk by chunk
+    :param recommendations: data frame or iterable of data frames returned by the recommenders
+    :param file_path: path of the file, parquet is used when it ends with .parquet and csv otherwise
+    :return: file with the recommendations
+    """
+    if isinstance(recommendations, pd.DataFrame):
+        recommendations = [recommendations]
+
+    if file_path.endswith(".parquet"):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        writer = None
+        for chunk in recommendations:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(file_path, table.schema)
+            writer.write_table(table)
+
+        if writer is not None:
+            writer.close()
+    else:
+        header = True
+        for chunk in recommendations:
+            chunk.to_csv(file_path, mode='w' if header else 'a', header=header, index=False)
+            header = False
@@ -0,0 +1,299 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from neighbour_store import NeighbourStore, top_k_neighbours
+from prop_vocabulary import PropVocabulary
+
+
+# utils similarity functions lib
+
+
+def movie_props_incidence(all_movie_props, movies_id: list):
+    """
+    Function that encodes the properties of all movies as a binary movie x (prop, obj) sparse matrix, where every
+    distinct (prop, obj) pair is interned to a column
+    :param all_movie_props: data frame indexed by movie id with the columns prop and obj, or its vocabulary
+    :param movies_id: sorted list of all movie id on data set, defines the row order of the matrix
+    :return: csr matrix with 1 where the movie has the (prop, obj) pair and 0 otherwise
+    """
+    if not isinstance(all_movie_props, PropVocabulary):
+        all_movie_props = PropVocabulary.from_data_frame(all_movie_props, movies_id)
+
+    return all_movie_props.incidence()
+
+
+def jaccard_from_incidence(incidence: sparse.csr_matrix):
+    """
+    Function that calculates the jaccard similarity of every pair of rows of a binary incidence matrix. The
+    intersections are obtained from one sparse product and the unions from the number of properties of each row
+    :param incidence: binary movie x (prop, obj) matrix
+    :return: numpy array of the movie per movie jaccard similarity with 1 on the diagonal
+    """
+    return jaccard_rows(incidence, 0, incidence.shape[0])
+
+
+def jaccard_rows(incidence: sparse.csr_matrix, first_row: int, last_row: int):
+    """
+    Function that calculates a block of rows of the jaccard similarity matrix
+    :param incidence: binary movie x (prop, obj) matrix
+    :param first_row: position of the first row of the block
+    :param last_row: position after the last row of the block
+    :return: numpy array with the jaccard similarity of the rows against every movie
+    """
+    return jaccard_rows_at(incidence, np.arange(first_row, last_row))
+
+
+def jaccard_rows_at(incidence: sparse.csr_matrix, rows_pos: np.ndarray):
+    """
+    Function that calculates some rows of the jaccard similarity matrix
+    :param incidence: binary movie x (prop, obj) matrix
+    :param rows_pos: positions of the rows
+    :return: numpy array with the jaccard similarity of the rows against every movie
+    """
+    intersection = (incidence[rows_pos] @ incidence.T).toarray().astype(np.float64)
+    counts = np.asarray(incidence.sum(axis=1), dtype=np.float64).ravel()
+    union = counts[rows_pos, None] + counts[None, :] - intersection
+
+    jaccard = np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+    jaccard[np.arange(len(rows_pos)), rows_pos] = 1
+
+    return jaccard
+
+
+def jaccard_neighbours(incidence: sparse.csr_matrix, movies_id: list, k_max: int, block_size: int = 1024):
+    """
+    Function that generates the k_max jaccard neighbours of every movie without materializing the full matrix
+    :param incidence: binary movie x (prop, obj) matrix
+    :param movies_id: sorted list of all movie id on data set
+    :param k_max: maximum number of neighbours kept per movie
+    :param block_size: number of rows of the matrix calculated at once
+    :return: neighbour store with the k_max most similar movies of every movie
+    """
+    n = len(movies_id)
+    k_max = min(k_max, max(n - 1, 1))
+    indices = np.empty((n, k_max), dtype=np.int32)
+    scores = np.empty((n, k_max), dtype=np.float32)
+
+    for first in range(0, n, block_size):
+        last = min(first + block_size, n)
+        indices[first:last], scores[first:last] = top_k_neighbours(jaccard_rows(incidence, first, last), first,
+                                                                       k_max)
+
+    return NeighbourStore(movies_id, indices, scores)
+
+
+def jaccard_similarity_matrix(all_movie_props, movies_id: list):
+    """
+    Function that generates the jaccard similarity matrix of all movies based on their dbpedia properties
+    :param all_movie_props: data frame indexed by movie id with the columns prop and obj, or its vocabulary
+    :param movies_id: sorted list of all movie id on data set
+    :return: movie per movie similarity matrix where 1 means more proximity and 0 otherwise
+    """
+    incidence = movie_props_incidence(all_movie_props, movies_id)
+    return pd.DataFrame(jaccard_from_incidence(incidence), index=movies_id, columns=movies_id)
+
+
+def normalized_items(interactions: sparse.csr_matrix):
+    """
+    Function that turns the user x item interactions into item x user rows with unit l2 norm, items without
+    interactions have zero norm and are kept as empty rows
+    :param interactions: users x movies sparse matrix of interactions
+    :return: csr matrix with the normalized interactions of every movie
+    """
+    items = sparse.csr_matrix(interactions.T, dtype=np.float64)
+    norms = np.sqrt(np.asarray(items.multiply(items).sum(axis=1)).ravel())
+    scale = np.divide(1, norms, out=np.zeros_like(norms), where=norms > 0)
+
+    return sparse.csr_matrix(sparse.diags(scale) @ items)
+
+
+def cosine_rows(items: sparse.csr_matrix, first_row: int, last_row: int):
+    """
+    Function that calculates a block of rows of the item x item cosine similarity matrix. Movies without
+    interactions have similarity 0 with every movie, themselves included
+    :param items: normalized item x user matrix returned by normalized_items
+    :param first_row: position of the first row of the block
+    :param last_row: position after the last row of the block
+    :return: numpy array with the cosine similarity of the rows against every movie
+    """
+    cosine = (items[first_row:last_row] @ items.T).toarray()
+
+    # rounding can leave the similarity of a movie with itself slightly above 1
+    return np.clip(cosine, 0, 1, out=cosine)
+
+
+def cosine_similarity_matrix(interactions: sparse.csr_matrix, movies_id: list, block_size: int = 1024):
+    """
+    Function that generates the item x item cosine similarity matrix from one sparse product per block of rows
+    :param interactions: users x movies sparse matrix of interactions, one column per movie of movies_id
+    :param movies_id: sorted list of all movie id on data set
+    :param block_size: number of rows of the matrix calculated at once
+    :return: movie per movie similarity matrix where 1 means more proximity and 0 otherwise
+    """
+    items = normalized_items(interactions)
+    sim_matrix = np.empty((len(movies_id), len(movies_id)))
+    for first in range(0, len(movies_id), block_size):
+        last = min(first + block_size, len(movies_id))
+        sim_matrix[first:last] = cosine_rows(items, first, last)
+
+    return pd.DataFrame(sim_matrix, index=movies_id, columns=movies_id)
+
+
+def cosine_neighbours(interactions: sparse.csr_matrix, movies_id: list, k_max: int, block_size: int = 1024):
+    """
+    Function that generates the k_max cosine neighbours of every movie without materializing the full matrix
+    :param interactions: users x movies sparse matrix of interactions, one column per movie of movies_id
+    :param movies_id: sorted list of all movie id on data set
+    :param k_max: maximum number of neighbours kept per movie
+    :param block_size: number of rows of the matrix calculated at once
+    :return: neighbour store with the k_max most similar movies of every movie
+    """
+    items = normalized_items(interactions)
+    n = len(movies_id)
+    k_max = min(k_max, max(n - 1, 1))
+    indices = np.empty((n, k_max), dtype=np.int32)
+    scores = np.empty((n, k_max), dtype=np.float32)
+
+    for first in range(0, n, block_size):
+        last = min(first + block_size, n)
+        indices[first:last], scores[first:last] = top_k_neighbours(cosine_rows(items, first, last), first, k_max)
+
+    return NeighbourStore(movies_id, indices, scores)
+
+
+def changed_positions(old_movies_id: list, movies_id: list, changed_movies_id: list):
+    """
+    Function that returns the positions of the movies whose similarities must be calculated again, the changed
+    movies and the movies added to the data set
+    :param old_movies_id: sorted movie ids of the stored model
+    :param movies_id: sorted list of all movie id on data set
+    :param changed_movies_id: movies whose properties changed
+    :return: sorted positions in movies_id of the changed and added movies
+    """
+    movies_id = pd.Index(movies_id)
+    changed = pd.Index(changed_movies_id).union(movies_id.difference(pd.Index(old_movies_id)))
+    return np.sort(movies_id.get_indexer(changed.intersection(movies_id)))
+
+
+def update_jaccard_matrix(sim_matrix: pd.DataFrame, incidence: sparse.csr_matrix, movies_id: list,
+                          changed_movies_id: list):
+    """
+    Function that updates a jaccard similarity matrix after movies were added or their properties changed, only the
+    rows and columns of these movies are calculated, removed movies are dropped
+    :param sim_matrix: stored movie x movie similarity matrix
+    :param incidence: binary movie x (prop, obj) matrix of the current properties
+    :param movies_id: sorted list of all movie id on data set
+    :param changed_movies_id: movies whose properties changed, added movies do not need to be listed
+    :return: the similarity matrix patched, in place when no movie was added or removed
+    """
+    positions = changed_positions(sim_matrix.index, movies_id, changed_movies_id)
+    if not sim_matrix.index.equals(pd.Index(movies_id)):
+        sim_matrix = sim_matrix.reindex(index=movies_id, columns=movies_id, fill_value=0)
+
+    rows = jaccard_rows_at(incidence, positions)
+    sim_matrix.iloc[positions, :] = rows
+    sim_matrix.iloc[:, positions] = rows.T
+
+    return sim_matrix
+
+
+def update_jaccard_neighbours(store: NeighbourStore, incidence: sparse.csr_matrix, movies_id: list,
+                              changed_movies_id: list, block_size: int = 1024):
+    """
+    Function that updates a jaccard neighbour store after movies were added, removed or their properties changed.
+    The changed movies get new neighbour lists, every other list drops the changed movies and merges their new
+    similarities. A full list whose merged k_max-th similarity falls below its old one may miss a movie that was not
+    stored, so only those lists are calculated again. Ties are broken by position as on jaccard_neighbours, so the
+    update gives the same store as a rebuild
+    :param store: stored neighbour store
+    :param incidence: binary movie x (prop, obj) matrix of the current properties
+    :param movies_id: sorted list of all movie id on data set
+    :param changed_movies_id: movies whose properties changed, added movies do not need to be listed
+    :param block_size: number of rows calculated at once for the lists calculated again
+    :return: new neighbour store
+    """
+    n = len(movies_id)
+    # a store that kept every movie has less columns after movies are removed, the extra ones would be empty
+    k_max = min(store.k_max, max(n - 1, 1))
+    positions = changed_positions(store.movies_id, movies_id, changed_movies_id)
+
+    # move the stored lists to the positions of the new data set, removed movies become -1
+    old_rows = pd.Index(movies_id).get_indexer(store.movies_id)
+    kept = old_rows >= 0
+    indices = np.full((n, k_max), -1, dtype=np.int64)
+    scores = np.zeros((n, k_max), dtype=np.float32)
+    indices[old_rows[kept]] = store.indices[kept, :k_max]
+    scores[old_rows[kept]] = store.scores[kept, :k_max]
+    valid = indices >= 0
+    indices[valid] = old_rows[indices[valid]]
+
+    full = np.zeros(n, dtype=bool)
+    full[old_rows[kept]] = store.indices[kept, k_max - 1] >= 0
+    old_kth = np.zeros(n, dtype=np.float32)
+    old_kth[old_rows[kept]] = store.scores[kept, k_max - 1]
+    old_kth_index = np.full(n, -1, dtype=np.int64)
+    old_kth_index[full] = indices[full, k_max - 1]
+
+    # drop removed and changed movies from the lists and merge the new similarities of the changed movies
+    changed = np.zeros(n + 1, dtype=bool)
+    changed[positions] = True
+    dropped = (indices < 0) | changed[indices]
+    merged_scores = np.concatenate([np.where(dropped, -np.inf, scores), np.zeros((n, len(positions)), np.float32)],
+                                   axis=1)
+    merged_indices = np.concatenate([np.where(dropped, -1, indices), np.tile(positions, (n, 1))], axis=1)
+
+    # the similarities are compared as float32, as the store keeps them, so ties are the same as on a rebuild
+    rows = jaccard_rows_at(incidence, positions)
+    merged_scores[:, k_max:] = rows.T
+    merged_scores[positions, k_max + np.arange(len(positions))] = -np.inf
+    merged_scores[~(merged_scores > 0)] = -np.inf
+
+    # sort by decreasing similarity and by position on ties before keeping the first k_max
+    order = np.lexsort((merged_indices, -merged_scores), axis=1)[:, :k_max]
+    new_scores = np.take_along_axis(merged_scores, order, axis=1)
+    new_indices = np.take_along_axis(merged_indices, order, axis=1)
+    empty = np.isinf(new_scores)
+    new_indices[empty] = -1
+    new_scores[empty] = 0
+
+    new_indices[positions], new_scores[positions] = top_k_neighbours(rows, positions, k_max)
+
+    # full lists whose k_max-th neighbour now comes after the old one may miss movies that were not stored
+    later = (new_scores[:, -1] < old_kth) | ((new_scores[:, -1] == old_kth) & (new_indices[:, -1] > old_kth_index))
+    recalculate = np.flatnonzero(full & later)
+    recalculate = np.setdiff1d(recalculate, positions)
+    for first in range(0, len(recalculate), block_size):
+        block = recalculate[first:first + block_size]
+        new_indices[block], new_scores[block] = top_k_neighbours(jaccard_rows_at(incidence, block), block, k_max)
+
+    return NeighbourStore(movies_id, new_indices, new_scores)
+
+
+def check_incremental_update(old_movie_props: pd.DataFrame, old_movies_id: list, movie_props: pd.DataFrame,
+                             movies_id: list, changed_movies_id: list, k_max: int = None):
+    """
+    Function that checks the incremental update against a full rebuild, meant for small data sets
+    :param old_movie_props: properties of the movies before the change, indexed by movie id
+    :param old_movies_id: sorted movie ids before the change
+    :param movie_props: properties of the movies after the change, indexed by movie id
+    :param movies_id: sorted movie ids after the change
+    :param changed_movies_id: movies whose properties changed
+    :param k_max: number of neighbours to check the neighbour store update, None to check the full matrix. The rebuild
+    uses the number of neighbours of the updated store, which keeps the k_max of the old data set when it was clipped
+    to its number of movies
+    :return: dict with the maximum absolute difference of similarities and the number of different neighbours
+    """
+    incidence = movie_props_incidence(movie_props, movies_id)
+    if k_max is None:
+        updated = update_jaccard_matrix(jaccard_similarity_matrix(old_movie_props, old_movies_id), incidence,
+                                        movies_id, changed_movies_id)
+        rebuilt = jaccard_similarity_matrix(movie_props, movies_id)
+        return {'max_difference': float(np.abs(updated.values - rebuilt.values).max()), 'different_neighbours': 0}
+
+    old_incidence = movie_props_incidence(old_movie_props, old_movies_id)
+    updated = update_jaccard_neighbours(jaccard_neighbours(old_incidence, old_movies_id, k_max), incidence,
+                                        movies_id, changed_movies_id)
+    rebuilt = jaccard_neighbours(incidence, movies_id, updated.k_max)
+
+    return {'max_difference': float(np.abs(updated.scores - rebuilt.scores).max()),
+            'different_neighbours': int((updated.indices != rebuilt.indices).sum())}
@@ -1,23 +1,20 @@
+import os
 import pandas as pd
-import re
-from SPARQLWrapper import SPARQLWrapper, JSON
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from SPARQLWrapper import SPARQLWrapper, JSON, POST
+import instrumentation
+from movie_metadata import MovieMetadata, name_from_uri
 
 
 # utils sparql functions lib
 
 
-def get_props_of_movie_from_dbpedia(movie_id: int, movie_uri: str):
-    """
-    Function that obtains the tuples (properties, resources) of a movie form its' uri
-    :param movie_id: id of the movie on the data set
-    :param movie_uri: path to the movie resource from dbpedia
-    :return: dict with properties of movies, along with its' movie id
-    """
+DBPEDIA_ENDPOINT = "http://dbpedia.org/sparql"
 
-    print(movie_uri)
 
-    sparql = SPARQLWrapper("http://dbpedia.org/sparql")
-    sparql.setQuery("""
+PREFIXES = """
     PREFIX owl: <http://www.w3.org/2002/07/owl#>
     PREFIX xsd: <http://www.w3.org/2001/XMLSchema#>
     PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
@@ -29,41 +26,254 @@ def get_props_of_movie_from_dbpedia(movie_id: int, movie_uri: str):
     PREFIX dbpedia: <http://dbpedia.org/>       
     PREFIX dct:	<http://purl.org/dc/terms/> 
     PREFIX ns:<http://www.w3.org/ns/prov#>    
-    SELECT DISTINCT *
-    WHERE { 
-        <""" + movie_uri + """> ?prop ?obj.
+"""
+
+PROPS_FILTER = """
         FILTER( 
             ?prop = dbo:cinematography || ?prop = dbo:director || ?prop = dbo:distributor || 
             ?prop = dbo:editing || ?prop = dbo:musicComposer || ?prop = dbo:producer || 
             ?prop = dbo:starring || ?prop = dct:subject || ?prop = foaf:name
         )   
-    }
-    """)
+"""
+
+
+def props_query(movie_uri: str):
+    """
+    Function that returns the sparql query of the tuples (properties, resources) of a movie
+    :param movie_uri: path to the movie resource from dbpedia
+    :return: sparql query
+    """
+    return PREFIXES + """
+    SELECT DISTINCT *
+    WHERE { 
+        <""" + movie_uri + """> ?prop ?obj.""" + PROPS_FILTER + """    }
+    """
+
+
+def props_query_batch(movies_uri: list):
+    """
+    Function that returns the sparql query of the tuples (movie, properties, resources) of many movies at once
+    :param movies_uri: paths to the movies resources from dbpedia
+    :return: sparql query
+    """
+    values = " ".join("<" + movie_uri + ">" for movie_uri in movies_uri)
+    return PREFIXES + """
+    SELECT DISTINCT ?movie ?prop ?obj
+    WHERE { 
+        VALUES ?movie { """ + values + """ }
+        ?movie ?prop ?obj.""" + PROPS_FILTER + """    }
+    """
 
+
+def new_sparql_wrapper(endpoint: str = DBPEDIA_ENDPOINT):
+    """
+    Function that creates a sparql wrapper that returns json and keeps its connection alive between queries when
+    the keepalive lib is installed
+    :param endpoint: url of the sparql endpoint
+    :return: sparql wrapper
+    """
+    sparql = SPARQLWrapper(endpoint)
     sparql.setReturnFormat(JSON)
+    sparql.setUseKeepAlive()
+    return sparql
+
+
+def get_props_of_movie_from_dbpedia(movie_id: int, movie_uri: str, endpoint: str = DBPEDIA_ENDPOINT,
+                                    sparql: SPARQLWrapper = None):
+    """
+    Function that obtains the tuples (properties, resources) of a movie form its' uri
+    :param movie_id: id of the movie on the data set
+    :param movie_uri: path to the movie resource from dbpedia
+    :param endpoint: url of the sparql endpoint
+    :param sparql: sparql wrapper to reuse, None to create a new one
+    :return: dict with properties of movies, along with its' movie id
+    """
+    if sparql is None:
+        sparql = new_sparql_wrapper(endpoint)
+
+    instrumentation.count('sparql.requests')
+    sparql.setQuery(props_query(movie_uri))
     results = sparql.query().convert()
+    instrumentation.count('sparql.rows', len(results["results"]["bindings"]))
 
     list_results = results_to_dict(movie_id, results)
     return list_results
 
 
-def obtain_all_movie_props(movies_set: pd.DataFrame, cols: list):
+def get_props_of_movies_from_dbpedia(movies: list, endpoint: str = DBPEDIA_ENDPOINT,
+                                     sparql: SPARQLWrapper = None):
+    """
+    Function that obtains the tuples (properties, resources) of many movies with a single query
+    :param movies: list of tuples (movie id, movie uri)
+    :param endpoint: url of the sparql endpoint
+    :param sparql: sparql wrapper to reuse, None to create a new one
+    :return: dict with properties of movies, along with their movie id, and the number of rows returned
+    """
+    if sparql is None:
+        sparql = new_sparql_wrapper(endpoint)
+
+    movies_of_uri = {}
+    for movie_id, movie_uri in movies:
+        movies_of_uri.setdefault(movie_uri, []).append(movie_id)
+
+    # long VALUES blocks do not fit in the url of a GET request
+    sparql.setMethod(POST)
+    instrumentation.count('sparql.requests')
+    sparql.setQuery(props_query_batch(list(movies_of_uri.keys())))
+    results = sparql.query().convert()
+    instrumentation.count('sparql.rows', len(results["results"]["bindings"]))
+
+    return results_to_dict(None, results, movies_of_uri), len(results["results"]["bindings"])
+
+
+# A class that spaces requests so that no more than a number of them start per second
+class RateLimiter:
+
+    def __init__(self, requests_per_second: float):
+        """
+        Constructor of the class
+        :param requests_per_second: maximum number of requests per second, None or 0 for no limit
+        """
+        self.interval = 1 / requests_per_second if requests_per_second else 0
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """
+        Function that blocks the calling thread until it may start a request
+        :return: the thread is released
+        """
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+
+        time.sleep(start - now)
+
+
+def fetch_all_movie_props(movies_set: pd.DataFrame, endpoint: str = DBPEDIA_ENDPOINT, max_workers: int = 8,
+                          requests_per_second: float = 10, retries: int = 4, backoff: float = 1,
+                          failures_path: str = None, batch_size: int = 50, result_limit: int = 10000):
+    """
+    Function that obtains the properties of many movies from the dbpedia concurrently. Every thread reuses its own
+    sparql wrapper, failed requests are retried with exponential backoff and movies that still fail are recorded.
+    Movies are queried in batches, a batch whose result reaches the result size limit of the endpoint may have been
+    truncated, so it is split in half and the next batches are smaller until results fit again. A batch that still
+    fails after the retries is also split, until the movies that fail are isolated
+    :param movies_set: data set of movies with columns movie id and movie dbpedia uri
+    :param endpoint: url of the sparql endpoint
+    :param max_workers: maximum number of requests in flight
+    :param requests_per_second: maximum number of requests started per second, None for no limit
+    :param retries: number of retries of a failed request
+    :param backoff: seconds waited before the first retry, doubled on every next retry
+    :param failures_path: csv file where the movies that failed are written, to fetch them again later
+    :param batch_size: maximum number of movies per query, 1 to send one query per movie
+    :param result_limit: maximum number of rows the endpoint returns for a query
+    :return: list of dictionaries with the properties of the movies and data frame of the movies that failed
+    """
+    limiter = RateLimiter(requests_per_second)
+    local = threading.local()
+
+    def query(batch: list):
+        if not hasattr(local, 'sparql'):
+            local.sparql = new_sparql_wrapper(endpoint)
+
+        for attempt in range(0, retries + 1):
+            limiter.wait()
+            try:
+                if len(batch) == 1:
+                    return get_props_of_movie_from_dbpedia(batch[0][0], batch[0][1], endpoint, local.sparql), 0
+                return get_props_of_movies_from_dbpedia(batch, endpoint, local.sparql)
+            except Exception:
+                instrumentation.count('sparql.errors')
+                if attempt == retries:
+                    raise
+                instrumentation.count('sparql.retries')
+                time.sleep(backoff * 2 ** attempt)
+
+    def fetch(batch: list):
+        try:
+            props, n_rows = query(batch)
+        except Exception as e:
+            if len(batch) == 1:
+                return [], False, [(batch[0], e)]
+            n_rows = None
+
+        # a failed batch is split as well, so a single bad uri does not fail the whole batch
+        if len(batch) > 1 and (n_rows is None or n_rows >= result_limit):
+            instrumentation.count('sparql.split_batches')
+            half = len(batch) // 2
+            first_props, _, first_failures = fetch(batch[:half])
+            second_props, _, second_failures = fetch(batch[half:])
+            return first_props + second_props, n_rows is not None, first_failures + second_failures
+
+        return props, False, []
+
+    movies = list(zip(movies_set['movie_id'], movies_set['dbpedia_uri']))
+    all_props = []
+    failures = []
+    size = batch_size
+    position = 0
+    with instrumentation.span('sparql.fetch_all_movie_props', movies=len(movies)), \
+            ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        while position < len(movies) or len(futures) > 0:
+            while position < len(movies) and len(futures) < max_workers:
+                batch = movies[position:position + size]
+                position = position + len(batch)
+                futures[executor.submit(fetch, batch)] = batch
+
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch = futures.pop(future)
+                props, truncated, batch_failures = future.result()
+                all_props.extend(props)
+                size = max(1, size // 2) if truncated else min(batch_size, size * 2)
+                failures.extend({'movie_id': movie[0], 'dbpedia_uri': movie[1], 'error': repr(e)}
+                                for movie, e in batch_failures)
+                instrumentation.event('sparql.batch_done', movies=[int(movie) for movie, _ in batch],
+                                      failures=len(batch_failures))
+
+    failures = pd.DataFrame(failures, columns=['movie_id', 'dbpedia_uri', 'error'])
+    instrumentation.count('sparql.failed_movies', len(failures))
+    if failures_path is not None:
+        failures.to_csv(failures_path, mode='w', index=False)
+
+    return all_props, failures
+
+
+def read_failures(movies_set: pd.DataFrame, failures_path: str):
+    """
+    Function that returns the movies recorded as failed by fetch_all_movie_props, to fetch only them again
+    :param movies_set: data set of movies with columns movie id and movie dbpedia uri
+    :param failures_path: csv file written by fetch_all_movie_props
+    :return: the movies of the data set that failed
+    """
+    failures = pd.read_csv(failures_path)
+    return movies_set[movies_set['movie_id'].isin(failures['movie_id'])]
+
+
+def obtain_all_movie_props(movies_set: pd.DataFrame, cols: list, endpoint: str = DBPEDIA_ENDPOINT,
+                           max_workers: int = 8, requests_per_second: float = 10,
+                           failures_path: str = None, batch_size: int = 50):
     """
     Function that obtains the properties of all movies from the dbpedia
     :param movies_set: data set of movies with columns movie id and movie dbpedia uri
     :param cols: columns of data frame with all movie properties
-    :return: a data frame with all movie properties
+    :param endpoint: url of the sparql endpoint
+    :param max_workers: maximum number of requests in flight
+    :param requests_per_second: maximum number of requests started per second
+    :param failures_path: csv file where the movies that failed are written
+    :param batch_size: maximum number of movies per query
+    :return: tuple with a data frame with all movie properties and a data frame with the movie_id, dbpedia_uri and
+    error of the movies that failed, their properties are missing from the first one
     """
-    movies_id = movies_set['movie_id'].to_list()
-    movies_id.sort()
-    all_movie_props = pd.DataFrame(columns=cols)
-    for movie in movies_id:
-        movie_uri = movies_set.loc[movie]['dbpedia_uri']
-        props_list_dic = get_props_of_movie_from_dbpedia(movie, movie_uri)
-        all_movie_props = all_movie_props.append(props_list_dic, ignore_index=True)
-        print("Obtained data of movie: " + str(movie))
+    movies_set = movies_set.sort_values('movie_id')
+    all_props, failures = fetch_all_movie_props(movies_set, endpoint, max_workers, requests_per_second,
+                                                failures_path=failures_path, batch_size=batch_size)
+    all_movie_props = pd.DataFrame(all_props, columns=cols)
 
-    return all_movie_props
+    return all_movie_props.sort_values(cols[0], kind='stable').reset_index(drop=True), failures
 
 
 def movie_props_tolist(movie_id: int, all_movies_props: pd.DataFrame):
@@ -77,9 +287,9 @@ def movie_props_tolist(movie_id: int, all_movies_props: pd.DataFrame):
     try:
         movie_props = all_movies_props.loc[movie_id]
 
-        # when movie_props size is two, it means that there is only one line of return
-        # and the command on line 63 wont work
-        if len(movie_props) > 2:
+        # when movie_props is a series, it means that there is only one line of return
+        # and the list comprehension below wont work
+        if isinstance(movie_props, pd.DataFrame):
             movie_tuples = [tuple(x) for x in movie_props.to_numpy()]
         else:
             movie_tuples = [(movie_props[0], movie_props[1])]
@@ -90,63 +300,143 @@ def movie_props_tolist(movie_id: int, all_movies_props: pd.DataFrame):
     return movie_tuples
 
 
-def get_all_movie_props(movies_set: pd.DataFrame, flag: int, file_path: str):
+def _write_csv(all_movie_props: pd.DataFrame, file_path: str):
+    """
+    Function that replaces a csv file of properties at once, so a reader never sees half of it
+    :param all_movie_props: data frame with the columns movie_id, prop and obj
+    :param file_path: path of the csv file
+    :return: csv file written
+    """
+    all_movie_props.to_csv(file_path + ".tmp", mode='w', header=False, index=False)
+    os.replace(file_path + ".tmp", file_path)
+
+
+def refresh_movie_props_csv(movies_set: pd.DataFrame, cols: list, file_path: str, endpoint: str = DBPEDIA_ENDPOINT):
     """
-    Function that returns the data frame of all movie properties from dbpedia
+    Function that fetches the properties of all movies into a csv file. When some movies fail, the rows already
+    fetched are kept on file_path + ".partial" and the failed movies on file_path + ".failures.csv", the csv file is
+    not changed and a RuntimeError is raised. The next call with the same movies fetches only the failed movies and
+    merges them with the partial rows
     :param movies_set: data set of movies with columns movie id and movie dbpedia uri
-    :param flag: 1 to generate the data frame from scratch and 0 to read from file
+    :param cols: columns of data frame with all movie properties
+    :param file_path: path of the csv file
+    :param endpoint: url of the sparql endpoint
+    :return: the data frame of all movie properties, also written to the csv file
+    """
+    partial_path = file_path + ".partial"
+    failures_path = file_path + ".failures.csv"
+
+    if os.path.exists(partial_path) and os.path.exists(failures_path):
+        partial = pd.read_csv(partial_path, header=None, names=cols)
+        missing = read_failures(movies_set, failures_path)
+        partial = partial[partial[cols[0]].isin(movies_set['movie_id']) & ~partial[cols[0]].isin(missing['movie_id'])]
+        instrumentation.count('props.resumed_movies', len(missing))
+    else:
+        partial = pd.DataFrame([], columns=cols)
+        missing = movies_set
+
+    fetched, failures = obtain_all_movie_props(missing, cols, endpoint)
+    all_movie_props = pd.concat([partial, fetched], ignore_index=True)
+    all_movie_props = all_movie_props.sort_values(cols[0], kind='stable').reset_index(drop=True)
+
+    if len(failures) > 0:
+        # the partial rows are written before the failures, a crash in between only fetches again the movies
+        # that were already failed
+        _write_csv(all_movie_props, partial_path)
+        failures.to_csv(failures_path + ".tmp", mode='w', index=False)
+        os.replace(failures_path + ".tmp", failures_path)
+        raise RuntimeError("the properties of " + str(len(failures)) + " movies could not be fetched, " + file_path
+                           + " was not changed, the movies are listed on " + failures_path + " and the next call "
+                           "fetches only them")
+
+    _write_csv(all_movie_props, file_path)
+    for path in [partial_path, failures_path]:
+        if os.path.exists(path):
+            os.remove(path)
+
+    return all_movie_props
+
+
+def get_all_movie_props(movies_set: pd.DataFrame, flag: int, file_path: str, endpoint: str = DBPEDIA_ENDPOINT,
+                        ttl: float = None):
+    """
+    Function that returns the data frame of all movie properties from dbpedia. When the file path ends with .sqlite
+    the properties are kept in a property store and only missing or expired movies are fetched. A csv file is only
+    replaced when the properties of every movie were fetched, see refresh_movie_props_csv to resume after failures
+    :param movies_set: data set of movies with columns movie id and movie dbpedia uri
+    :param flag: 1 to generate the data frame from scratch, or update the store, and 0 to read from file
     :param file_path: file path to read if flag is not 0
+    :param endpoint: url of the sparql endpoint used when flag is 1
+    :param ttl: seconds after which the properties of a movie on the store expire, None to never expire
     :return: the data frame of all movie properties from dbpedia
     """
     cols = ['movie_id', 'prop', 'obj']
-    if flag == 1:
-        all_movie_props = obtain_all_movie_props(movies_set, cols)
-        all_movie_props.to_csv(file_path, mode='w', header=False, index=False)
-    else:
-        all_movie_props = pd.read_csv(file_path, header=None)
-        all_movie_props.columns = cols
+    with instrumentation.span('props.load', flag=flag, path=file_path):
+        if file_path.endswith(".sqlite"):
+            from property_store import PropertyStore
 
-    all_movie_props = all_movie_props.set_index(cols[0])
+            store = PropertyStore(file_path, ttl)
+            if flag == 1:
+                store.refresh(movies_set, endpoint)
+            all_movie_props = store.load(movies_set)
+        elif flag == 1:
+            all_movie_props = refresh_movie_props_csv(movies_set, cols, file_path, endpoint)
+        else:
+            all_movie_props = pd.read_csv(file_path, header=None)
+            all_movie_props.columns = cols
+
+        all_movie_props = all_movie_props.set_index(cols[0])
+        instrumentation.count('props.rows', len(all_movie_props))
 
     return all_movie_props
 
 
-def results_to_dict(movie_id: int, props_movie: dict):
+def results_to_dict(movie_id: int, props_movie: dict, movies_of_uri: dict = None):
     """
     Function that returns vector of dictionaries with the results from the dbpedia to insert into data frame of all
     movie properties
-    :param movie_id: movie id of the movie
+    :param movie_id: movie id of the movie, ignored for results of a batch query
     :param props_movie: properties returned from dbpedia
+    :param movies_of_uri: for results of a batch query, dict from the movie uri to the list of its movie ids
     :return: vector of dictionaries with the results from the dbpedia
     """
     filter_props = []
     for p in props_movie["results"]["bindings"]:
-        dict_props = {'movie_id': movie_id, "prop": p["prop"]["value"], "obj": p["obj"]["value"]}
-        filter_props.append(dict_props)
+        if movies_of_uri is None:
+            movies_id = [movie_id]
+        else:
+            movies_id = movies_of_uri.get(p["movie"]["value"], [])
+
+        for movie in movies_id:
+            dict_props = {'movie_id': movie, "prop": p["prop"]["value"], "obj": p["obj"]["value"]}
+            filter_props.append(dict_props)
 
     return filter_props
 
 
-def get_movie_name(all_movie_props: pd.DataFrame, movies_set: pd.DataFrame, movie_id: int):
+def get_movie_name(all_movie_props, movies_set: pd.DataFrame, movie_id: int):
     """
     Function that return the movie name
-    :param all_movie_props: properties of all movies from dbpedia
+    :param all_movie_props: properties of all movies from dbpedia, as a data frame or as a prop vocabulary, or the
+    movie metadata of the model, which answers without scanning the properties
     :param movies_set: set of movies on data set with movie id and dbpedia uri
     :param movie_id: movie id
     :return: the movie name
     """
+    instrumentation.count('names.lookups')
+    if isinstance(all_movie_props, MovieMetadata):
+        return all_movie_props.name(movie_id)
+
     try:
-        movie_props = all_movie_props.loc[movie_id]
-        name = movie_props.loc[movie_props['prop'] == "http://xmlns.com/foaf/0.1/name"]['obj'].values[0]
+        if isinstance(all_movie_props, pd.DataFrame):
+            movie_props = all_movie_props.loc[movie_id]
+            name = movie_props.loc[movie_props['prop'] == "http://xmlns.com/foaf/0.1/name"]['obj'].values[0]
+        else:
+            name = all_movie_props.name(movie_id)
+            if name is None:
+                raise KeyError(movie_id)
 
     except (KeyError, IndexError) as e:
-        movie_uri = movies_set.loc[movie_id]['dbpedia_uri']
-        reg = r'\([\s\S]*\)'
-        separated = movie_uri.split("/")
-        most_important = separated[-1]
-        most_important = re.sub(reg, '', most_important)
-        name = most_important.replace("_", " ")
-        if name[-1] == " ":
-            name = name[:-1]
+        name = name_from_uri(movies_set.loc[movie_id]['dbpedia_uri'])
 
     return name
@@ -0,0 +1,146 @@
+import os
+import numpy as np
+import pandas as pd
+
+
+# utils functions lib to generate synthetic data sets with the layout of the facebook_movies files
+
+PROPS = ["http://purl.org/dc/terms/subject", "http://dbpedia.org/ontology/starring",
+         "http://dbpedia.org/ontology/director", "http://dbpedia.org/ontology/producer",
+         "http://dbpedia.org/ontology/writer", "http://dbpedia.org/ontology/musicComposer",
+         "http://dbpedia.org/ontology/cinematography", "http://dbpedia.org/ontology/editing",
+         "http://dbpedia.org/ontology/distributor"]
+# share of the property rows of a movie on each property of PROPS
+PROPS_WEIGHTS = [0.40, 0.25, 0.06, 0.07, 0.06, 0.04, 0.04, 0.04, 0.04]
+
+
+def _zipf_choice(rng: np.random.RandomState, n: int, size: int, exponent: float):
+    """
+    Function that draws positions with a zipf like popularity, position 0 being the most popular
+    :param rng: random state
+    :param n: number of positions
+    :param size: number of draws
+    :param exponent: exponent of the popularity, 0 for uniform draws
+    :return: array with the drawn positions
+    """
+    weights = 1 / np.arange(1, n + 1) ** exponent
+    return rng.choice(n, size, p=weights / weights.sum())
+
+
+def generate_movies_set(n_movies: int, seed: int = 0):
+    """
+    Function that generates a data set of movies with made up dbpedia uris
+    :param n_movies: number of movies
+    :param seed: seed of the generator
+    :return: data frame with the columns movie_id and dbpedia_uri
+    """
+    rng = np.random.RandomState(seed)
+    movies_id = np.sort(rng.choice(np.arange(1, 10 * n_movies + 1), n_movies, replace=False))
+    return pd.DataFrame({'movie_id': movies_id,
+                         'dbpedia_uri': ["http://dbpedia.org/resource/Movie_" + str(i) + "_(film)" for i in movies_id]})
+
+
+def generate_movie_props(movies_set: pd.DataFrame, props_per_movie: int = 20, n_objs: int = None,
+                         exponent: float = 1.0, seed: int = 0):
+    """
+    Function that generates dbpedia like properties, every movie has a foaf name and a poisson number of (prop, obj)
+    rows whose objects follow a zipf popularity, so few objects are shared by many movies and most by few
+    :param movies_set: data set of movies with columns movie id and movie dbpedia uri
+    :param props_per_movie: mean number of property rows of a movie
+    :param n_objs: number of distinct objects of each property, None for the number of movies
+    :param exponent: exponent of the popularity of the objects
+    :param seed: seed of the generator
+    :return: data frame with the columns movie_id, prop and obj
+    """
+    rng = np.random.RandomState(seed)
+    movies_id = movies_set['movie_id'].values
+    n_objs = len(movies_id) if n_objs is None else n_objs
+
+    counts = rng.poisson(props_per_movie, len(movies_id))
+    rows_movie = np.repeat(movies_id, counts)
+    rows_prop = rng.choice(len(PROPS), len(rows_movie), p=PROPS_WEIGHTS)
+    rows_obj = _zipf_choice(rng, n_objs, len(rows_movie), exponent)
+
+    # subjects are categories and the other objects are resources named after their property
+    prefixes = np.asarray(["http://dbpedia.org/resource/Category:Topic_"] +
+                          ["http://dbpedia.org/resource/" + prop.split("/")[-1] + "_" for prop in PROPS[1:]],
+                          dtype=object)
+    objs = pd.Series(prefixes[rows_prop]) + pd.Series(rows_obj).astype(str)
+
+    names = pd.DataFrame({'movie_id': movies_id, 'prop': "http://xmlns.com/foaf/0.1/name",
+                          'obj': ["Movie " + str(i) for i in movies_id]})
+    props = pd.DataFrame({'movie_id': rows_movie, 'prop': np.asarray(PROPS)[rows_prop], 'obj': objs.values})
+
+    return pd.concat([names, props]).sort_values('movie_id', kind='stable').reset_index(drop=True)
+
+
+def generate_interactions(movies_set: pd.DataFrame, n_users: int, interactions_per_user: int = 20,
+                          test_fraction: float = 0.2, exponent: float = 0.8, seed: int = 0):
+    """
+    Function that generates positive interactions of users with a zipf popularity of the movies, the sparsity of
+    the data set is interactions_per_user / number of movies
+    :param movies_set: data set of movies with columns movie id and movie dbpedia uri
+    :param n_users: number of users
+    :param interactions_per_user: mean number of interactions of a user, at least 2
+    :param test_fraction: fraction of the interactions of each user moved to the test set
+    :param exponent: exponent of the popularity of the movies
+    :param seed: seed of the generator
+    :return: tuple with the train and test data frames with the columns user_id, movie_id and interaction
+    """
+    rng = np.random.RandomState(seed)
+    movies_id = movies_set['movie_id'].values[rng.permutation(len(movies_set))]
+
+    counts = np.clip(rng.poisson(interactions_per_user, n_users), 2, len(movies_id))
+    users = np.repeat(np.arange(1, n_users + 1), counts)
+    movies = movies_id[_zipf_choice(rng, len(movies_id), len(users), exponent)]
+    interactions = pd.DataFrame({'user_id': users, 'movie_id': movies, 'interaction': 1})
+    interactions = interactions.drop_duplicates(['user_id', 'movie_id']).reset_index(drop=True)
+
+    # every user keeps at least one train interaction
+    test = (rng.rand(len(interactions)) < test_fraction) & interactions['user_id'].duplicated(keep='first').values
+
+    return interactions[~test].reset_index(drop=True), interactions[test].reset_index(drop=True)
+
+
+def generate_data_set(n_movies: int = 1000, n_users: int = 500, props_per_movie: int = 20,
+                      interactions_per_user: int = 20, test_fraction: float = 0.2, seed: int = 0):
+    """
+    Function that generates a whole synthetic data set, the same arguments always give the same data set
+    :param n_movies: number of movies
+    :param n_users: number of users
+    :param props_per_movie: mean number of property rows of a movie
+    :param interactions_per_user: mean number of interactions of a user
+    :param test_fraction: fraction of the interactions of each user moved to the test set
+    :param seed: seed of the generator
+    :return: tuple with the movies set, the properties of the movies, the train set and the test set
+    """
+    movies_set = generate_movies_set(n_movies, seed)
+    all_movie_props = generate_movie_props(movies_set, props_per_movie, seed=seed + 1)
+    train_set, test_set = generate_interactions(movies_set, n_users, interactions_per_user, test_fraction,
+                                                seed=seed + 2)
+
+    return movies_set, all_movie_props, train_set, test_set
+
+
+def write_data_set(directory: str, movies_set: pd.DataFrame, all_movie_props: pd.DataFrame,
+                   train_set: pd.DataFrame, test_set: pd.DataFrame):
+    """
+    Function that writes a data set with the files and layout read by main.py, so the recommenders run on it with
+    the similarity and properties flags set to 0
+    :param directory: directory that receives the facebook_movies and generated_files directories
+    :param movies_set: data set of movies with columns movie id and movie dbpedia uri
+    :param all_movie_props: properties of the movies with the columns movie_id, prop and obj
+    :param train_set: train interactions
+    :param test_set: test interactions
+    :return: files of the data set
+    """
+    os.makedirs(os.path.join(directory, "facebook_movies"), exist_ok=True)
+    os.makedirs(os.path.join(directory, "generated_files"), exist_ok=True)
+
+    movies_set.to_csv(os.path.join(directory, "facebook_movies", "mappingLinkedData.tsv"), sep="\t", header=False,
+                      index=False)
+    train_set.to_csv(os.path.join(directory, "facebook_movies", "trainingset.tsv"), sep="\t", header=False,
+                     index=False)
+    test_set.to_csv(os.path.join(directory, "facebook_movies", "testset.tsv"), sep="\t", header=False, index=False)
+    all_movie_props.to_csv(os.path.join(directory, "generated_files", "all_movie_props.csv"), header=False,
+                           index=False)
@@ -0,0 +1,125 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+# A class that holds the interactions of the users with the movies as a sparse matrix
+class UserItemMatrix:
+
+    def __init__(self, matrix: sparse.csr_matrix, users_id: list, movies_id: list):
+        """
+        Constructor of the class
+        :param matrix: users x movies csr matrix with 1 where the user interacted with the movie
+        :param users_id: user id of every row of the matrix
+        :param movies_id: sorted list of all movie id on data set, one per column of the matrix
+        """
+        self.matrix = sparse.csr_matrix(matrix, dtype=np.float32)
+        self.users_id = np.asarray(users_id)
+        self.movies_id = np.asarray(movies_id)
+        self.user_index = pd.Series(np.arange(len(self.users_id)), index=self.users_id)
+        self.movie_index = pd.Series(np.arange(len(self.movies_id)), index=self.movies_id)
+
+    @classmethod
+    def from_interactions(cls, interactions: pd.DataFrame, movies_id: list, users_id: list = None):
+        """
+        Function that builds the matrix from a data frame of interactions, interactions with movies that are not on
+        the data set are ignored
+        :param interactions: data frame with the columns user_id and movie_id
+        :param movies_id: sorted list of all movie id on data set
+        :param users_id: users that must have a row even without interactions, e.g. the users of the test set
+        :return: user item matrix of the interactions
+        """
+        users = pd.Index(users_id if users_id is not None else [])
+        users = users.append(pd.Index(interactions['user_id'].unique()).difference(users))
+
+        rows = users.get_indexer(interactions['user_id'].values)
+        cols = pd.Index(movies_id).get_indexer(interactions['movie_id'].values)
+        known = cols >= 0
+
+        matrix = sparse.csr_matrix((np.ones(known.sum(), dtype=np.float32), (rows[known], cols[known])),
+                                   shape=(len(users), len(movies_id)))
+        matrix.sum_duplicates()
+        matrix.data[:] = 1
+
+        return cls(matrix, users.values, movies_id)
+
+    @classmethod
+    def read(cls, file_path: str, movies_id: list, users_id: list = None):
+        """
+        Function that builds the matrix from a tsv file of interactions with the columns user id, movie id and
+        interaction
+        :param file_path: path of the tsv file
+        :param movies_id: sorted list of all movie id on data set
+        :param users_id: users that must have a row even without interactions, e.g. the users of the test set
+        :return: user item matrix of the file
+        """
+        interactions = pd.read_csv(file_path, header=None, sep="\t", usecols=[0, 1], names=['user_id', 'movie_id'])
+        return cls.from_interactions(interactions, movies_id, users_id)
+
+    @classmethod
+    def from_data_frame(cls, user_item: pd.DataFrame):
+        """
+        Function that converts the dense user x item data frame, with 1 where the user interacted with the movie
+        :param user_item: user x item data frame
+        :return: user item matrix of the data frame
+        """
+        return cls(sparse.csr_matrix(user_item.values == 1), user_item.index.values, user_item.columns.values)
+
+    def profile(self, user_id: int):
+        """
+        Function that returns the movies a user interacted with
+        :param user_id: user id
+        :return: array with the sorted movie ids of the profile of the user
+        """
+        row = self.user_index[user_id]
+        return self.movies_id[self.matrix.indices[self.matrix.indptr[row]:self.matrix.indptr[row + 1]]]
+
+    def profile_masks(self, users_id: list, movies_id: list = None):
+        """
+        Function that returns which movies each user interacted with
+        :param users_id: users to get the profiles
+        :param movies_id: order of the movies of the masks, None for the order of the matrix
+        :return: users x movies boolean array, true where the user interacted with the movie
+        """
+        masks = self.matrix[self.user_index[users_id].values].toarray() > 0
+        if movies_id is None or np.array_equal(movies_id, self.movies_id):
+            return masks
+
+        cols = self.movie_index.reindex(movies_id).values
+        known = ~np.isnan(cols)
+        reindexed = np.zeros((len(masks), len(movies_id)), dtype=bool)
+        reindexed[:, known] = masks[:, cols[known].astype(np.int64)]
+
+        return reindexed
+
+    def profile_positions(self, users_id: list, movies_id: list = None):
+        """
+        Function that returns the positions of the movies each user interacted with, without building the masks
+        :param users_id: users to get the profiles
+        :param movies_id: order of the movies of the positions, None for the order of the matrix
+        :return: list with a sorted array of positions per user, movies that are not on movies_id are left out
+        """
+        rows = self.user_index[users_id].values
+        cols = [self.matrix.indices[self.matrix.indptr[row]:self.matrix.indptr[row + 1]] for row in rows]
+        if movies_id is None or np.array_equal(movies_id, self.movies_id):
+            return cols
+
+        new_positions = pd.Index(movies_id).get_indexer(self.movies_id)
+        positions = [new_positions[row_cols] for row_cols in cols]
+        return [np.sort(row_positions[row_positions >= 0]) for row_positions in positions]
+
+    def item_matrix(self, movies_id: list):
+        """
+        Function that returns the interactions with the columns in the order of a list of movies
+        :param movies_id: order of the movies of the columns, movies that are not on the matrix get empty columns
+        :return: users x movies csr matrix with 1 where the user interacted with the movie
+        """
+        if np.array_equal(movies_id, self.movies_id):
+            return self.matrix
+
+        cols = self.movie_index.reindex(movies_id).values
+        known = np.flatnonzero(~np.isnan(cols))
+        selection = sparse.csr_matrix((np.ones(len(known), dtype=np.float32), (cols[known].astype(np.int64), known)),
+                                      shape=(len(self.movies_id), len(movies_id)))
+
+        return sparse.csr_matrix(self.matrix @ selection)